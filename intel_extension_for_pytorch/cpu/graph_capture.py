@@ -3,11 +3,17 @@ import torch
 from torch._dynamo.backends.common import fake_tensor_unsupported
 from torch.jit._trace import TracerWarning
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from enum import IntEnum
 from typing import List
 
 import functools
+import hashlib
+import json
 import logging
+import os
+import tempfile
 import threading
 import warnings
 
@@ -19,14 +25,250 @@ class RunMethods(IntEnum):
     EagerTrain = 4
 
 
+def _input_signature(value):
+    # Describe the structure, shapes and dtypes of the inputs, the traced graphs
+    # are specialized on them.
+    if isinstance(value, torch.Tensor):
+        return ("Tensor", tuple(value.shape), value.dtype, value.requires_grad)
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_input_signature(v) for v in value)
+    if isinstance(value, dict):
+        return ("dict",) + tuple(
+            (k, _input_signature(v)) for k, v in sorted(value.items())
+        )
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return (type(value).__name__, value)
+    return (type(value).__name__,)
+
+
+class _GraphEntry(object):
+    def __init__(self, method, model):
+        self.method = method
+        self.model = model
+        self.hits = 0
+
+
 class GraphCapture(object):
-    def __init__(self, model, train, dtype, weights_prepack):
+    def __init__(
+        self,
+        model,
+        train,
+        dtype,
+        weights_prepack,
+        max_graphs=16,
+        async_compile=False,
+        cache_dir=None,
+        cache_prefix=None,
+    ):
         self.model = copy.deepcopy(model)
         self.train = train
         self.dtype = dtype
         self.weights_prepack = weights_prepack
         self.method = None
         self.lock = threading.Lock()
+        # The graphs generated for each input signature, in the LRU order.
+        self.graphs = OrderedDict()
+        self.max_graphs = max_graphs
+        self.misses = 0
+        self.evictions = 0
+        self.dynamo_model = None
+        # With async_compile, the graphs are generated on a background thread
+        # while the inputs are run with the eager model.
+        self.async_compile = async_compile
+        self.executor = None
+        # input signature -> future of the graph generation in background
+        self.pending = {}
+        # With cache_dir, the generated graphs are stored in files named with
+        # cache_prefix, which identifies the model, and the input signature.
+        # They are loaded instead of being generated again in other processes.
+        self.cache_dir = cache_dir
+        self.cache_prefix = cache_prefix
+
+    def wait_compilation(self, timeout=None):
+        r"""
+        Wait for the graphs being generated in background to be ready, returns
+        whether all of them are ready in ``timeout`` seconds.
+        """
+        with self.lock:
+            futures = list(self.pending.values())
+        _, not_done = wait(futures, timeout=timeout)
+        return len(not_done) == 0
+
+    def stats(self):
+        r"""
+        Get the statistics of the graph cache: the number of generated graphs
+        (``misses``), evicted ones (``evictions``) and ones being generated in
+        background (``pending``), and the run method and the number of hits of
+        each input signature in the cache (``graphs``).
+        """
+        with self.lock:
+            return {
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pending": len(self.pending),
+                "graphs": [
+                    {"signature": sig, "method": e.method.name, "hits": e.hits}
+                    for sig, e in self.graphs.items()
+                ],
+            }
+
+    def _lookup(self, signature):
+        with self.lock:
+            entry = self.graphs.get(signature)
+            if entry is not None:
+                self.graphs.move_to_end(signature)
+                entry.hits += 1
+            return entry
+
+    def _insert(self, signature, entry):
+        # Should be called with self.lock held
+        self.graphs[signature] = entry
+        self.misses += 1
+        while len(self.graphs) > max(self.max_graphs, 1):
+            self.graphs.popitem(last=False)
+            self.evictions += 1
+
+    def _cache_path(self, signature):
+        if self.cache_dir is None:
+            return None
+        sig_hash = hashlib.sha256(repr(signature).encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{self.cache_prefix}_graph_{sig_hash}")
+
+    def _load_graph_method(self, signature):
+        # Returns the run method stored for the signature and the loaded JIT
+        # graph if the method is JIT.
+        path = self._cache_path(signature)
+        if path is None or not os.path.exists(path + ".json"):
+            return None, None
+        try:
+            with open(path + ".json") as f:
+                method = RunMethods[json.load(f)["method"]]
+            model = None
+            if method == RunMethods.JIT:
+                model = torch.jit.load(path + ".pt")
+            logging.debug(f"load the graph of {method.name} from {path}.")
+            return method, model
+        except Exception as e:
+            warnings.warn(f"Failed to load the cached graph from {path}: {e}")
+            return None, None
+
+    def _save_graph(self, signature, method, model):
+        path = self._cache_path(signature)
+        if path is None:
+            return
+
+        def atomic_write(dst, write):
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            os.close(fd)
+            try:
+                write(tmp_path)
+                os.replace(tmp_path, dst)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        def write_method(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump({"method": method.name}, f)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if method == RunMethods.JIT:
+                atomic_write(path + ".pt", lambda p: torch.jit.save(model, p))
+            # The method file is written at last, it marks the graph complete.
+            atomic_write(path + ".json", write_method)
+        except Exception as e:
+            warnings.warn(f"Failed to cache the graph to {path}: {e}")
+
+    def _generate_graph(self, compiler, signature, input, kwargs):
+        # Returns the run method, the model to run the inputs of the same
+        # signature with, and the output of the given inputs.
+        method, model = self._load_graph_method(signature)
+        if model is not None:
+            return method, model, model(*input, **kwargs)
+        method, model, output = self._generate_graph_by_method(
+            compiler, input, kwargs, method
+        )
+        self._save_graph(signature, method, model)
+        return method, model, output
+
+    def _generate_graph_by_method(self, compiler, input, kwargs, method=None):
+        # The methods known to fail for the signature, i.e. before the given
+        # method, are skipped.
+        if method == RunMethods.EagerInfer:
+            return RunMethods.EagerInfer, self.model, self.model(*input, **kwargs)
+        try:
+            if method == RunMethods.TorchDynamo:
+                raise RuntimeError("JIT trace is known to fail.")
+            # Try JIT trace.
+            # Tracing only records operations done when the given function is run on the given
+            # tensors. Therefore, the returned ScriptModule will always run the same traced graph
+            # on any input. This has some important implications when your module is expected
+            # to run different sets of operations, depending on the input and/or the module state.
+            # In cases like these, tracing would not be appropriate, and the tracer will try to
+            # emit warnings when doing something that may cause an incorrect trace to be produced.
+            # Therefore, we catch these warnings and treat them as errors, and let TorchDynamo
+            # handle such models appropriately.
+            with warnings.catch_warnings():
+                warnings.filterwarnings("error", category=TracerWarning)
+                traced_model = torch.jit.trace(self.model.eval(), input).eval()
+                traced_model = torch.jit.freeze(traced_model)
+                output = traced_model(*input, **kwargs)
+                logging.debug("generate graph by JIT trace.")
+                return RunMethods.JIT, traced_model, output
+        except BaseException:
+            try:
+                # JIT trace failed, try torchdynamo with JIT trace backend.
+                # The dynamo model is generated with dynamic shapes, so it is
+                # shared by all the input signatures.
+                dynamo_model = self.dynamo_model
+                if dynamo_model is None:
+                    torch._dynamo.reset()
+                    dynamo_model = torch._dynamo.optimize(compiler, dynamic=True)(
+                        self.model
+                    )
+                output = dynamo_model(*input, **kwargs)
+                self.dynamo_model = dynamo_model
+                logging.debug("generate graph by TorchDynamo.")
+                return RunMethods.TorchDynamo, dynamo_model, output
+            except BaseException:
+                warnings.warn(
+                    "Both JIT and TorchDynamo failed, fallback to original model."
+                )
+                if self.dynamo_model is None:
+                    torch._dynamo.reset()
+                return RunMethods.EagerInfer, self.model, self.model(*input, **kwargs)
+
+    def _generate_graph_async(self, compiler, signature, input, kwargs):
+        # Should be called with self.lock held. The inputs are copied since the
+        # caller may reuse their storages once the eager run returns.
+        input, kwargs = torch.utils._pytree.tree_map(
+            lambda x: x.detach().clone() if isinstance(x, torch.Tensor) else x,
+            (input, kwargs),
+        )
+
+        def generate():
+            try:
+                with torch.no_grad(), torch.cpu.amp.autocast(
+                    enabled=(self.dtype == torch.bfloat16 or self.dtype == torch.half),
+                    dtype=self.dtype,
+                ):
+                    method, model, _ = self._generate_graph(
+                        compiler, signature, input, kwargs
+                    )
+                # Swap in the graph, the later inputs of the signature run it.
+                with self.lock:
+                    self._insert(signature, _GraphEntry(method, model))
+                    self.method = method
+            finally:
+                with self.lock:
+                    self.pending.pop(signature, None)
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="ipex_graph_capture"
+            )
+        self.pending[signature] = self.executor.submit(generate)
 
     def __call__(self, func):
         @fake_tensor_unsupported
@@ -48,67 +290,38 @@ class GraphCapture(object):
                 enabled=(self.dtype == torch.bfloat16 or self.dtype == torch.half),
                 dtype=self.dtype,
             ):
-                if self.method:
-                    if self.train:
-                        return func(*input, **kwargs)
-                    else:
-                        return self.model(*input, **kwargs)
-                else:
-                    # Lock the graph generation process to avoid multiple threads generating graph simultaneously.
-                    with self.lock:
-                        if self.method:
-                            if self.train:
-                                return func(*input, **kwargs)
-                            else:
-                                return self.model(*input, **kwargs)
-                        if self.train:
-                            warnings.warn(
-                                "graph capture does not support training yet."
+                if self.train:
+                    if self.method is None:
+                        warnings.warn("graph capture does not support training yet.")
+                        self.method = RunMethods.EagerTrain
+                    return func(*input, **kwargs)
+                signature = (_input_signature(input), _input_signature(kwargs))
+                entry = self._lookup(signature)
+                if entry is not None:
+                    return entry.model(*input, **kwargs)
+                # Lock the graph generation process to avoid multiple threads generating graph simultaneously.
+                with self.lock:
+                    entry = self.graphs.get(signature)
+                    if entry is not None:
+                        entry.hits += 1
+                        return entry.model(*input, **kwargs)
+                    if self.async_compile:
+                        if signature not in self.pending:
+                            self._generate_graph_async(
+                                compiler, signature, input, kwargs
                             )
-                            self.method = RunMethods.EagerTrain
-                            return func(*input, **kwargs)
-                        else:
-                            try:
-                                # Try JIT trace.
-                                # Tracing only records operations done when the given function is run on the given
-                                # tensors. Therefore, the returned ScriptModule will always run the same traced graph
-                                # on any input. This has some important implications when your module is expected
-                                # to run different sets of operations, depending on the input and/or the module state.
-                                # In cases like these, tracing would not be appropriate, and the tracer will try to
-                                # emit warnings when doing something that may cause an incorrect trace to be produced.
-                                # Therefore, we catch these warnings and treat them as errors, and let TorchDynamo
-                                # handle such models appropriately.
-                                with warnings.catch_warnings():
-                                    warnings.filterwarnings(
-                                        "error", category=TracerWarning
-                                    )
-                                    traced_model = torch.jit.trace(
-                                        self.model.eval(), input
-                                    ).eval()
-                                    traced_model = torch.jit.freeze(traced_model)
-                                    output = traced_model(*input, **kwargs)
-                                    self.model = traced_model
-                                    self.method = RunMethods.JIT
-                                    logging.debug("generate graph by JIT trace.")
-                                    return output
-                            except BaseException:
-                                try:
-                                    # JIT trace failed, try torchdynamo with JIT trace backend.
-                                    torch._dynamo.reset()
-                                    dynamo_model = torch._dynamo.optimize(
-                                        compiler, dynamic=True
-                                    )(self.model)
-                                    output = dynamo_model(*input, **kwargs)
-                                    self.model = dynamo_model
-                                    self.method = RunMethods.TorchDynamo
-                                    logging.debug("generate graph by TorchDynamo.")
-                                    return output
-                                except BaseException:
-                                    warnings.warn(
-                                        "Both JIT and TorchDynamo failed, fallback to original model."
-                                    )
-                                    self.method = RunMethods.EagerInfer
-                                    torch._dynamo.reset()
-                                    return self.model(*input, **kwargs)
+                        run_eager = True
+                    else:
+                        run_eager = False
+                        method, model, output = self._generate_graph(
+                            compiler, signature, input, kwargs
+                        )
+                        self._insert(signature, _GraphEntry(method, model))
+                        self.method = method
+                # The eager run doesn't need to hold the lock.
+                if run_eager:
+                    return self.model(*input, **kwargs)
+                return output
 
+        forward.graph_capture = self
         return forward
@@ -2,4 +2,5 @@ from .cpu_info import CPUPoolList
 from .launcher_base import Launcher
 from .launcher_distributed import DistributedTrainingLauncher
 from .launcher_multi_instances import MultiInstancesLauncher
+from .instance_metrics import report_metrics
 from .launch import init_parser, run_main_with_args, ArgumentTypesDefaultsHelpFormatter
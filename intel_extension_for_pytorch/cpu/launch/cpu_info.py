@@ -1,8 +1,14 @@
+import glob
 import itertools
+import json
 import os
 import platform
 import re
 import subprocess
+import tempfile
+
+# Bump it whenever the layout of the topology snapshot file changes.
+_TOPOLOGY_SNAPSHOT_FORMAT = 1
 
 # lscpu Examples
 # # The following is the parsable format, which can be fed to other
@@ -63,6 +69,7 @@ class CoreInfo:
     - [bool] is a physical core or not
     - [float] maxmhz
     - [bool] is a performance core
+    - [dict] cache domain index of each cache level, e.g. {"l2": 0, "l3": 0}
     """
 
     def __init__(self, lscpu_txt="", headers=None):
@@ -75,6 +82,7 @@ class CoreInfo:
         self.is_physical_core = True
         self.maxmhz = 0
         self.is_p_core = True
+        self.cache = {}
         if lscpu_txt != "" and len(headers) > 0:
             self.parse_raw(lscpu_txt, headers)
 
@@ -89,6 +97,33 @@ class CoreInfo:
             self.socket = int(cols[headers["socket"]])
         if "maxmhz" in headers:
             self.maxmhz = float(cols[headers["maxmhz"]])
+        if "cache" in headers:
+            # e.g. l1d:l1i:l2:l3 0:0:0:0
+            ids = cols[headers["cache"]].split(":")
+            for name, idx in zip(headers["cache_names"], ids):
+                if idx.isdigit():
+                    self.cache[name] = int(idx)
+
+    def to_dict(self):
+        return {
+            "cpu": self.cpu,
+            "core": self.core,
+            "socket": self.socket,
+            "node": self.node,
+            "maxmhz": self.maxmhz,
+            "cache": self.cache,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        c = cls()
+        c.cpu = d["cpu"]
+        c.core = d["core"]
+        c.socket = d["socket"]
+        c.node = d["node"]
+        c.maxmhz = d["maxmhz"]
+        c.cache = dict(d["cache"])
+        return c
 
     def __str__(self):
         return f"{self.cpu}\t{self.core}\t{self.socket}\t{self.node}\t{self.is_physical_core}\t{self.maxmhz}\t{self.is_p_core}"
@@ -128,59 +163,181 @@ class CPUPool(list):
         return ret
 
 
+def _read_sysfs(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def _parse_cpu_list(txt):
+    # e.g. 0-3,8,10-11
+    cpus = []
+    for item in txt.split(","):
+        item = item.strip()
+        if item == "":
+            continue
+        if "-" in item:
+            start, end = item.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(item))
+    return cpus
+
+
+def read_sysfs_topology(sysfs_root="/sys"):
+    """
+    Read the topology of the online CPUs from sysfs, with the same indexing as
+    lscpu: the cores and the cache domains are numbered in the order they
+    first appear among the CPUs. Raise OSError or ValueError if sysfs doesn't
+    provide the topology.
+    """
+    cpu_root = os.path.join(sysfs_root, "devices/system/cpu")
+    node_root = os.path.join(sysfs_root, "devices/system/node")
+    cpus = _parse_cpu_list(_read_sysfs(os.path.join(cpu_root, "online")))
+    cpu_to_node = {}
+    for node_dir in glob.glob(os.path.join(node_root, "node[0-9]*")):
+        node = int(os.path.basename(node_dir)[len("node") :])
+        for cpu in _parse_cpu_list(_read_sysfs(os.path.join(node_dir, "cpulist"))):
+            cpu_to_node[cpu] = node
+    core_ids = {}
+    cache_ids = {}
+    cores = []
+    for cpu in sorted(cpus):
+        cpu_dir = os.path.join(cpu_root, f"cpu{cpu}")
+        topology_dir = os.path.join(cpu_dir, "topology")
+        c = CoreInfo()
+        c.cpu = cpu
+        c.socket = int(_read_sysfs(os.path.join(topology_dir, "physical_package_id")))
+        die_path = os.path.join(topology_dir, "die_id")
+        die = int(_read_sysfs(die_path)) if os.path.exists(die_path) else 0
+        # core_id is only unique in a package
+        core_id = int(_read_sysfs(os.path.join(topology_dir, "core_id")))
+        core_key = (c.socket, die, core_id)
+        c.core = core_ids.setdefault(core_key, len(core_ids))
+        # lscpu takes sockets as nodes without NUMA information
+        c.node = cpu_to_node.get(cpu, c.socket)
+        freq_path = os.path.join(cpu_dir, "cpufreq/cpuinfo_max_freq")
+        if os.path.exists(freq_path):
+            c.maxmhz = int(_read_sysfs(freq_path)) / 1000
+        for cache_dir in sorted(glob.glob(os.path.join(cpu_dir, "cache/index[0-9]*"))):
+            level = _read_sysfs(os.path.join(cache_dir, "level"))
+            cache_type = _read_sysfs(os.path.join(cache_dir, "type"))
+            name = f"l{level}" + {"Data": "d", "Instruction": "i"}.get(cache_type, "")
+            shared = _read_sysfs(os.path.join(cache_dir, "shared_cpu_list"))
+            ids = cache_ids.setdefault(name, {})
+            c.cache[name] = ids.setdefault(shared, len(ids))
+        cores.append(c)
+    return cores
+
+
+def _topology_fingerprint():
+    # The snapshot is valid in the same boot with the same online CPUs
+    fingerprint = {"online": _read_sysfs("/sys/devices/system/cpu/online")}
+    try:
+        fingerprint["boot_id"] = _read_sysfs("/proc/sys/kernel/random/boot_id")
+    except OSError:
+        pass
+    return fingerprint
+
+
+def _cgroup_dirs(cgroup_root, mount, path):
+    # The path in /proc/self/cgroup is relative to the root of the cgroup
+    # namespace, which is usually the mount point in a container. Check the
+    # cgroup and its ancestors, since the quota of any of them applies.
+    dirs = []
+    path = path.strip("/")
+    while True:
+        d = os.path.join(cgroup_root, mount, path)
+        if os.path.isdir(d):
+            dirs.append(d)
+        if path == "":
+            break
+        path = os.path.dirname(path)
+    return dirs
+
+
+def read_cgroup_cpu_quota(proc_root="/proc", cgroup_root="/sys/fs/cgroup"):
+    """
+    Get the number of CPUs the CFS quota of the cgroup v1 or v2 of the process
+    allows, e.g. 2.5 for a quota of 250ms per 100ms period. Return None if
+    there is no quota.
+    """
+    try:
+        with open(os.path.join(proc_root, "self/cgroup")) as f:
+            lines = f.read().strip().split("\n")
+    except OSError:
+        return None
+    quotas = []
+    for line in lines:
+        fields = line.split(":", 2)
+        if len(fields) != 3:
+            continue
+        _, controllers, path = fields
+        if controllers == "":
+            # cgroup v2, e.g. 0::/kubepods/pod1
+            for d in _cgroup_dirs(cgroup_root, "", path):
+                try:
+                    quota, period = _read_sysfs(os.path.join(d, "cpu.max")).split()
+                except (OSError, ValueError):
+                    continue
+                if quota != "max":
+                    quotas.append(int(quota) / int(period))
+        elif "cpu" in controllers.split(","):
+            # cgroup v1, e.g. 4:cpu,cpuacct:/kubepods/pod1
+            for mount in [controllers, "cpu,cpuacct", "cpu"]:
+                for d in _cgroup_dirs(cgroup_root, mount, path):
+                    try:
+                        quota = int(_read_sysfs(os.path.join(d, "cpu.cfs_quota_us")))
+                        period = int(_read_sysfs(os.path.join(d, "cpu.cfs_period_us")))
+                    except (OSError, ValueError):
+                        continue
+                    if quota > 0 and period > 0:
+                        quotas.append(quota / period)
+    return min(quotas) if len(quotas) > 0 else None
+
+
 class CPUPoolList:
     """
     Get a CPU pool with all available CPUs and CPU pools filtered with designated criterias.
     """
 
-    def __init__(self, logger=None, lscpu_txt=""):
+    def __init__(self, logger=None, lscpu_txt="", topology_file=None):
         self.pool_all = CPUPool()
         self.pools_ondemand = []
+        # Number of CPUs the cgroup CPU quota allows, None without quota
+        self.cpu_quota = None
 
         self.logger = logger
         if platform.system() == "Windows":
             raise RuntimeError("Windows platform is not supported!!!")
         elif platform.system() == "Linux":
-            """
-            Retrieve CPU information from lscpu.
-            """
             if lscpu_txt.strip() == "":
-                args = ["lscpu", "--all", "--extended"]
-                env_lang = os.getenv("LANG", "UNSET")
-                os.environ["LANG"] = "C"
-                lscpu_info = subprocess.check_output(
-                    args, env=os.environ, universal_newlines=True
-                )
-                if env_lang == "UNSET":
-                    del os.environ["LANG"]
-                else:
-                    os.environ["LANG"] = env_lang
+                """
+                Retrieve CPU information from the topology snapshot, sysfs or lscpu.
+                """
+                if topology_file is None:
+                    topology_file = os.environ.get("IPEX_CPU_TOPOLOGY_FILE", "")
+                cores = self.detect_topology(topology_file)
+                """
+                Only use the CPUs the process is allowed to run on, e.g. in a container
+                """
+                affinity = os.sched_getaffinity(0)
+                excluded = [c.cpu for c in cores if c.cpu not in affinity]
+                if len(excluded) > 0 and len(excluded) < len(cores):
+                    cores = [c for c in cores if c.cpu in affinity]
+                    self.verbose(
+                        "info",
+                        f"CPUs {excluded} are excluded since they are out of the affinity mask \
+                            (cpuset) of the process.",
+                    )
+                self.pool_all.extend(cores)
+                self.cpu_quota = read_cgroup_cpu_quota()
+                if self.cpu_quota is not None:
+                    self.verbose(
+                        "info",
+                        f"CPU quota of the cgroup allows {self.cpu_quota:g} CPUs.",
+                    )
             else:
-                lscpu_info = lscpu_txt
-
-            """
-            Filter out lines that are really useful.
-            """
-            lscpu_info = lscpu_info.strip().split("\n")
-            headers = {}
-            num_cols = 0
-            for line in lscpu_info:
-                line = re.sub(" +", " ", line.lower().strip())
-                if "cpu" in line and "socket" in line and "core" in line:
-                    t = line.split(" ")
-                    num_cols = len(t)
-                    for i in range(num_cols):
-                        if t[i] in ["cpu", "core", "socket", "node", "maxmhz"]:
-                            headers[t[i]] = i
-                else:
-                    t = line.split(" ")
-                    if (
-                        len(t) == num_cols
-                        and t[headers["cpu"]].isdigit()
-                        and t[headers["core"]].isdigit()
-                        and t[headers["socket"]].isdigit()
-                    ):
-                        self.pool_all.append(CoreInfo(t, headers))
+                self.pool_all.extend(self.parse_lscpu(lscpu_txt))
             assert len(self.pool_all) > 0, "cpuinfo is empty"
 
         # Determine logical cores
@@ -210,6 +367,104 @@ class CPUPoolList:
                     if c.maxmhz in e_core_mhzs:
                         c.is_p_core = False
 
+    def parse_lscpu(self, lscpu_info):
+        """
+        Filter out lines that are really useful.
+        """
+        cores = []
+        lscpu_info = lscpu_info.strip().split("\n")
+        headers = {}
+        num_cols = 0
+        for line in lscpu_info:
+            line = re.sub(" +", " ", line.lower().strip())
+            if "cpu" in line and "socket" in line and "core" in line:
+                t = line.split(" ")
+                num_cols = len(t)
+                for i in range(num_cols):
+                    if t[i] in ["cpu", "core", "socket", "node", "maxmhz"]:
+                        headers[t[i]] = i
+                    elif ":" in t[i]:
+                        headers["cache"] = i
+                        headers["cache_names"] = t[i].split(":")
+            else:
+                t = line.split(" ")
+                if (
+                    len(t) == num_cols
+                    and t[headers["cpu"]].isdigit()
+                    and t[headers["core"]].isdigit()
+                    and t[headers["socket"]].isdigit()
+                ):
+                    cores.append(CoreInfo(t, headers))
+        return cores
+
+    def run_lscpu(self):
+        # Run lscpu in the C locale without changing the environment of the
+        # launcher, which is inherited by the launched processes.
+        return subprocess.check_output(
+            ["lscpu", "--all", "--extended"],
+            env=dict(os.environ, LANG="C", LC_ALL="C"),
+            universal_newlines=True,
+        )
+
+    def detect_topology(self, topology_file=""):
+        """
+        Read the CPU topology from sysfs, or from lscpu if sysfs doesn't
+        provide it. With topology_file, the topology is cached in it and
+        loaded by the later launches in the same boot.
+        """
+        fingerprint = None
+        if topology_file:
+            try:
+                fingerprint = _topology_fingerprint()
+                with open(topology_file) as f:
+                    snapshot = json.load(f)
+                if (
+                    snapshot["format"] == _TOPOLOGY_SNAPSHOT_FORMAT
+                    and snapshot["fingerprint"] == fingerprint
+                ):
+                    return [CoreInfo.from_dict(d) for d in snapshot["cores"]]
+                self.verbose(
+                    "info", f"Topology snapshot {topology_file} is outdated, refresh it"
+                )
+            except (OSError, ValueError, KeyError):
+                pass
+        try:
+            cores = read_sysfs_topology()
+        except (OSError, ValueError) as e:
+            cores = []
+            self.verbose(
+                "warning",
+                f"Failed to read the CPU topology from sysfs ({e}), fallback to lscpu.",
+            )
+        if len(cores) == 0:
+            cores = self.parse_lscpu(self.run_lscpu())
+        if topology_file and fingerprint is not None and len(cores) > 0:
+            self.save_topology(topology_file, fingerprint, cores)
+        return cores
+
+    def save_topology(self, topology_file, fingerprint, cores):
+        snapshot = {
+            "format": _TOPOLOGY_SNAPSHOT_FORMAT,
+            "fingerprint": fingerprint,
+            "cores": [c.to_dict() for c in cores],
+        }
+        topology_dir = os.path.dirname(os.path.abspath(topology_file))
+        try:
+            os.makedirs(topology_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=topology_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(snapshot, f)
+                # Atomic rename, concurrent launches never see a partial file.
+                os.replace(tmp_path, topology_file)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except OSError as e:
+            self.verbose(
+                "warning", f"Failed to save the topology snapshot {topology_file}: {e}"
+            )
+
     def verbose(self, level, msg):
         if self.logger:
             logging_fn = {
@@ -235,6 +490,9 @@ class CPUPoolList:
     - skip_cross_node_cores [bool]: Allow instances to be executed on cores across NUMA nodes, False by default.
     - nodes_list [list]: A list containing all node ids that the execution is expected to be running on.
     - cores_list [list]: A list containing all cpu ids that the execution is expected to be running on.
+    - pack_cache_domains [bool]: Pack each instance into as few cache domains (cores sharing a L3 cache \
+        in a NUMA node, e.g. a sub-NUMA cluster or a CCX) as possible, False by default. It takes effect only \
+        when the cache domains of the cores are detected.
     - return_mode [str]: A string that defines how result values are formed, could be either of 'auto', \
         'list' and 'range'. When set to 'list', a string with comma-separated cpu ids, '0,1,2,3,...', is returned. \
         When set to 'range', a string with comma-separated cpu id ranges, '0-2,6-8,...', is returned. \
@@ -253,6 +511,7 @@ class CPUPoolList:
         nodes_list=None,
         cores_list=None,
         return_mode="auto",
+        pack_cache_domains=False,
     ):
         if nodes_list is None:
             nodes_list = []
@@ -311,6 +570,34 @@ class CPUPoolList:
                             You can enable them with argument --use-e-cores.",
                     )
 
+        # Fit the pool into the cgroup CPU quota, otherwise the instances are
+        # throttled with more threads than the CPU time they get.
+        if self.cpu_quota is not None:
+            ncores_quota = max(int(self.cpu_quota), 1)
+            if len(pool) > ncores_quota:
+                if len(cores_list) > 0 or ncores_per_instance * ninstances > 0:
+                    self.verbose(
+                        "warning",
+                        f"The designated cores exceed the CPU quota of the cgroup \
+                            ({self.cpu_quota:g} CPUs), the instances may be throttled.",
+                    )
+                else:
+                    if skip_cross_node_cores:
+                        nodes = sorted(set([c.node for c in pool]))
+                        ncores_per_node = max(ncores_quota // len(nodes), 1)
+                        pool_quota = []
+                        for n in nodes:
+                            cores = [c for c in pool if c.node == n]
+                            pool_quota.extend(cores[:ncores_per_node])
+                        pool = pool_quota
+                    else:
+                        pool = pool[:ncores_quota]
+                    self.verbose(
+                        "info",
+                        f"Number of cores is reduced to {len(pool)} to fit the CPU quota \
+                            of the cgroup ({self.cpu_quota:g} CPUs).",
+                    )
+
         # Determine ninstances and ncores_per_instance for grouping
         assert (
             ncores_per_instance >= 0
@@ -363,6 +650,16 @@ class CPUPoolList:
         # Split the aggregated pool into individual pools
         self.pools_ondemand.clear()
         pool.sort(key=lambda x: (x.core, 1 - int(x.is_physical_core)))
+        if pack_cache_domains:
+            if all(["l3" in c.cache for c in pool]):
+                self.pools_ondemand.extend(
+                    self.pack_pools(pool, ninstances, ncores_per_instance)
+                )
+                return
+            self.verbose(
+                "warning",
+                "Cache domains of the cores are not detected. Argument --pack-cache-domains is disabled.",
+            )
         for i in range(ninstances):
             # Generate individual raw pool
             pool_local = CPUPool()
@@ -371,6 +668,42 @@ class CPUPoolList:
             pool_local.sort(key=lambda x: x.cpu)
             self.pools_ondemand.append(pool_local)
 
+    def pack_pools(self, pool, ninstances, ncores_per_instance):
+        """
+        Split the pool into instances with as few cache domains in each instance as possible.
+        The cores in a domain are taken in the order of the pool, so a physical core and its
+        logical cores stay together.
+        """
+        domains = {}
+        for c in pool:
+            domains.setdefault((c.node, c.cache["l3"]), []).append(c)
+        pools = []
+        for i in range(ninstances):
+            # The domain with the least cores which can hold the whole instance,
+            # so the large domains are left for the other instances.
+            fits = [d for d in domains if len(domains[d]) >= ncores_per_instance]
+            if len(fits) > 0:
+                selected = [min(fits, key=lambda d: len(domains[d]))]
+            else:
+                selected = sorted(domains, key=lambda d: len(domains[d]), reverse=True)
+            pool_local = CPUPool()
+            for d in selected:
+                n = min(ncores_per_instance - len(pool_local), len(domains[d]))
+                pool_local.extend(domains[d][:n])
+                domains[d] = domains[d][n:]
+                if len(domains[d]) == 0:
+                    del domains[d]
+                if len(pool_local) == ncores_per_instance:
+                    break
+            ndomains = len(set([(c.node, c.cache["l3"]) for c in pool_local]))
+            if ndomains > 1:
+                self.verbose(
+                    "info", f"Instance {i} is placed across {ndomains} cache domains."
+                )
+            pool_local.sort(key=lambda x: x.cpu)
+            pools.append(pool_local)
+        return pools
+
 
 if __name__ == "__main__":
     lscpu_txt = """
@@ -0,0 +1,153 @@
+import json
+import math
+import os
+import threading
+import time
+
+"""
+Metrics of the instances started by the launcher with --report-metrics. Each instance appends one JSON object per
+line to the file in the environment variable IPEX_LAUNCHER_METRICS_FILE, with the optional fields:
+- latency_ms [float]: latency of a request in milliseconds.
+- samples [int]: number of the samples of the request, 1 by default when latency_ms is given.
+- throughput [float]: throughput measured by the instance itself, overrides the one computed by the launcher.
+The launcher adds up the metrics of all instances when they exit.
+"""
+
+METRICS_FILE_ENV = "IPEX_LAUNCHER_METRICS_FILE"
+PERCENTILES = [50, 90, 95, 99]
+
+_lock = threading.Lock()
+_file = None
+
+
+def report_metrics(latency_ms=None, samples=None, throughput=None):
+    """
+    Report the metrics of a request or of the instance to the launcher. It does nothing if the instance is not
+    started by the launcher with --report-metrics.
+    """
+    global _file
+    path = os.environ.get(METRICS_FILE_ENV, "")
+    if path == "":
+        return
+    record = {"time": time.time()}
+    if latency_ms is not None:
+        record["latency_ms"] = float(latency_ms)
+        record["samples"] = 1 if samples is None else int(samples)
+    elif samples is not None:
+        record["samples"] = int(samples)
+    if throughput is not None:
+        record["throughput"] = float(throughput)
+    with _lock:
+        if _file is None:
+            _file = open(path, "a", buffering=1)
+        _file.write(json.dumps(record) + "\n")
+
+
+def percentile(values, p):
+    """
+    Percentile with linear interpolation between the closest ranks. values should be sorted.
+    """
+    if len(values) == 0:
+        return None
+    k = (len(values) - 1) * p / 100
+    f = math.floor(k)
+    c = math.ceil(k)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    if len(latencies) == 0:
+        return None
+    summary = {
+        "count": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies),
+        "min_ms": latencies[0],
+        "max_ms": latencies[-1],
+    }
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = percentile(latencies, p)
+    return summary
+
+
+def read_metrics(path):
+    records = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # The last line may be incomplete if the instance is killed
+                    continue
+    except OSError:
+        pass
+    return records
+
+
+def instance_summary(records):
+    latencies = [r["latency_ms"] for r in records if "latency_ms" in r]
+    samples = sum([r.get("samples", 0) for r in records])
+    throughputs = [r["throughput"] for r in records if "throughput" in r]
+    throughput = None
+    if len(throughputs) > 0:
+        throughput = throughputs[-1]
+    else:
+        # The samples after the first record, over the time since it
+        timed = [r for r in records if "samples" in r]
+        if len(timed) > 1:
+            elapsed = timed[-1]["time"] - timed[0]["time"]
+            if elapsed > 0:
+                throughput = (samples - timed[0]["samples"]) / elapsed
+    return {
+        "samples": samples,
+        "throughput": throughput,
+        "latency": latency_summary(latencies),
+    }
+
+
+def summarize_metrics(instance_files):
+    """
+    Summarize the metrics files of the instances, by instance index.
+    """
+    instances = {}
+    latencies = []
+    for index, path in instance_files.items():
+        records = read_metrics(path)
+        instances[index] = instance_summary(records)
+        latencies.extend([r["latency_ms"] for r in records if "latency_ms" in r])
+    throughputs = [s["throughput"] for s in instances.values()]
+    return {
+        "ninstances": len(instances),
+        "samples": sum([s["samples"] for s in instances.values()]),
+        "throughput": sum([t for t in throughputs if t is not None])
+        if any([t is not None for t in throughputs])
+        else None,
+        "latency": latency_summary(latencies),
+        "instances": instances,
+    }
+
+
+def format_summary(summary):
+    def fmt_latency(latency):
+        if latency is None:
+            return "n/a"
+        return ", ".join(
+            [f"p{p} {latency[f'p{p}_ms']:.3f} ms" for p in PERCENTILES]
+            + [f"mean {latency['mean_ms']:.3f} ms"]
+        )
+
+    def fmt_throughput(throughput):
+        return "n/a" if throughput is None else f"{throughput:.3f} samples/s"
+
+    lines = [
+        f"Instances: {summary['ninstances']}, samples: {summary['samples']}, "
+        f"throughput: {fmt_throughput(summary['throughput'])}",
+        f"Latency: {fmt_latency(summary['latency'])}",
+    ]
+    for index, s in summary["instances"].items():
+        lines.append(
+            f"Instance {index}: samples: {s['samples']}, throughput: {fmt_throughput(s['throughput'])}, "
+            f"latency: {fmt_latency(s['latency'])}"
+        )
+    return lines
@@ -8,6 +8,7 @@ from datetime import datetime
 import intel_extension_for_pytorch.cpu.auto_ipex as auto_ipex
 from .launcher_distributed import DistributedTrainingLauncher
 from .launcher_multi_instances import MultiInstancesLauncher
+from .launcher_auto_tune import AutoTuner, add_auto_tune_params
 
 """
 This is a script for launching PyTorch training and inference on Intel Xeon CPU with optimal configurations.
@@ -105,6 +106,15 @@ rank 0: *(IP: 192.168.10.10, and has a free port: 29500)*
 
     >>> ipexrun --help
 
+*** Auto-tune ***
+
+Run a short benchmark phase over candidate numbers of cores per instance, memory allocators and OpenMP runtimes,
+then launch the run with the configuration of the highest throughput printed by the program.
+
+::
+
+   >>> ipexrun --auto-tune --auto-tune-program-args "--iterations 20" python_script args
+
 *** Memory allocator  ***
 
 Memory allocator plays an important role from performance perspective as well. A more efficient memory usage reduces
@@ -386,6 +396,7 @@ def init_parser(parser):
     launcher_multi_instances.add_params(parser)
     launcher_distributed.add_params(parser)
     auto_ipex.add_auto_ipex_params(parser)
+    add_auto_tune_params(parser)
     add_deprecated_params(parser)
 
     return parser
@@ -447,8 +458,27 @@ def run_main_with_args(args):
     launcher = None
     if args.nnodes > 0:
         launcher = launcher_distributed
+        if args.auto_tune:
+            logger.warning(
+                "Argument --auto-tune doesn't take effect on distributed training."
+            )
     else:
         launcher = launcher_multi_instances
+        if args.auto_tune:
+            if (
+                args.ninstances > 0
+                or args.ncores_per_instance > 0
+                or args.latency_mode
+                or args.throughput_mode
+                or args.memory_allocator != "auto"
+                or args.omp_runtime != "auto"
+            ):
+                logger.warning(
+                    "--auto-tune overrides --ninstances, --ncores-per-instance, --latency-mode, \
+                        --throughput-mode, --memory-allocator and --omp-runtime. They won't take effect even if \
+                        they are set explicitly."
+                )
+            AutoTuner(launcher, logger).tune(args)
 
     launcher.launch(args)
     for x in sorted(set(os.environ.keys()) - env_before):
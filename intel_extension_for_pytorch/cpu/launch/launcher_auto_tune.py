@@ -0,0 +1,306 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+from os.path import expanduser
+
+"""
+Benchmark phase of `ipexrun --auto-tune`. The program is run with each candidate configuration for a short time, a
+throughput metric is parsed from its output, and the best configuration is used for the production run.
+"""
+
+
+def add_auto_tune_params(parser):
+    group = parser.add_argument_group("Auto-Tune Parameters")
+    group.add_argument(
+        "--auto-tune",
+        "--auto_tune",
+        action="store_true",
+        default=False,
+        help="Run a benchmark phase over candidate numbers of cores per instance, memory allocators and OpenMP \
+            runtimes before the run, and launch the run with the one of the highest throughput. It overrides \
+            --ninstances, --ncores-per-instance, --memory-allocator and --omp-runtime.",
+    )
+    group.add_argument(
+        "--auto-tune-metric",
+        "--auto_tune_metric",
+        default=r"throughput\D*?([0-9]+(?:\.[0-9]+)?)",
+        type=str,
+        help="Regular expression (case insensitive) to parse the throughput from the output of the program. \
+            The first group is the value. The last value printed by each instance is summed up.",
+    )
+    group.add_argument(
+        "--auto-tune-program-args",
+        "--auto_tune_program_args",
+        default=None,
+        type=str,
+        help="Arguments of the program in the benchmark phase, e.g. fewer iterations. By default the arguments \
+            of the run are used.",
+    )
+    group.add_argument(
+        "--auto-tune-timeout",
+        "--auto_tune_timeout",
+        default=600,
+        type=float,
+        help="Timeout in seconds of each benchmark run.",
+    )
+    group.add_argument(
+        "--auto-tune-file",
+        "--auto_tune_file",
+        default=f'{expanduser("~")}/.cache/ipex/ipexrun_auto_tune.json',
+        type=str,
+        help="File to save the tuned configurations in. A saved configuration of the same program, arguments and \
+            cores is reused without the benchmark phase. Setting it to empty disables saving.",
+    )
+    group.add_argument(
+        "--auto-tune-refresh",
+        "--auto_tune_refresh",
+        action="store_true",
+        default=False,
+        help="Run the benchmark phase even if a tuned configuration is saved.",
+    )
+
+
+def gen_candidate_ncores(ncores, nnodes):
+    """
+    Candidate numbers of cores per instance: powers of 2, the number of cores per node and all cores.
+    """
+    candidates = set([ncores, max(ncores // nnodes, 1)])
+    c = 1
+    while c < ncores:
+        candidates.add(c)
+        c *= 2
+    return sorted(candidates)
+
+
+def parse_metric(output, pattern, ninstances):
+    """
+    Sum up the last value printed by each instance. Return None if not all instances print it.
+    """
+    values = [float(m.group(1)) for m in re.finditer(pattern, output, re.IGNORECASE)]
+    if len(values) < ninstances:
+        return None
+    return sum(values[-ninstances:])
+
+
+class AutoTuner:
+    def __init__(self, launcher, logger=None):
+        self.launcher = launcher
+        self.logger = logger
+
+    def verbose(self, level, msg):
+        self.launcher.verbose(level, msg)
+
+    def launcher_args(self, args, config):
+        cmd = [
+            "--ninstances",
+            str(config["ninstances"]),
+            "--ncores-per-instance",
+            str(config["ncores_per_instance"]),
+            "--memory-allocator",
+            config["memory_allocator"],
+            "--omp-runtime",
+            config["omp_runtime"],
+            "--multi-task-manager",
+            args.multi_task_manager,
+            "--memory-profile",
+            args.memory_profile,
+        ]
+        if args.nodes_list != "":
+            cmd.extend(["--nodes-list", args.nodes_list])
+        if args.cores_list != "":
+            cmd.extend(["--cores-list", args.cores_list])
+        for flag in [
+            "use_logical_cores",
+            "use_e_cores",
+            "pack_cache_domains",
+            "benchmark",
+            "module",
+            "no_python",
+        ]:
+            if getattr(args, flag):
+                cmd.append(f'--{flag.replace("_", "-")}')
+        if args.auto_ipex:
+            cmd.extend(["--auto-ipex", "--dtype", args.dtype])
+            if args.disable_ipex_graph_mode:
+                cmd.append("--disable-ipex-graph-mode")
+        return cmd
+
+    def run_trial(self, args, config):
+        program_args = (
+            shlex.split(args.auto_tune_program_args)
+            if args.auto_tune_program_args is not None
+            else args.program_args
+        )
+        cmd = [sys.executable, "-m", "intel_extension_for_pytorch.cpu.launch"]
+        cmd.extend(self.launcher_args(args, config))
+        cmd.append(args.program)
+        cmd.extend(program_args)
+        self.verbose("info", f"auto-tune: run {config}")
+        # In a new session, so the instances are killed together on timeout
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            start_new_session=True,
+        )
+        try:
+            stdout, stderr = process.communicate(timeout=args.auto_tune_timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            self.verbose(
+                "warning",
+                f"auto-tune: {config} timed out after {args.auto_tune_timeout} seconds.",
+            )
+            return None
+        if process.returncode != 0:
+            self.verbose(
+                "warning",
+                f"auto-tune: {config} failed with return code {process.returncode}: {stderr[-1000:]}",
+            )
+            return None
+        metric = parse_metric(stdout, args.auto_tune_metric, config["ninstances"])
+        if metric is None:
+            self.verbose(
+                "warning",
+                f"auto-tune: throughput of {config} is not found in the output with '{args.auto_tune_metric}'.",
+            )
+        else:
+            self.verbose("info", f"auto-tune: throughput of {config} is {metric}")
+        return metric
+
+    def config_key(self, args, ncores):
+        key = {
+            "program": os.path.abspath(args.program),
+            "program_args": args.program_args,
+            "auto_tune_program_args": args.auto_tune_program_args,
+            "nodes_list": args.nodes_list,
+            "cores_list": args.cores_list,
+            "use_logical_cores": args.use_logical_cores,
+            "use_e_cores": args.use_e_cores,
+            "module": args.module,
+            "no_python": args.no_python,
+            "memory_profile": args.memory_profile,
+            "memory_allocator": args.memory_allocator,
+            "omp_runtime": args.omp_runtime,
+            "multi_task_manager": args.multi_task_manager,
+            "pack_cache_domains": args.pack_cache_domains,
+            "ncores": ncores,
+            "ncpus": len(self.launcher.cpuinfo.pool_all),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def load(self, path, key):
+        try:
+            with open(path) as f:
+                return json.load(f).get(key, None)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, path, key, decision):
+        try:
+            with open(path) as f:
+                decisions = json.load(f)
+        except (OSError, ValueError):
+            decisions = {}
+        decisions[key] = decision
+        try:
+            path_dir = os.path.dirname(os.path.abspath(path))
+            os.makedirs(path_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(decisions, f, indent=2)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.verbose("info", f"auto-tune: configuration is saved in {path}")
+        except OSError as e:
+            self.verbose("warning", f"auto-tune: failed to save {path}: {e}")
+
+    def tune(self, args):
+        """
+        Tune the number of cores per instance first, then the memory allocator and the OpenMP runtime with it.
+        The best configuration is set to args.
+        """
+        cpuinfo = self.launcher.cpuinfo
+        cpuinfo.gen_pools_ondemand(
+            ninstances=1,
+            use_logical_cores=args.use_logical_cores,
+            use_e_cores=args.use_e_cores,
+            nodes_list=self.launcher.parse_list_argument(args.nodes_list),
+            cores_list=self.launcher.parse_list_argument(args.cores_list),
+        )
+        pool = cpuinfo.pools_ondemand[0]
+        ncores = len(pool)
+        nnodes = len(set([c.node for c in pool]))
+        key = self.config_key(args, ncores)
+
+        decision = None
+        if args.auto_tune_file and not args.auto_tune_refresh:
+            decision = self.load(args.auto_tune_file, key)
+            if decision is not None:
+                self.verbose(
+                    "info",
+                    f"auto-tune: reuse the configuration saved in {args.auto_tune_file}.",
+                )
+        if decision is None:
+            trials = []
+
+            def run(config):
+                metric = self.run_trial(args, config)
+                trials.append({"config": config, "throughput": metric})
+                return metric
+
+            best = None
+            best_metric = None
+            for c in gen_candidate_ncores(ncores, nnodes):
+                config = {
+                    "ninstances": ncores // c,
+                    "ncores_per_instance": c,
+                    "memory_allocator": args.memory_allocator,
+                    "omp_runtime": args.omp_runtime,
+                }
+                metric = run(config)
+                if metric is not None and (best_metric is None or metric > best_metric):
+                    best, best_metric = config, metric
+            if best is None:
+                raise RuntimeError(
+                    "auto-tune: throughput is not found with any configuration. Please check the output of the \
+                        program and --auto-tune-metric."
+                )
+            for name, choices in [
+                ("memory_allocator", self.launcher.ma_supported[1:]),
+                ("omp_runtime", self.launcher.omp_supported[1:]),
+            ]:
+                for choice in choices:
+                    if choice == best[name]:
+                        continue
+                    config = dict(best, **{name: choice})
+                    metric = run(config)
+                    if metric is not None and metric > best_metric:
+                        best, best_metric = config, metric
+            decision = {"config": best, "throughput": best_metric, "trials": trials}
+            if args.auto_tune_file:
+                self.save(args.auto_tune_file, key, decision)
+
+        config = decision["config"]
+        self.verbose(
+            "info",
+            f'auto-tune: use {config} with throughput {decision["throughput"]}',
+        )
+        args.ninstances = config["ninstances"]
+        args.ncores_per_instance = config["ncores_per_instance"]
+        args.memory_allocator = config["memory_allocator"]
+        args.omp_runtime = config["omp_runtime"]
+        args.latency_mode = False
+        args.throughput_mode = False
+        return decision
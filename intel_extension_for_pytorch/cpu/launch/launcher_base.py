@@ -1,9 +1,87 @@
 import os
+import re
 from os.path import expanduser
 import glob
 from .cpu_info import CPUPoolList
 
 
+"""
+Memory profiles. Each profile has
+- allocators: The order to search the memory allocators in when --memory-allocator is auto.
+- thp: The transparent huge page mode the profile expects, "always" or "never".
+- jemalloc: MALLOC_CONF of JeMalloc. {narenas} is replaced with the number of cores per instance.
+- tcmalloc: Environment variables of TCMalloc.
+- default: Environment variables of the glibc allocator. {narenas} is replaced with the number of cores per instance.
+"""
+MEMORY_PROFILES = {
+    # Keep the freed memory and the huge pages, so the requests don't pay for page faults and returning memory
+    "latency": {
+        "allocators": ["jemalloc", "tcmalloc"],
+        "thp": "always",
+        "jemalloc": "oversize_threshold:1,background_thread:true,thp:always,metadata_thp:always,"
+        "dirty_decay_ms:-1,muzzy_decay_ms:-1,narenas:{narenas}",
+        "tcmalloc": {
+            "TCMALLOC_RELEASE_RATE": "0",
+            "TCMALLOC_MAX_TOTAL_THREAD_CACHE_BYTES": str(1 << 30),
+        },
+        "default": {
+            "MALLOC_ARENA_MAX": "{narenas}",
+            "MALLOC_MMAP_THRESHOLD_": str(32 << 20),
+            "MALLOC_TRIM_THRESHOLD_": str(1 << 30),
+            "GLIBC_TUNABLES": "glibc.malloc.hugetlb=1",
+        },
+    },
+    # Return the freed memory lazily in the background
+    "throughput": {
+        "allocators": ["tcmalloc", "jemalloc"],
+        "thp": "always",
+        "jemalloc": "oversize_threshold:1,background_thread:true,metadata_thp:auto,"
+        "dirty_decay_ms:10000,muzzy_decay_ms:10000,narenas:{narenas}",
+        "tcmalloc": {
+            "TCMALLOC_RELEASE_RATE": "1",
+            "TCMALLOC_MAX_TOTAL_THREAD_CACHE_BYTES": str(256 << 20),
+        },
+        "default": {
+            "MALLOC_ARENA_MAX": "{narenas}",
+            "MALLOC_MMAP_THRESHOLD_": str(32 << 20),
+            "MALLOC_TRIM_THRESHOLD_": str(256 << 20),
+            "GLIBC_TUNABLES": "glibc.malloc.hugetlb=1",
+        },
+    },
+    # Return the freed memory soon and avoid huge pages, for memory bound deployments
+    "low-memory": {
+        "allocators": ["jemalloc", "tcmalloc"],
+        "thp": "never",
+        "jemalloc": "background_thread:true,thp:never,metadata_thp:disabled,"
+        "dirty_decay_ms:1000,muzzy_decay_ms:0,narenas:{narenas}",
+        "tcmalloc": {
+            "TCMALLOC_RELEASE_RATE": "10",
+            "TCMALLOC_AGGRESSIVE_DECOMMIT": "true",
+            "TCMALLOC_MAX_TOTAL_THREAD_CACHE_BYTES": str(32 << 20),
+        },
+        "default": {
+            "MALLOC_ARENA_MAX": "2",
+            "MALLOC_TRIM_THRESHOLD_": str(16 << 20),
+        },
+    },
+}
+
+
+def read_thp_mode(sysfs_root="/sys"):
+    """
+    Get the system transparent huge page mode (always, madvise or never), None if it is unavailable.
+    """
+    try:
+        with open(
+            os.path.join(sysfs_root, "kernel/mm/transparent_hugepage/enabled")
+        ) as f:
+            # e.g. always [madvise] never
+            m = re.search(r"\[(\w+)\]", f.read())
+            return m.group(1) if m else None
+    except OSError:
+        return None
+
+
 class Launcher:
     """
     Base class for launcher
@@ -29,6 +107,7 @@ class Launcher:
         )
         self.ma_supported = ["auto", "default", "tcmalloc", "jemalloc"]
         self.omp_supported = ["auto", "default", "intel"]
+        self.mp_supported = ["none"] + list(MEMORY_PROFILES.keys())
         self.environ_set = {}
         self.ld_preload = (
             os.environ["LD_PRELOAD"].split(":") if "LD_PRELOAD" in os.environ else []
@@ -74,6 +153,15 @@ class Launcher:
             choices=self.omp_supported,
             help=f"Choose which OpenMP runtime to run the workloads with. Supported choices are {self.omp_supported}.",
         )
+        group.add_argument(
+            "--memory-profile",
+            "--memory_profile",
+            default="none",
+            type=str,
+            choices=self.mp_supported,
+            help=f"Choose which memory profile to configure the memory allocator, its arenas and decay, and the \
+                transparent huge pages with. Supported choices are {self.mp_supported}.",
+        )
 
     def verbose(self, level, msg):
         if self.logger:
@@ -237,12 +325,19 @@ class Launcher:
         return name_local
 
     def set_memory_allocator(
-        self, memory_allocator="auto", benchmark=False, skip_list=None
+        self,
+        memory_allocator="auto",
+        benchmark=False,
+        skip_list=None,
+        memory_profile="none",
+        ncores_per_instance=0,
     ):
         """
         Enable TCMalloc/JeMalloc with LD_PRELOAD and set configuration for JeMalloc.
         By default, PTMalloc will be used for PyTorch, but TCMalloc and JeMalloc can get better
         memory resue and reduce page fault to improve performance.
+        With a memory profile, the allocator is searched in the order of the profile, and its arenas, decay and
+        transparent huge page settings are set by the profile.
         """
         if skip_list is None:
             skip_list = []
@@ -250,16 +345,28 @@ class Launcher:
             "jemalloc": ["jemalloc", "conda install -c conda-forge jemalloc"],
             "tcmalloc": ["tcmalloc", "conda install -c conda-forge gperftools"],
         }
+        profile = MEMORY_PROFILES.get(memory_profile, None)
+        if memory_profile != "none" and profile is None:
+            self.verbose(
+                "warning",
+                f"Designated memory profile '{memory_profile}' is unknown. Supported memory profiles are \
+                    {self.mp_supported}.",
+            )
+        supported = self.ma_supported
+        if profile is not None:
+            supported = self.ma_supported[:2] + profile["allocators"]
         ma_local = self.set_lib_bin_from_list(
             memory_allocator,
             ma_lib_name,
             "memory allocator",
-            self.ma_supported,
+            supported,
             self.add_lib_preload,
             skip_list=skip_list,
             extra_warning_msg_with_default_choice="This may drop the performance.",
         )
-        if ma_local == "jemalloc":
+        if profile is not None:
+            self.set_memory_profile(memory_profile, ma_local, ncores_per_instance)
+        elif ma_local == "jemalloc":
             if benchmark:
                 self.add_env(
                     "MALLOC_CONF",
@@ -272,6 +379,58 @@ class Launcher:
                 )
         return ma_local
 
+    def set_memory_profile(
+        self, memory_profile, memory_allocator, ncores_per_instance=0
+    ):
+        """
+        Set the environment variables of the memory profile for the memory allocator, and log the effective settings.
+        The number of arenas is the number of cores per instance, so each OpenMP thread allocates in its own arena.
+        """
+        profile = MEMORY_PROFILES[memory_profile]
+        narenas = ncores_per_instance
+        if narenas <= 0:
+            narenas = len([c for c in self.cpuinfo.pool_all if c.is_physical_core])
+        if memory_allocator == "jemalloc":
+            envs = {"MALLOC_CONF": profile["jemalloc"]}
+        else:
+            envs = profile[memory_allocator]
+        envs = {k: v.format(narenas=narenas) for k, v in envs.items()}
+        for k, v in envs.items():
+            self.add_env(k, v)
+
+        thp = read_thp_mode()
+        if thp is None:
+            thp_msg = "unavailable"
+        else:
+            thp_msg = f"system mode '{thp}', profile expects '{profile['thp']}'"
+            if profile["thp"] == "always" and thp == "never":
+                self.verbose(
+                    "warning",
+                    "Transparent huge pages are disabled in the system. The memory profile can't use them. \
+                        You can enable them with 'echo madvise > /sys/kernel/mm/transparent_hugepage/enabled'.",
+                )
+            elif profile["thp"] == "never" and thp == "always":
+                if memory_allocator == "jemalloc":
+                    thp_msg += ", opted out with MADV_NOHUGEPAGE by JeMalloc"
+                else:
+                    self.verbose(
+                        "warning",
+                        "Transparent huge pages are always enabled in the system, which may increase the memory \
+                            footprint. Consider the jemalloc memory allocator or \
+                            'echo madvise > /sys/kernel/mm/transparent_hugepage/enabled'.",
+                    )
+
+        self.verbose("info", f"Memory profile '{memory_profile}':")
+        self.verbose("info", f"  memory allocator: {memory_allocator}")
+        preload = [
+            item for item in self.ld_preload if item.endswith(f"lib{memory_allocator}.so")
+        ]
+        if len(preload) > 0:
+            self.verbose("info", f"  LD_PRELOAD: {preload[0]}")
+        for k in envs:
+            self.verbose("info", f"  {k}={self.environ_set[k]}")
+        self.verbose("info", f"  transparent huge pages: {thp_msg}")
+
     def set_omp_runtime(self, omp_runtime="auto", set_kmp_affinity=True):
         """
         Set OpenMP runtime
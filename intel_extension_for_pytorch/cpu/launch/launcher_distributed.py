@@ -216,7 +216,15 @@ class DistributedTrainingLauncher(Launcher):
             nodes_list=nodes_list,
         )
 
-        self.set_memory_allocator(args.memory_allocator, False, ["jemalloc"])
+        self.set_memory_allocator(
+            args.memory_allocator,
+            False,
+            ["jemalloc"],
+            memory_profile=args.memory_profile,
+            ncores_per_instance=len(
+                [c for c in self.cpuinfo.pools_ondemand[0] if c.is_physical_core]
+            ),
+        )
         self.set_omp_runtime(args.omp_runtime, True)
         omp_num_threads = len(
             [c for c in self.cpuinfo.pools_ondemand[0] if c.is_physical_core]
@@ -1,8 +1,13 @@
 import sys
 import subprocess
 import os
+import json
+import shutil
+import tempfile
 import intel_extension_for_pytorch.cpu.auto_ipex as auto_ipex
 from .launcher_base import Launcher
+from .instance_metrics import METRICS_FILE_ENV, summarize_metrics, format_summary
+from .supervisor import InstanceSupervisor
 
 
 class MultiInstancesLauncher(Launcher):
@@ -45,6 +50,14 @@ class MultiInstancesLauncher(Launcher):
             default=False,
             help="Allow instances to be executed on cores across NUMA nodes.",
         )
+        group.add_argument(
+            "--pack-cache-domains",
+            "--pack_cache_domains",
+            action="store_true",
+            default=False,
+            help="Pack each instance into as few cache domains (cores sharing a L3 cache in a NUMA node, \
+                e.g. a sub-NUMA cluster or a CCX) as possible.",
+        )
         group.add_argument(
             "--multi-task-manager",
             "--multi_task_manager",
@@ -77,6 +90,67 @@ class MultiInstancesLauncher(Launcher):
                 "core_id,core_id,..." or list of core ranges "core_id-core_id,...". \
                 By default all cores will be used.',
         )
+        group.add_argument(
+            "--report-metrics",
+            "--report_metrics",
+            action="store_true",
+            default=False,
+            help="Collect the metrics the instances report with \
+                intel_extension_for_pytorch.cpu.launch.report_metrics, and print the aggregated throughput and \
+                latency percentiles when the instances exit.",
+        )
+        group.add_argument(
+            "--report-file",
+            "--report_file",
+            default="",
+            type=str,
+            help="JSON file to write the metrics summary of --report-metrics in. By default it is \
+                <prefix>_summary.json in --log-dir if --log-dir is set.",
+        )
+        group.add_argument(
+            "--supervise",
+            action="store_true",
+            default=False,
+            help="Keep the instances running for serving. A crashed instance is restarted on the same cores after \
+                a backoff. SIGTERM and SIGINT are forwarded to the instances to drain them.",
+        )
+        group.add_argument(
+            "--max-restarts",
+            "--max_restarts",
+            default=-1,
+            type=int,
+            help="Max number of restarts of each instance with --supervise. -1 means unlimited.",
+        )
+        group.add_argument(
+            "--restart-backoff",
+            "--restart_backoff",
+            default=1.0,
+            type=float,
+            help="Seconds to wait before restarting a crashed instance with --supervise. It doubles on each crash \
+                in a row.",
+        )
+        group.add_argument(
+            "--max-restart-backoff",
+            "--max_restart_backoff",
+            default=60.0,
+            type=float,
+            help="Max seconds to wait before restarting a crashed instance with --supervise.",
+        )
+        group.add_argument(
+            "--drain-timeout",
+            "--drain_timeout",
+            default=30.0,
+            type=float,
+            help="Seconds to wait for the instances to exit after SIGTERM with --supervise, before killing them.",
+        )
+        group.add_argument(
+            "--health-file",
+            "--health_file",
+            default="",
+            type=str,
+            help="JSON file to write the health of the instances in with --supervise: the state, the pid, \
+                the number of restarts and the last exit code of each instance.",
+        )
         group.add_argument(
             "--benchmark",
             action="store_true",
@@ -123,7 +197,7 @@ class MultiInstancesLauncher(Launcher):
         return tm_local
 
     def execution_command_builder(
-        self, args, omp_runtime, task_mgr, environ, cpu_pools, index
+        self, args, omp_runtime, task_mgr, environ, cpu_pools, index, new_session=False
     ):
         assert index > -1 and index <= len(
             cpu_pools
@@ -167,15 +241,28 @@ class MultiInstancesLauncher(Launcher):
         log_name = os.path.join(args.log_dir, log_name)
         cmd.extend(args.program_args)
         cmd_s = " ".join(cmd)
+        executable = None
         if args.log_dir:
-            cmd_s = f"{cmd_s} 2>&1 | tee {log_name}"
+            # Append to the log of the instance when it is restarted
+            tee = "tee -a" if new_session else "tee"
+            cmd_s = f"{cmd_s} 2>&1 | {tee} {log_name}"
+            if new_session:
+                # The supervisor needs the exit code of the program rather than the one of tee
+                cmd_s = f"set -o pipefail; {cmd_s}"
+                executable = "/bin/bash"
         self.verbose("info", f"cmd: {cmd_s}")
         if len(set([c.node for c in pool])) > 1:
             self.verbose(
                 "warning",
                 f"Cross NUMA nodes execution detected: cores [{cores_list_local}] are on different NUMA nodes [{nodes_list_local}]",
             )
-        process = subprocess.Popen(cmd_s, env=environ_local, shell=True)
+        process = subprocess.Popen(
+            cmd_s,
+            env=environ_local,
+            shell=True,
+            executable=executable,
+            start_new_session=new_session,
+        )
         return {"process": process, "cmd": cmd_s}
 
     def launch(self, args):
@@ -225,6 +312,7 @@ class MultiInstancesLauncher(Launcher):
             skip_cross_node_cores=args.skip_cross_node_cores,
             nodes_list=nodes_list,
             cores_list=cores_list,
+            pack_cache_domains=args.pack_cache_domains,
         )
         args.ninstances = len(self.cpuinfo.pools_ondemand)
         args.ncores_per_instance = len(self.cpuinfo.pools_ondemand[0])
@@ -246,7 +334,18 @@ class MultiInstancesLauncher(Launcher):
             ), 'Environment variable "KMP_AFFINITY" is detected. Please unset it when using all cores.'
             set_kmp_affinity = False
 
-        self.set_memory_allocator(args.memory_allocator, args.benchmark)
+        if args.benchmark and args.memory_profile != "none":
+            self.verbose(
+                "warning",
+                f"Argument --benchmark won't take effect when --memory-profile is set. The configuration of the \
+                    '{args.memory_profile}' memory profile is used.",
+            )
+        self.set_memory_allocator(
+            args.memory_allocator,
+            args.benchmark,
+            memory_profile=args.memory_profile,
+            ncores_per_instance=args.ncores_per_instance,
+        )
         omp_runtime = self.set_omp_runtime(args.omp_runtime, set_kmp_affinity)
         self.add_env("OMP_NUM_THREADS", str(args.ncores_per_instance))
 
@@ -297,31 +396,86 @@ class MultiInstancesLauncher(Launcher):
         assert set(instance_idx).issubset(
             set(instances_available)
         ), "Designated nodes list contains invalid nodes."
-        processes = []
-        for i in instance_idx:
-            process = self.execution_command_builder(
+        metrics_files = {}
+        metrics_dir = ""
+        if args.report_metrics:
+            metrics_dir = (
+                args.log_dir
+                if args.log_dir
+                else tempfile.mkdtemp(prefix="ipexrun_metrics_")
+            )
+            for i in instance_idx:
+                metrics_files[i] = os.path.join(
+                    metrics_dir, f"{args.log_file_prefix}_instance_{i}_metrics.jsonl"
+                )
+                if os.path.exists(metrics_files[i]):
+                    os.remove(metrics_files[i])
+
+        def spawn(i):
+            if args.report_metrics:
+                environ_local[METRICS_FILE_ENV] = metrics_files[i]
+            return self.execution_command_builder(
                 args=args,
                 omp_runtime=omp_runtime,
                 task_mgr=task_mgr,
                 environ=environ_local,
                 cpu_pools=self.cpuinfo.pools_ondemand,
                 index=i,
+                new_session=args.supervise,
             )
-            processes.append(process)
+
         try:
-            for process in processes:
-                p = process["process"]
-                p.wait()
-                if p.returncode != 0:
-                    raise subprocess.CalledProcessError(
-                        returncode=p.returncode, cmd=process["cmd"]
-                    )
+            if args.supervise:
+                supervisor = InstanceSupervisor(
+                    spawn,
+                    logger=self.logger,
+                    max_restarts=args.max_restarts,
+                    backoff=args.restart_backoff,
+                    max_backoff=args.max_restart_backoff,
+                    drain_timeout=args.drain_timeout,
+                    health_file=args.health_file,
+                )
+                instances = supervisor.run(instance_idx)
+                for inst in instances.values():
+                    if inst.state == "failed":
+                        raise subprocess.CalledProcessError(
+                            returncode=inst.last_exit_code, cmd=inst.cmd
+                        )
+            else:
+                processes = [spawn(i) for i in instance_idx]
+                for process in processes:
+                    p = process["process"]
+                    p.wait()
+                    if p.returncode != 0:
+                        raise subprocess.CalledProcessError(
+                            returncode=p.returncode, cmd=process["cmd"]
+                        )
         finally:
+            if args.report_metrics:
+                self.report_metrics(args, metrics_files)
+                if not args.log_dir:
+                    shutil.rmtree(metrics_dir, ignore_errors=True)
             if args.auto_ipex:
                 # Clean the temp file
                 if os.path.exists(args.program) and args.program.endswith("_auto_ipex"):
                     os.remove(args.program)
 
+    def report_metrics(self, args, metrics_files):
+        summary = summarize_metrics(metrics_files)
+        self.verbose("info", "==========")
+        for line in format_summary(summary):
+            self.verbose("info", line)
+        report_file = args.report_file
+        if report_file == "" and args.log_dir:
+            report_file = os.path.join(
+                args.log_dir, f"{args.log_file_prefix}_summary.json"
+            )
+        if report_file != "":
+            with open(report_file, "w") as f:
+                json.dump(summary, f, indent=2)
+            self.verbose("info", f"Metrics summary is written to {report_file}")
+        return summary
+
 
 if __name__ == "__main__":
     pass
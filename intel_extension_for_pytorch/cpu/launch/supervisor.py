@@ -0,0 +1,252 @@
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+
+"""
+Supervisor of the instances started by the launcher with --supervise. It keeps the instances running: a crashed
+instance is restarted with the same command and cores after a backoff, which doubles on each crash in a row. SIGTERM
+and SIGINT drain the instances: the signal is forwarded to each of them, and the ones still running after the drain
+timeout are killed. The health of the instances is written to a JSON file.
+"""
+
+
+class InstanceState:
+    def __init__(self, index, backoff):
+        self.index = index
+        self.process = None
+        self.cmd = ""
+        # starting, running, backoff, completed, stopped or failed
+        self.state = "starting"
+        self.restarts = 0
+        self.start_time = None
+        self.last_exit_code = None
+        self.last_exit_time = None
+        self.backoff = backoff
+        self.restart_time = None
+        # Killed after the drain timeout
+        self.killed = False
+
+    def health(self, now):
+        return {
+            "state": self.state,
+            "pid": self.process.pid if self.process is not None else None,
+            "restarts": self.restarts,
+            "uptime": now - self.start_time
+            if self.state == "running" and self.start_time is not None
+            else None,
+            "last_exit_code": self.last_exit_code,
+            "last_exit_time": self.last_exit_time,
+            "next_restart_in": max(self.restart_time - now, 0)
+            if self.state == "backoff"
+            else None,
+            "cmd": self.cmd,
+        }
+
+
+class InstanceSupervisor:
+    """
+    - spawn [function]: Start the instance of an index in a new session, return {"process": Popen, "cmd": str}.
+    - max_restarts [int]: Max number of restarts of each instance, -1 for unlimited.
+    - backoff [float]: Seconds to wait before the first restart of a crashed instance.
+    - max_backoff [float]: Max seconds to wait before a restart. An instance that runs longer than it before the
+        crash is restarted after the initial backoff again.
+    - drain_timeout [float]: Seconds to wait for the instances to exit after SIGTERM, before killing them.
+    - health_file [str]: JSON file to write the health of the instances in, empty to disable.
+    """
+
+    TERMINAL_STATES = ["completed", "stopped", "failed"]
+
+    def __init__(
+        self,
+        spawn,
+        logger=None,
+        max_restarts=-1,
+        backoff=1.0,
+        max_backoff=60.0,
+        drain_timeout=30.0,
+        health_file="",
+        poll_interval=0.2,
+    ):
+        self.spawn = spawn
+        self.logger = logger
+        self.max_restarts = max_restarts
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self.drain_timeout = drain_timeout
+        self.health_file = health_file
+        self.poll_interval = poll_interval
+        self.instances = {}
+        self.draining = False
+        self.drain_time = None
+        self.start_time = None
+        self.event = threading.Event()
+
+    def verbose(self, level, msg):
+        if self.logger:
+            getattr(self.logger, level)(msg)
+        else:
+            print(msg)
+
+    def start(self, inst):
+        ret = self.spawn(inst.index)
+        inst.process = ret["process"]
+        inst.cmd = ret["cmd"]
+        inst.state = "running"
+        inst.start_time = time.time()
+        inst.restart_time = None
+
+    def signal_instance(self, inst, sig):
+        # The instance runs in its own session, so the signal reaches the shell, the task manager and the program
+        try:
+            os.killpg(inst.process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def is_group_alive(self, inst):
+        try:
+            os.killpg(inst.process.pid, 0)
+            return True
+        except (ProcessLookupError, PermissionError):
+            return False
+
+    def request_drain(self, sig=signal.SIGTERM):
+        """
+        Stop restarting the instances and forward sig to the running ones.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        self.drain_time = time.time()
+        self.verbose(
+            "info",
+            f"Draining the instances, they are killed if still running after {self.drain_timeout} seconds.",
+        )
+        for inst in self.instances.values():
+            if inst.state == "running":
+                self.signal_instance(inst, sig)
+            elif inst.state in ["starting", "backoff"]:
+                inst.state = "stopped"
+        self.event.set()
+
+    def on_exit(self, inst, now):
+        inst.last_exit_code = inst.process.returncode
+        inst.last_exit_time = now
+        if self.draining:
+            inst.state = "stopped"
+            self.verbose(
+                "info", f"Instance {inst.index} stopped with code {inst.last_exit_code}."
+            )
+        elif inst.last_exit_code == 0:
+            inst.state = "completed"
+            self.verbose("info", f"Instance {inst.index} completed.")
+        elif self.max_restarts >= 0 and inst.restarts >= self.max_restarts:
+            inst.state = "failed"
+            self.verbose(
+                "warning",
+                f"Instance {inst.index} exited with code {inst.last_exit_code}, and it has been restarted \
+                    {inst.restarts} times. Give up restarting it.",
+            )
+        else:
+            if now - inst.start_time > self.max_backoff:
+                # Crashed after running stably for a while
+                inst.backoff = self.initial_backoff
+            inst.state = "backoff"
+            inst.restart_time = now + inst.backoff
+            self.verbose(
+                "warning",
+                f"Instance {inst.index} exited with code {inst.last_exit_code}. Restart it in {inst.backoff} seconds.",
+            )
+            inst.backoff = min(inst.backoff * 2, self.max_backoff)
+
+    def health(self):
+        now = time.time()
+        return {
+            "time": now,
+            "uptime": now - self.start_time,
+            "draining": self.draining,
+            "instances": {i: inst.health(now) for i, inst in self.instances.items()},
+        }
+
+    def write_health(self):
+        if self.health_file == "":
+            return
+        path_dir = os.path.dirname(os.path.abspath(self.health_file))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=path_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.health(), f, indent=2)
+                os.replace(tmp_path, self.health_file)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except OSError as e:
+            self.verbose(
+                "warning", f"Failed to write the health file {self.health_file}: {e}"
+            )
+
+    def step(self):
+        now = time.time()
+        for inst in self.instances.values():
+            if inst.state == "running" and inst.process.poll() is not None:
+                # The shell exits while the program may still run in the process group
+                if self.is_group_alive(inst):
+                    if self.draining and not inst.killed:
+                        continue
+                    # Free the cores of a crashed instance before restarting it
+                    self.signal_instance(inst, signal.SIGKILL)
+                self.on_exit(inst, now)
+            elif inst.state == "backoff" and now >= inst.restart_time:
+                inst.restarts += 1
+                self.verbose(
+                    "info", f"Restart instance {inst.index} ({inst.restarts} restarts)."
+                )
+                self.start(inst)
+        if self.draining and now - self.drain_time > self.drain_timeout:
+            for inst in self.instances.values():
+                if inst.state == "running" and not inst.killed:
+                    self.verbose(
+                        "warning",
+                        f"Instance {inst.index} is still running after the drain timeout. Kill it.",
+                    )
+                    self.signal_instance(inst, signal.SIGKILL)
+                    inst.killed = True
+        self.write_health()
+
+    def run(self, indices):
+        """
+        Supervise the instances until all of them complete, stop or fail. Return the states of the instances.
+        """
+        self.start_time = time.time()
+        self.instances = {i: InstanceState(i, self.initial_backoff) for i in indices}
+        handlers = {}
+        is_main_thread = threading.current_thread() is threading.main_thread()
+        if is_main_thread:
+            for sig in [signal.SIGTERM, signal.SIGINT]:
+                handlers[sig] = signal.signal(
+                    sig, lambda signum, frame: self.request_drain(signal.SIGTERM)
+                )
+        try:
+            for inst in self.instances.values():
+                if not self.draining:
+                    self.start(inst)
+            while any(
+                [
+                    inst.state not in self.TERMINAL_STATES
+                    for inst in self.instances.values()
+                ]
+            ):
+                self.step()
+                self.event.wait(self.poll_interval)
+                self.event.clear()
+            self.write_health()
+        finally:
+            for inst in self.instances.values():
+                if inst.state == "running":
+                    self.signal_instance(inst, signal.SIGKILL)
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+        return self.instances
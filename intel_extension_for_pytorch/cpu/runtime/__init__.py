@@ -3,7 +3,19 @@ from .cpupool import pin, CPUPool, is_runtime_ext_enabled
 from .multi_stream import (
     MultiStreamModule,
     get_default_num_streams,
+    tune_num_streams,
     MultiStreamModuleHint,
     _MultiStreamBenchmarkModule,
 )
+from .dynamic_batching import DynamicBatcher
+from .pipeline import PipelineModule
+from .scheduler import ModelScheduler
+from .instrumentation import (
+    enable_instrumentation,
+    disable_instrumentation,
+    is_instrumentation_enabled,
+    reset_runtime_metrics,
+    get_runtime_metrics,
+    get_runtime_metrics_prometheus,
+)
 from .runtime_utils import get_core_list_of_node_id
@@ -0,0 +1,276 @@
+import torch
+import collections
+import threading
+import time
+from concurrent.futures import Future
+from .multi_stream import (
+    MultiStreamModule,
+    MultiStreamModuleHint,
+    default_multi_stream_module_split_hint,
+    default_multi_stream_module_concat_hint,
+)
+
+
+def _hint_of_args(hint, args_len):
+    # The args not covered by the hint are not batched, and the hint of the
+    # args not given is dropped
+    return (list(hint.args) + [None] * args_len)[:args_len]
+
+
+def _hint_of_output(hint):
+    # Align with the output structure of MultiStreamModule
+    if hint.args and hint.kwargs:
+        return (hint.args[0], hint.kwargs)
+    elif hint.args:
+        return hint.args[0]
+    else:
+        return hint.kwargs
+
+
+def _batch_size(hint, obj):
+    if isinstance(hint, (list, tuple)):
+        for h, o in zip(hint, obj):
+            size = _batch_size(h, o)
+            if size is not None:
+                return size
+    elif isinstance(hint, dict):
+        for key in hint:
+            size = _batch_size(hint[key], obj[key])
+            if size is not None:
+                return size
+    elif hint is not None:
+        return obj.size(hint)
+    return None
+
+
+def _batch_key(hint, obj):
+    # Requests can be batched together only if they have the same key: the
+    # same shapes except the batch dim, and the same objects not batched.
+    if isinstance(hint, (list, tuple)):
+        return tuple(_batch_key(h, o) for h, o in zip(hint, obj))
+    elif isinstance(hint, dict):
+        return tuple((key, _batch_key(hint[key], obj[key])) for key in hint)
+    elif hint is not None:
+        shape = list(obj.shape)
+        shape[hint] = -1
+        return (tuple(shape), obj.dtype)
+    return id(obj)
+
+
+def _concat(hint, objs):
+    if isinstance(hint, (list, tuple)):
+        return type(hint)(_concat(h, [o[i] for o in objs]) for i, h in enumerate(hint))
+    elif isinstance(hint, dict):
+        return {key: _concat(hint[key], [o[key] for o in objs]) for key in hint}
+    elif hint is not None:
+        return objs[0] if len(objs) == 1 else torch.cat(objs, dim=hint)
+    return objs[0]
+
+
+def _split(hint, obj, sizes):
+    # Returns the list of objects for each request
+    if isinstance(hint, (list, tuple)):
+        splits = [_split(h, obj[i], sizes) for i, h in enumerate(hint)]
+        return [type(obj)(s[j] for s in splits) for j in range(len(sizes))]
+    elif isinstance(hint, dict):
+        splits = {key: _split(hint[key], obj[key], sizes) for key in hint}
+        return [{key: splits[key][j] for key in hint} for j in range(len(sizes))]
+    elif hint is not None:
+        return list(torch.split(obj, sizes, dim=hint))
+    return [obj] * len(sizes)
+
+
+class _Request(object):
+    def __init__(self, args, kwargs, batch_size, key):
+        self.args = args
+        self.kwargs = kwargs
+        self.batch_size = batch_size
+        self.key = key
+        self.future = Future()
+        self.arrival = time.monotonic()
+
+
+class DynamicBatcher(object):
+    r"""
+    DynamicBatcher queues the concurrent requests, batches them and runs the
+    batches with the given module (usually a MultiStreamModule) on a
+    dispatcher thread, then scatters the outputs back to each request.
+
+    A batch is dispatched once it holds ``max_batch_size`` samples, or the
+    oldest request in it has waited for ``max_latency_ms`` milliseconds. Only
+    the requests with the same shapes except the batched dim and the same
+    objects in the positions not batched are batched together.
+
+    Args:
+        module (callable): The module to run the batches, e.g. a
+            intel_extension_for_pytorch.cpu.runtime.MultiStreamModule object.
+        max_batch_size (int): The max number of samples in a batch. A single
+            request larger than it is run as a batch alone.
+        max_latency_ms (float): The max time in milliseconds a request waits
+            in the queue for other requests to be batched with.
+        input_split_hint (MultiStreamModuleHint): Hint about along which dim
+            the inputs of the requests are batched. The default value is the
+            ``input_split_hint`` of ``module`` if it is a MultiStreamModule,
+            otherwise dim 0 of the first input.
+        output_concat_hint (MultiStreamModuleHint): Hint about along which dim
+            the output of ``module`` is split for the requests. The default
+            value is the ``output_concat_hint`` of ``module`` if it is a
+            MultiStreamModule, otherwise dim 0 of the output.
+
+    Returns:
+        intel_extension_for_pytorch.cpu.runtime.DynamicBatcher: Generated
+        intel_extension_for_pytorch.cpu.runtime.DynamicBatcher object.
+
+    :meta public:
+    """
+
+    def __init__(
+        self,
+        module,
+        max_batch_size: int,
+        max_latency_ms: float = 5.0,
+        input_split_hint: MultiStreamModuleHint = None,
+        output_concat_hint: MultiStreamModuleHint = None,
+    ):
+        assert max_batch_size >= 1, "max_batch_size should be a positive number"
+        self.module = module
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        if input_split_hint is None:
+            input_split_hint = (
+                module.input_split_hint
+                if isinstance(module, MultiStreamModule)
+                else default_multi_stream_module_split_hint
+            )
+        if output_concat_hint is None:
+            output_concat_hint = (
+                module.output_concat_hint
+                if isinstance(module, MultiStreamModule)
+                else default_multi_stream_module_concat_hint
+            )
+        self.input_split_hint = input_split_hint
+        self.output_hint = _hint_of_output(output_concat_hint)
+
+        self.num_batches = 0
+        self.num_requests = 0
+        self.num_samples = 0
+
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._dispatch_loop, name="ipex_dynamic_batcher", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, *args, **kwargs):
+        r"""
+        Queue a request and return a ``concurrent.futures.Future`` of its
+        output.
+        """
+        args_hint = _hint_of_args(self.input_split_hint, len(args))
+        kwargs_hint = {
+            key: self.input_split_hint.kwargs.get(key, None) for key in kwargs
+        }
+        batch_size = _batch_size([args_hint, kwargs_hint], [args, kwargs])
+        assert batch_size is not None, "No input of the request is to be batched"
+        key = (
+            len(args),
+            tuple(kwargs.keys()),
+            _batch_key([args_hint, kwargs_hint], [args, kwargs]),
+        )
+        request = _Request(args, kwargs, batch_size, key)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The DynamicBatcher is closed")
+            self._queue.append(request)
+            self._cond.notify()
+        return request.future
+
+    def __call__(self, *args, **kwargs):
+        return self.submit(*args, **kwargs).result()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "num_batches": self.num_batches,
+                "num_requests": self.num_requests,
+                "num_samples": self.num_samples,
+                "queue_size": len(self._queue),
+            }
+
+    def close(self):
+        r"""
+        Stop the dispatcher thread after running the queued requests.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _collect(self, key):
+        batch = []
+        size = 0
+        for request in self._queue:
+            if request.key != key:
+                continue
+            if batch and size + request.batch_size > self.max_batch_size:
+                break
+            batch.append(request)
+            size += request.batch_size
+        return batch, size
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            first = self._queue[0]
+            deadline = first.arrival + self.max_latency
+            while True:
+                batch, size = self._collect(first.key)
+                timeout = deadline - time.monotonic()
+                if size >= self.max_batch_size or self._closed or timeout <= 0:
+                    break
+                self._cond.wait(timeout)
+            batched = set(id(r) for r in batch)
+            self._queue = collections.deque(
+                r for r in self._queue if id(r) not in batched
+            )
+            self.num_batches += 1
+            self.num_requests += len(batch)
+            self.num_samples += size
+            return batch
+
+    def _run_batch(self, batch):
+        first = batch[0]
+        args_hint = _hint_of_args(self.input_split_hint, len(first.args))
+        kwargs_hint = {
+            key: self.input_split_hint.kwargs.get(key, None) for key in first.kwargs
+        }
+        try:
+            args = _concat(args_hint, [r.args for r in batch])
+            kwargs = _concat(kwargs_hint, [r.kwargs for r in batch])
+            with torch.no_grad():
+                output = self.module(*args, **kwargs)
+            outputs = _split(self.output_hint, output, [r.batch_size for r in batch])
+        except BaseException as e:
+            for r in batch:
+                r.future.set_exception(e)
+            return
+        for r, o in zip(batch, outputs):
+            r.future.set_result(o)
+
+    def _dispatch_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._run_batch(batch)
@@ -0,0 +1,339 @@
+import bisect
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+# The upper bounds in seconds of the buckets of the wait and execution time
+# histograms, the last bucket is +Inf.
+_HISTOGRAM_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
+
+_lock = threading.Lock()
+_enabled = False
+_enabled_time = None
+# Task name -> _TaskMetrics
+_task_metrics = {}
+# Core ids of the CPUPool -> _PoolBusyTime
+_pool_busy_time = {}
+
+
+class _Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(_HISTOGRAM_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        idx = len(_HISTOGRAM_BUCKETS)
+        for i, bound in enumerate(_HISTOGRAM_BUCKETS):
+            if value <= bound:
+                idx = i
+                break
+        self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        # Cumulative counts as Prometheus histograms
+        buckets = []
+        total = 0
+        for bound, count in zip(_HISTOGRAM_BUCKETS + (float("inf"),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class _TaskMetrics(object):
+    def __init__(self, name, core_ids):
+        self.name = name
+        self.core_ids = tuple(core_ids)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = _Histogram()
+        self.exec_time = _Histogram()
+        # The Task runs the submissions in order, the next one starts once the
+        # last one ends.
+        self.last_end_time = 0.0
+        # The submit times of the submissions queued or running
+        self.pending = collections.deque()
+
+    def next_start_time(self):
+        # The earliest time the next completed submission can start from
+        if not self.pending:
+            return None
+        return max(self.pending[0], self.last_end_time)
+
+    def on_submit(self):
+        with _lock:
+            submit_time = time.perf_counter()
+            self.submitted += 1
+            self.pending.append(submit_time)
+        return submit_time
+
+    def on_complete(self, submit_time, failed):
+        end_time = time.perf_counter()
+        with _lock:
+            start_time = max(submit_time, self.last_end_time)
+            self.last_end_time = end_time
+            if self.pending:
+                self.pending.popleft()
+            self.completed += 1
+            self.failed += int(failed)
+            self.wait_time.observe(start_time - submit_time)
+            self.exec_time.observe(end_time - start_time)
+            if _enabled_time is not None:
+                pool = _pool_busy_time.get(self.core_ids)
+                if pool is None:
+                    pool = _PoolBusyTime()
+                    _pool_busy_time[self.core_ids] = pool
+                pool.add(max(start_time, _enabled_time), end_time)
+                # The intervals of the Tasks on the CPUPool which will complete
+                # later start after the watermark.
+                watermark = end_time
+                for m in _task_metrics.values():
+                    if m.core_ids == self.core_ids:
+                        start = m.next_start_time()
+                        if start is not None:
+                            watermark = min(watermark, start)
+                pool.fold(watermark)
+
+
+class _PoolBusyTime(object):
+    # The busy time of a CPUPool: the union of the execution intervals of the
+    # Tasks on it, which overlap when several Tasks share the CPUPool (e.g. the
+    # streams of MultiStreamModule).
+    def __init__(self):
+        self.folded = 0.0
+        # Disjoint intervals sorted by the start time, which may still overlap
+        # the intervals completed later.
+        self.intervals = []
+
+    def add(self, start, end):
+        if end <= start:
+            return
+        idx = bisect.bisect_left(self.intervals, [start, end])
+        # Merge with the overlapping intervals before and after
+        if idx > 0 and self.intervals[idx - 1][1] >= start:
+            idx -= 1
+            start = self.intervals[idx][0]
+            end = max(end, self.intervals[idx][1])
+        last = idx
+        while last < len(self.intervals) and self.intervals[last][0] <= end:
+            end = max(end, self.intervals[last][1])
+            last += 1
+        self.intervals[idx:last] = [[start, end]]
+
+    def fold(self, watermark):
+        # Sum up the intervals ending before the watermark, no interval
+        # completed later overlaps them.
+        idx = 0
+        while idx < len(self.intervals) and self.intervals[idx][1] <= watermark:
+            self.folded += self.intervals[idx][1] - self.intervals[idx][0]
+            idx += 1
+        del self.intervals[:idx]
+
+    def busy_time(self):
+        return self.folded + sum(end - start for start, end in self.intervals)
+
+
+class _InstrumentedFuture(Future):
+    # Returned by the instrumented Task in place of the future of the C++
+    # TaskModule, with the same get() method.
+    def get(self):
+        return self.result()
+
+
+def enable_instrumentation():
+    r"""
+    Enable the runtime instrumentation: the submissions of each
+    intel_extension_for_pytorch.cpu.runtime.Task, including the ones of
+    MultiStreamModule, PipelineModule and DynamicBatcher, record the queue
+    depth, the wait time before and the time of the execution, and the busy
+    time of each CPUPool. It is disabled by default since it adds a callback to
+    each submission.
+    """
+    global _enabled, _enabled_time
+    with _lock:
+        if not _enabled:
+            _enabled = True
+            _enabled_time = time.perf_counter()
+
+
+def disable_instrumentation():
+    r"""
+    Disable the runtime instrumentation. The recorded metrics are kept.
+    """
+    global _enabled
+    with _lock:
+        _enabled = False
+
+
+def is_instrumentation_enabled():
+    return _enabled
+
+
+def reset_runtime_metrics():
+    r"""
+    Clear the recorded metrics.
+    """
+    global _enabled_time
+    with _lock:
+        _task_metrics.clear()
+        _pool_busy_time.clear()
+        _enabled_time = time.perf_counter() if _enabled else None
+
+
+def _get_task_metrics(name, core_ids):
+    with _lock:
+        metrics = _task_metrics.get(name)
+        if metrics is None:
+            metrics = _TaskMetrics(name, core_ids)
+            _task_metrics[name] = metrics
+        return metrics
+
+
+def get_runtime_metrics():
+    r"""
+    Get a snapshot of the runtime metrics as a dict. ``tasks`` has the metrics
+    of each Task by its name: the cores (``core_ids``), the number of the
+    submissions (``submitted``), the completed and the failed ones
+    (``completed`` and ``failed``), the submissions queued or running
+    (``queue_depth``), and the histograms of the wait time and the execution
+    time in seconds (``wait_time`` and ``exec_time``) with cumulative
+    ``(upper bound, count)`` buckets. ``cpu_pools`` has the busy time in
+    seconds (``busy_seconds``), in which any Task runs on the CPUPool, and the ratio of it to the time since the
+    instrumentation is enabled (``utilization``) of each CPUPool by its core
+    ids.
+    """
+    with _lock:
+        elapsed = (
+            time.perf_counter() - _enabled_time if _enabled_time is not None else 0.0
+        )
+        tasks = {
+            name: {
+                "core_ids": list(m.core_ids),
+                "submitted": m.submitted,
+                "completed": m.completed,
+                "failed": m.failed,
+                "queue_depth": m.submitted - m.completed,
+                "wait_time": m.wait_time.snapshot(),
+                "exec_time": m.exec_time.snapshot(),
+            }
+            for name, m in _task_metrics.items()
+        }
+        cpu_pools = {}
+        for core_ids, pool in _pool_busy_time.items():
+            busy = pool.busy_time()
+            cpu_pools[core_ids] = {
+                "busy_seconds": busy,
+                "utilization": busy / elapsed if elapsed > 0 else 0.0,
+            }
+    return {
+        "enabled": _enabled,
+        "elapsed_seconds": elapsed,
+        "tasks": tasks,
+        "cpu_pools": cpu_pools,
+    }
+
+
+def _format_core_ids(core_ids):
+    # Compact the core ids into ranges, e.g. 0-3,8
+    ranges = []
+    for core in sorted(core_ids):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ",".join(
+        str(start) if start == end else "{}-{}".format(start, end)
+        for start, end in ranges
+    )
+
+
+def _escape_label_value(value):
+    # Escape the label value as the Prometheus text exposition format requires
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def get_runtime_metrics_prometheus():
+    r"""
+    Get the runtime metrics in the Prometheus text exposition format.
+    """
+    metrics = get_runtime_metrics()
+    lines = []
+
+    def header(name, metric_type, help_text):
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+
+    task_labels = {
+        name: 'task="{}",cores="{}"'.format(
+            _escape_label_value(name), _format_core_ids(m["core_ids"])
+        )
+        for name, m in metrics["tasks"].items()
+    }
+    for key, metric_type, help_text in (
+        ("submitted", "counter", "Number of the submissions of the task."),
+        ("completed", "counter", "Number of the completed submissions of the task."),
+        ("failed", "counter", "Number of the failed submissions of the task."),
+        ("queue_depth", "gauge", "Number of the submissions queued or running."),
+    ):
+        name = "ipex_runtime_task_" + key
+        if metric_type == "counter":
+            name += "_total"
+        header(name, metric_type, help_text)
+        for task, m in metrics["tasks"].items():
+            lines.append("{}{{{}}} {}".format(name, task_labels[task], m[key]))
+    for key, help_text in (
+        ("wait_time", "Time in seconds the submissions wait in the queue."),
+        ("exec_time", "Time in seconds the submissions run."),
+    ):
+        name = "ipex_runtime_task_{}_seconds".format(key)
+        header(name, "histogram", help_text)
+        for task, m in metrics["tasks"].items():
+            labels = task_labels[task]
+            for bound, count in m[key]["buckets"]:
+                lines.append(
+                    '{}_bucket{{{},le="{}"}} {}'.format(
+                        name, labels, _format_bound(bound), count
+                    )
+                )
+            lines.append("{}_sum{{{}}} {}".format(name, labels, m[key]["sum"]))
+            lines.append("{}_count{{{}}} {}".format(name, labels, m[key]["count"]))
+    for key, name, metric_type, help_text in (
+        (
+            "busy_seconds",
+            "ipex_runtime_cpupool_busy_seconds_total",
+            "counter",
+            "Time in seconds the tasks run on the CPUPool.",
+        ),
+        (
+            "utilization",
+            "ipex_runtime_cpupool_utilization",
+            "gauge",
+            "Ratio of the busy time of the CPUPool since the instrumentation "
+            "is enabled.",
+        ),
+    ):
+        header(name, metric_type, help_text)
+        for core_ids, m in metrics["cpu_pools"].items():
+            lines.append(
+                '{}{{cores="{}"}} {}'.format(name, _format_core_ids(core_ids), m[key])
+            )
+    return "\n".join(lines) + "\n"
@@ -1,11 +1,17 @@
+import asyncio
 import torch
 import torch.nn as nn
 from typing import Union
 import intel_extension_for_pytorch._C as core
-from .cpupool import CPUPool
+from .cpupool import CPUPool, pin
 from .task import Task
+from .runtime_utils import get_node_id_of_core
 import copy
+import time
 import warnings
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
 
 
 class MultiStreamModuleHint(object):
@@ -37,6 +43,138 @@ class MultiStreamModuleHint(object):
 default_multi_stream_module_split_hint = MultiStreamModuleHint(0)
 default_multi_stream_module_concat_hint = MultiStreamModuleHint(0)
 
+# The max number of the input split sizes to keep the preallocated outputs for.
+_MAX_PREALLOCATED_OUTPUTS = 8
+
+
+def _copy_structure(obj):
+    # Copy the containers, the stream inputs are updated in place by the later
+    # calls while the tasks of the async calls may still refer to them.
+    if isinstance(obj, list):
+        return [_copy_structure(o) for o in obj]
+    elif isinstance(obj, tuple):
+        return tuple(_copy_structure(o) for o in obj)
+    elif isinstance(obj, dict):
+        return {k: _copy_structure(v) for k, v in obj.items()}
+    return obj
+
+
+class _TimedStreamFuture(Future):
+    # Completed by the callback of a stream task, which records the time the
+    # stream finishes no matter in which order the streams are waited.
+    def __init__(self):
+        super(_TimedStreamFuture, self).__init__()
+        self.end_time = None
+        # Whether the outputs are written into the preallocated outputs
+        self.copied = False
+
+    def callback(self, output, error):
+        self.end_time = time.perf_counter()
+        if error is not None:
+            self.set_exception(error)
+        else:
+            self.set_result(output)
+
+    def get(self):
+        return self.result()
+
+
+def _get_by_path(obj, path):
+    for idx_or_key in path:
+        obj = obj[idx_or_key]
+    return obj
+
+
+def _output_slots(hint_object, output_object, path, slots):
+    # Collect (path in the stream output, concatenated tensor, concat dim) of
+    # each position to concat. Returns False if any position isn't a tensor to
+    # concat, which is not supported by the preallocated outputs.
+    if isinstance(hint_object, (list, tuple)):
+        return all(
+            _output_slots(h, output_object[i], path + [i], slots)
+            for i, h in enumerate(hint_object)
+        )
+    elif isinstance(hint_object, dict):
+        return all(
+            _output_slots(hint_object[key], output_object[key], path + [key], slots)
+            for key in hint_object
+        )
+    elif isinstance(hint_object, int) and isinstance(output_object, torch.Tensor):
+        slots.append((path, output_object, hint_object))
+        return True
+    return False
+
+
+class _PreallocatedOutput(object):
+    # The concatenated outputs reused by the forwards of the same split sizes,
+    # and the slice of each stream's outputs in them. Each stream copies its
+    # outputs into its slices in the stream thread, instead of torch.cat in
+    # the main thread with a new allocation.
+    def __init__(self, output, slots, stream_results):
+        self.output = output
+        self.slots = []
+        for path, buffer, dim in slots:
+            shapes = []
+            offsets = []
+            offset = 0
+            for result in stream_results:
+                value = _get_by_path(result, path)
+                shapes.append(value.shape)
+                offsets.append(offset)
+                offset += value.size(dim)
+            self.slots.append((path, buffer, dim, offsets, shapes))
+
+    def write(self, stream_id, result):
+        # Returns False without writing if the stream outputs don't match the
+        # preallocated outputs, e.g. the output shape depends on the values.
+        values = []
+        for path, buffer, _, _, shapes in self.slots:
+            value = _get_by_path(result, path)
+            if (
+                not isinstance(value, torch.Tensor)
+                or value.shape != shapes[stream_id]
+                or value.dtype != buffer.dtype
+            ):
+                return False
+            values.append(value)
+        for (_, buffer, dim, offsets, shapes), value in zip(self.slots, values):
+            buffer.narrow(dim, offsets[stream_id], shapes[stream_id][dim]).copy_(
+                value
+            )
+        return True
+
+    def stream_callback(self, stream_id, future):
+        def callback(output, error):
+            if error is None:
+                try:
+                    future.copied = self.write(stream_id, output)
+                except Exception as e:
+                    error = e
+            future.callback(output, error)
+
+        return callback
+
+
+def _weight_bytes(model):
+    # The memory of the parameters and buffers, shared storages counted once
+    storages = {}
+    for t in list(model.parameters()) + list(model.buffers()):
+        try:
+            storage = t.untyped_storage()
+            storages[storage.data_ptr()] = storage.nbytes()
+        except Exception:
+            # Opaque tensors, e.g. mkldnn tensors, have no storage
+            storages[id(t)] = t.numel() * t.element_size()
+    return sum(storages.values())
+
+
+def _replicate_model_on_node(model, node_core_ids):
+    # Copy the model with the threads pinned to the cores of the node, so the
+    # copied weights are first touched and allocated on the node's memory with
+    # the default local allocation policy.
+    with pin(CPUPool(node_core_ids)), torch.no_grad():
+        return copy.deepcopy(model)
+
 
 def get_default_num_streams(cpu_pool):
     # One core per stream usually brings better overall throughput than other configurations.
@@ -44,6 +182,168 @@ def get_default_num_streams(cpu_pool):
     return cpu_pool.core_ids.__len__()
 
 
+# model -> {(core ids, batch size, latency SLA, candidates, iterations,
+#            MultiStreamModule arguments): tuning report}
+_num_streams_tuning_cache = weakref.WeakKeyDictionary()
+
+
+def _hashable(obj):
+    # Hashable form of the arguments of MultiStreamModule for the tuning cache
+    if isinstance(obj, MultiStreamModuleHint):
+        return ("hint", _hashable(obj.args), _hashable(obj.kwargs))
+    elif isinstance(obj, (list, tuple)):
+        return tuple(_hashable(o) for o in obj)
+    elif isinstance(obj, dict):
+        return tuple(sorted((key, _hashable(value)) for key, value in obj.items()))
+    return obj
+
+
+def _split_batch_size(hint_object, input_object):
+    # The size of the first input to split along its split dim
+    if isinstance(hint_object, (list, tuple)):
+        for h, i in zip(hint_object, input_object):
+            size = _split_batch_size(h, i)
+            if size is not None:
+                return size
+    elif isinstance(hint_object, dict):
+        for key in hint_object:
+            size = _split_batch_size(hint_object[key], input_object[key])
+            if size is not None:
+                return size
+    elif isinstance(hint_object, int) and isinstance(input_object, torch.Tensor):
+        return input_object.size(hint_object)
+    return None
+
+
+def tune_num_streams(
+    model,
+    cpu_pool: CPUPool,
+    sample_input,
+    candidates=None,
+    latency_sla_ms: float = None,
+    num_iters: int = 20,
+    num_warmup_iters: int = 5,
+    return_report: bool = False,
+    **kwargs
+):
+    r"""
+    Select the number of streams of MultiStreamModule by benchmarking the
+    model on the CPUPool, instead of the heuristic of
+    ``get_default_num_streams``. Each candidate is measured with a
+    MultiStreamModule running ``sample_input``, and the one with the best
+    throughput whose 95th percentile latency meets ``latency_sla_ms`` is
+    selected. If no candidate meets the SLA, the one with the lowest latency is
+    selected with a warning. The decision is cached per model, CPUPool, batch
+    size and the other arguments. It is also used by MultiStreamModule with
+    ``num_streams="TUNE"``.
+
+    Args:
+        model (torch.jit.ScriptModule or torch.nn.Module): The input model.
+        cpu_pool (intel_extension_for_pytorch.cpu.runtime.CPUPool): An
+            intel_extension_for_pytorch.cpu.runtime.CPUPool object, contains
+            all CPU cores used to run multi-stream inference.
+        sample_input (torch.Tensor or tuple): The sample input of the model,
+            with the batch size used in deployment.
+        candidates (list of int): The numbers of streams to benchmark. The
+            default value is the divisors of the core number of ``cpu_pool``
+            not larger than the batch size.
+        latency_sla_ms (float): The max 95th percentile latency in
+            milliseconds of a forward. The default value is None, which means
+            no latency requirement.
+        num_iters (int): The number of the measured iterations of each
+            candidate.
+        num_warmup_iters (int): The number of the warm-up iterations of each
+            candidate.
+        return_report (bool): Whether to return the measurement of each
+            candidate along with the selected number.
+        kwargs: The other arguments of MultiStreamModule, e.g. the hints.
+
+    Returns:
+        int: The selected number of streams. A tuple of it and the report dict
+        if ``return_report`` is True.
+
+    :meta public:
+    """
+    assert num_iters >= 1, "num_iters should be a positive number"
+    if not isinstance(sample_input, (tuple, list)):
+        sample_input = (sample_input,)
+    input_split_hint = kwargs.get(
+        "input_split_hint", default_multi_stream_module_split_hint
+    )
+    batch_size = _split_batch_size(input_split_hint.args, sample_input)
+    num_cores = len(cpu_pool.core_ids)
+    if candidates is None:
+        candidates = [
+            n
+            for n in range(1, num_cores + 1)
+            if num_cores % n == 0 and (batch_size is None or n <= batch_size)
+        ]
+    candidates = sorted(set(n for n in candidates if 1 <= n <= num_cores))
+    assert candidates, "No valid candidate of num_streams"
+
+    key = (
+        tuple(cpu_pool.core_ids),
+        batch_size,
+        latency_sla_ms,
+        tuple(candidates),
+        num_iters,
+        num_warmup_iters,
+        _hashable(kwargs),
+    )
+    model_cache = _num_streams_tuning_cache.setdefault(model, {})
+    if key not in model_cache:
+        results = []
+        with torch.no_grad():
+            for num_streams in candidates:
+                multi_stream_model = MultiStreamModule(
+                    model, num_streams=num_streams, cpu_pool=cpu_pool, **kwargs
+                )
+                for _ in range(num_warmup_iters):
+                    multi_stream_model(*sample_input)
+                latencies = []
+                for _ in range(num_iters):
+                    start = time.perf_counter()
+                    multi_stream_model(*sample_input)
+                    latencies.append(time.perf_counter() - start)
+                del multi_stream_model
+                latencies.sort()
+                mean_latency = sum(latencies) / len(latencies)
+                p95_latency = latencies[(len(latencies) - 1) * 95 // 100]
+                results.append(
+                    {
+                        "num_streams": num_streams,
+                        "mean_latency_ms": mean_latency * 1000,
+                        "p95_latency_ms": p95_latency * 1000,
+                        "throughput": (batch_size or 1) / mean_latency,
+                    }
+                )
+        qualified = [
+            r
+            for r in results
+            if latency_sla_ms is None or r["p95_latency_ms"] <= latency_sla_ms
+        ]
+        if qualified:
+            best = max(qualified, key=lambda r: r["throughput"])
+        else:
+            best = min(results, key=lambda r: r["p95_latency_ms"])
+            warnings.warn(
+                "No num_streams meets the latency SLA of {} ms, select {} with "
+                "the lowest latency {:.3f} ms.".format(
+                    latency_sla_ms, best["num_streams"], best["p95_latency_ms"]
+                )
+            )
+        model_cache[key] = {
+            "num_streams": best["num_streams"],
+            "batch_size": batch_size,
+            "latency_sla_ms": latency_sla_ms,
+            "results": results,
+        }
+    report = model_cache[key]
+    if return_report:
+        return report["num_streams"], report
+    return report["num_streams"]
+
+
 class MultiStreamModule(nn.Module):
     r"""
     MultiStreamModule supports inference with multi-stream throughput mode.
@@ -66,10 +366,12 @@ class MultiStreamModule(nn.Module):
 
     Args:
         model (torch.jit.ScriptModule or torch.nn.Module): The input model.
-        num_streams (Union[int, str]): Number of instances (int) or "AUTO" (str). "AUTO" means the stream number
+        num_streams (Union[int, str]): Number of instances (int), "AUTO" or "TUNE" (str). "AUTO" means the stream number
             will be selected automatically. Although "AUTO" usually provides a
             reasonable performance, it may still not be optimal for some cases which
             means manual tuning for number of streams is needed for this case.
+            "TUNE" means the stream number is selected by benchmarking the model
+            with ``sample_input`` by ``tune_num_streams``.
         cpu_pool (intel_extension_for_pytorch.cpu.runtime.CPUPool): An
             intel_extension_for_pytorch.cpu.runtime.CPUPool object, contains
             all CPU cores used to run multi-stream inference.
@@ -81,6 +383,40 @@ class MultiStreamModule(nn.Module):
             how to split the inputs.
         output_concat_hint (MultiStreamModuleHint): Hint to MultiStreamModule about
             how to concat the outputs.
+        adaptive_split (bool): A flag indicates whether to split the inputs by
+            the measured throughput of each stream instead of evenly. The
+            throughput of each stream is tracked with an exponentially weighted
+            moving average (EWMA) and the batch is split proportionally, which
+            reduces the latency when the streams run at different speeds, e.g.
+            on hybrid cores or with noisy neighbours. The statistics of each
+            stream are reported by ``get_stream_stats``. The default value is
+            False.
+        adaptive_split_alpha (float): The smoothing factor of the EWMA of the
+            stream throughput, in (0, 1]. The default value is 0.3.
+        numa_weight_replicas (bool): A flag indicates whether to replicate the
+            model weights on each numa node the streams run on, when
+            ``cpu_pool`` crosses numa nodes. The streams on the numa node of
+            the first stream run the input model, and the streams on each other
+            node run a replica copied by the threads pinned to the node, so they
+            read the weights from the local memory instead of over the socket
+            interconnect. The memory of the replicas is reported by
+            ``get_weight_replica_stats``. Note: the replicas are copies of the
+            model, the later updates of the input model don't apply to them.
+            The default value is False.
+        weight_replica_memory_budget (int): The max memory in bytes of all the
+            weight replicas. The nodes out of the budget run the input model.
+            The default value is None, which means no limit.
+        preallocate_output (bool): A flag indicates whether to reuse the
+            concatenated outputs among the forwards of the same input split.
+            Each stream copies its outputs into its slices of them once it
+            finishes, which saves the concat copy in the main thread and the
+            allocation of the outputs in each forward. Note: the returned
+            outputs are overwritten by the next forward, clone them to keep
+            them. Only supported by ``forward`` with ``concat_output`` and the
+            outputs which are all concatenated. The default value is False.
+        sample_input (torch.Tensor or tuple): The sample input of the model
+            with the batch size used in deployment, to tune the number of
+            streams with. Required by ``num_streams="TUNE"``.
 
     Returns:
         intel_extension_for_pytorch.cpu.runtime.MultiStreamModule: Generated
@@ -97,6 +433,12 @@ class MultiStreamModule(nn.Module):
         concat_output: bool = True,
         input_split_hint: MultiStreamModuleHint = default_multi_stream_module_split_hint,
         output_concat_hint: MultiStreamModuleHint = default_multi_stream_module_concat_hint,
+        adaptive_split: bool = False,
+        adaptive_split_alpha: float = 0.3,
+        preallocate_output: bool = False,
+        numa_weight_replicas: bool = False,
+        weight_replica_memory_budget: int = None,
+        sample_input=None,
     ):
         super(MultiStreamModule, self).__init__()
         assert (
@@ -115,6 +457,23 @@ class MultiStreamModule(nn.Module):
                 self.num_streams = get_default_num_streams(
                     cpu_pool
                 )  # The default selected value when auto selection is on.
+            elif num_streams.upper() == "TUNE":
+                assert (
+                    sample_input is not None
+                ), 'sample_input is required by num_streams="TUNE"'
+                self.num_streams = tune_num_streams(
+                    model,
+                    cpu_pool,
+                    sample_input,
+                    concat_output=concat_output,
+                    input_split_hint=input_split_hint,
+                    output_concat_hint=output_concat_hint,
+                    adaptive_split=adaptive_split,
+                    adaptive_split_alpha=adaptive_split_alpha,
+                    preallocate_output=preallocate_output,
+                    numa_weight_replicas=numa_weight_replicas,
+                    weight_replica_memory_budget=weight_replica_memory_budget,
+                )
             else:
                 AssertionError(
                     False
@@ -142,6 +501,7 @@ class MultiStreamModule(nn.Module):
                 self.core_list.__len__() % self.num_streams
             )
             self.tasks = []
+            stream_core_lists = []
             start_core_list_idx = 0
             end_core_list_idx = 0
             for j in range(self.num_streams):
@@ -151,13 +511,18 @@ class MultiStreamModule(nn.Module):
                     end_core_list_idx += self.cores_per_instance + 1
                 else:
                     end_core_list_idx += self.cores_per_instance
-                self.tasks.append(
-                    Task(
-                        model,
-                        CPUPool(self.core_list[start_core_list_idx:end_core_list_idx]),
-                    )
+                stream_core_lists.append(
+                    self.core_list[start_core_list_idx:end_core_list_idx]
                 )
                 start_core_list_idx = end_core_list_idx
+            stream_models = self._create_weight_replicas(
+                model,
+                stream_core_lists,
+                numa_weight_replicas,
+                weight_replica_memory_budget,
+            )
+            for stream_model, stream_core_list in zip(stream_models, stream_core_lists):
+                self.tasks.append(Task(stream_model, CPUPool(stream_core_list)))
         self.concat_output = concat_output
         self.input_split_hint = input_split_hint
         self.output_concat_hint = output_concat_hint
@@ -176,9 +541,75 @@ class MultiStreamModule(nn.Module):
         # self.output will be recursively visited and set to the concat value in place.
         self.output = copy.deepcopy(self.output_concat_hint)
 
+        # Status of the adaptive split: the EWMA of the throughput (samples per
+        # second), the latency and the split size of each stream measured in
+        # the last forward.
+        assert 0 < adaptive_split_alpha <= 1, "adaptive_split_alpha should be in (0, 1]"
+        self.adaptive_split = adaptive_split
+        self.adaptive_split_alpha = adaptive_split_alpha
+        self.stream_throughput = [None] * self.num_streams
+        self.stream_latency = [None] * self.num_streams
+        self.last_split_sizes = []
+
+        # The preallocated outputs of the recent input split sizes.
+        self.preallocate_output = preallocate_output and concat_output
+        self._preallocated_outputs = OrderedDict()
+
         # Init status needed for forward
         self.reset_forward_status()
 
+    def _create_weight_replicas(self, model, stream_core_lists, enabled, budget):
+        # Returns the model each stream runs, and records the memory of the
+        # weights on each numa node in self.weight_replica_stats.
+        if not enabled:
+            return [model] * len(stream_core_lists)
+        stream_nodes = [get_node_id_of_core(cores[0]) for cores in stream_core_lists]
+        weight_bytes = _weight_bytes(model)
+        replicas = {stream_nodes[0]: model}
+        stats = {}
+        replica_bytes = 0
+        for node_id in stream_nodes:
+            if node_id in stats:
+                continue
+            node_stats = {"replicated": False, "weight_bytes": weight_bytes}
+            if node_id not in replicas:
+                if budget is not None and replica_bytes + weight_bytes > budget:
+                    warnings.warn(
+                        "The weight replica on numa node {} exceeds the memory budget "
+                        "of {} bytes, the streams on it share the input model.".format(
+                            node_id, budget
+                        )
+                    )
+                    replicas[node_id] = model
+                else:
+                    node_cores = [
+                        core
+                        for cores, node in zip(stream_core_lists, stream_nodes)
+                        if node == node_id
+                        for core in cores
+                    ]
+                    replicas[node_id] = _replicate_model_on_node(model, node_cores)
+                    replica_bytes += weight_bytes
+                    node_stats["replicated"] = True
+            node_stats["streams"] = [
+                i for i, node in enumerate(stream_nodes) if node == node_id
+            ]
+            stats[node_id] = node_stats
+        self.weight_replica_stats = {"nodes": stats, "replica_bytes": replica_bytes}
+        return [replicas[node_id] for node_id in stream_nodes]
+
+    def get_weight_replica_stats(self):
+        r"""
+        Get the memory accounting of ``numa_weight_replicas``: for each numa
+        node the streams run on (``nodes``), the stream ids on it
+        (``streams``), whether the streams run a replica (``replicated``) and
+        the memory of the weights in bytes (``weight_bytes``), and the total
+        extra memory of the replicas in bytes (``replica_bytes``).
+        """
+        return copy.deepcopy(
+            getattr(self, "weight_replica_stats", {"nodes": {}, "replica_bytes": 0})
+        )
+
     def reset_forward_status(self):
         # Since the input batchsize for each forward invoking may change
         # Need to reset the status for each forward invoking
@@ -187,7 +618,10 @@ class MultiStreamModule(nn.Module):
         #       It may less than self.num_streams when bs is less than self.num_streams.
         #   * current_split_start_idx: used to record the split start idx for current stream.
         #   * current_split_end_idx: used to record the split end idx for current stream.
+        #   * stream_split_sizes: the input size of each stream decided by the
+        #       measured throughput, None to split evenly.
         self.split_size = None
+        self.stream_split_sizes = None
         self.used_num_streams = self.num_streams
         self.current_split_start_idx = 0
         self.current_split_end_idx = 0
@@ -196,7 +630,11 @@ class MultiStreamModule(nn.Module):
         # Set current_split_start_idx to last current_split_end_idx
         self.current_split_start_idx = self.current_split_end_idx
         # Calculate current_split_end_idx to new value
-        if stream_id < self.instance_need_extra_input:
+        if self.stream_split_sizes is not None:
+            self.current_split_end_idx = (
+                self.current_split_end_idx + self.stream_split_sizes[stream_id]
+            )
+        elif stream_id < self.instance_need_extra_input:
             # Tail case, when the input image size larger than num_streams and not divisible,
             # the first remainder streams will have (mini_batch + 1) input size.
             self.current_split_end_idx = self.current_split_end_idx + (
@@ -225,8 +663,73 @@ class MultiStreamModule(nn.Module):
             self.batch_per_instance = 1
             self.used_num_streams = self.split_size
             self.instance_need_extra_input = 0
+        if self.adaptive_split and self.used_num_streams == self.num_streams:
+            self.stream_split_sizes = self._adaptive_split_sizes(self.split_size)
         self.update_split_idx(stream_id)
 
+    def _adaptive_split_sizes(self, split_size):
+        # Split proportionally to the throughput of each stream, by the largest
+        # remainder. Each stream gets one sample at least, so its throughput
+        # keeps being measured.
+        if None in self.stream_throughput:
+            return None
+        spare = split_size - self.num_streams
+        total = sum(self.stream_throughput)
+        quotas = [spare * t / total for t in self.stream_throughput]
+        sizes = [1 + int(q) for q in quotas]
+        remainder = split_size - sum(sizes)
+        order = sorted(
+            range(self.num_streams), key=lambda i: quotas[i] - int(quotas[i])
+        )
+        for i in order[::-1][:remainder]:
+            sizes[i] += 1
+        return sizes
+
+    def _current_split_sizes(self):
+        # The input size of each used stream in the current forward
+        if self.split_size is None:
+            return None
+        if self.stream_split_sizes is not None:
+            return list(self.stream_split_sizes)
+        return [
+            self.batch_per_instance + (1 if i < self.instance_need_extra_input else 0)
+            for i in range(self.used_num_streams)
+        ]
+
+    def _update_stream_stats(self, split_sizes, latencies):
+        if split_sizes is None:
+            return
+        alpha = self.adaptive_split_alpha
+        for stream_id, (size, latency) in enumerate(zip(split_sizes, latencies)):
+            self.stream_latency[stream_id] = latency
+            throughput = size / max(latency, 1e-9)
+            last = self.stream_throughput[stream_id]
+            self.stream_throughput[stream_id] = (
+                throughput if last is None else alpha * throughput + (1 - alpha) * last
+            )
+        self.last_split_sizes = list(split_sizes)
+
+    def get_stream_stats(self):
+        r"""
+        Get the statistics of each stream collected with ``adaptive_split``:
+        the input size (``split_sizes``) and the latency in seconds
+        (``latency``) of each stream in the last forward, the EWMA of the
+        throughput in samples per second (``throughput``) and the imbalance of
+        the last forward (``imbalance``), which is the ratio of the max stream
+        latency to the mean one. 1.0 means all the streams finish together.
+        """
+        used = len(self.last_split_sizes)
+        latencies = self.stream_latency[:used]
+        imbalance = None
+        if used and sum(latencies) > 0:
+            imbalance = max(latencies) / (sum(latencies) / used)
+        return {
+            "split_sizes": list(self.last_split_sizes),
+            "latency": latencies,
+            "throughput": list(self.stream_throughput),
+            "imbalance": imbalance,
+        }
+
     def _do_get_input_for_each_stream(
         self, hint_object, input_object, stream_input_object, idx_or_key, stream_id
     ):
@@ -496,15 +999,45 @@ class MultiStreamModule(nn.Module):
         # Split the raw input to generate input for each stream
         self._get_input_for_each_stream(self.input_split_hint, *args, **kwargs)
 
+        preallocated = None
+        split_sizes = self._current_split_sizes()
+        if self.preallocate_output and split_sizes is not None:
+            preallocated = self._preallocated_outputs.get(tuple(split_sizes))
+            if preallocated is not None:
+                self._preallocated_outputs.move_to_end(tuple(split_sizes))
+
         results_raw_future = []
         results_raw = []
+        start_time = time.perf_counter()
         for stream_id in range(self.used_num_streams):
-            results_raw_future.append(
-                self.tasks[stream_id](
+            if self.adaptive_split or self.preallocate_output:
+                future = _TimedStreamFuture()
+                self.tasks[stream_id].run_async_with_callback(
+                    future.callback
+                    if preallocated is None
+                    else preallocated.stream_callback(stream_id, future),
                     *(self.args_streams_input[stream_id]),
                     **(self.kwargs_streams_input[stream_id])
                 )
-            )
+            else:
+                future = self.tasks[stream_id](
+                    *(self.args_streams_input[stream_id]),
+                    **(self.kwargs_streams_input[stream_id])
+                )
+            results_raw_future.append(future)
+
+        if preallocated is not None:
+            for future in results_raw_future:
+                future.get()
+            if all(future.copied for future in results_raw_future):
+                if self.adaptive_split:
+                    self._update_stream_stats(
+                        split_sizes,
+                        [f.end_time - start_time for f in results_raw_future],
+                    )
+                return preallocated.output
+            # Some stream outputs don't match, concat them as usual below.
+            del self._preallocated_outputs[tuple(split_sizes)]
 
         for stream_id in range(self.used_num_streams):
             # If we need to concat the output, for each position, we will push the result generated \
@@ -517,11 +1050,100 @@ class MultiStreamModule(nn.Module):
             ) if self.concat_output else results_raw.append(
                 results_raw_future[stream_id].get()
             )
+        if self.adaptive_split:
+            self._update_stream_stats(
+                split_sizes, [f.end_time - start_time for f in results_raw_future]
+            )
         # If we need to concat the output, for each position, we will concat the result in the list \
         # (generate in self._generate_outputs).
-        return (
-            self._concat_output_for_each_stream() if self.concat_output else results_raw
+        if not self.concat_output:
+            return results_raw
+        output = self._concat_output_for_each_stream()
+        if self.preallocate_output and split_sizes is not None:
+            self._preallocate_output(
+                split_sizes, output, [f.get() for f in results_raw_future]
+            )
+        return output
+
+    def _preallocate_output(self, split_sizes, output, stream_results):
+        # Keep the concatenated output to be reused by the next forwards of the
+        # same split sizes. The containers are copied since self.output is
+        # updated in place by the other forwards.
+        output = _copy_structure(output)
+        slots = []
+        hint = self.output_concat_hint
+        if hint.args and hint.kwargs:
+            supported = _output_slots(hint.args[0], output[0], [], slots)
+            supported = supported and _output_slots(hint.kwargs, output[1], [], slots)
+        elif hint.args:
+            supported = _output_slots(hint.args[0], output, [], slots)
+        else:
+            supported = _output_slots(hint.kwargs, output, [], slots)
+        if not supported:
+            warnings.warn(
+                "preallocate_output only supports the outputs which are all "
+                "tensors to concat, fallback to concat the outputs in each forward."
+            )
+            self.preallocate_output = False
+            return
+        self._preallocated_outputs[tuple(split_sizes)] = _PreallocatedOutput(
+            output, slots, stream_results
         )
+        while len(self._preallocated_outputs) > _MAX_PREALLOCATED_OUTPUTS:
+            self._preallocated_outputs.popitem(last=False)
+
+    async def forward_async(self, *args, **kwargs):
+        r"""
+        Asynchronous version of ``forward`` for asyncio, which awaits the
+        output of each stream without blocking the event loop. Concurrent
+        calls in the same event loop are supported.
+        """
+        self.reset_forward_status()
+        if self.num_streams == 1:
+            if not hasattr(self, "_async_task"):
+                # The sync path runs the model in the calling thread, which
+                # would block the event loop.
+                self._async_task = Task(self.model, self.cpu_pool)
+            results_raw = await self._async_task.run_async_aio(*args, **kwargs)
+            return results_raw if self.concat_output else [results_raw]
+
+        # The inputs are split and submitted before the first await, so the
+        # split status isn't shared with the other calls.
+        self._get_input_for_each_stream(self.input_split_hint, *args, **kwargs)
+        split_sizes = self._current_split_sizes()
+
+        start_time = time.perf_counter()
+        timed_futures = []
+        for stream_id in range(self.used_num_streams):
+            stream_args, stream_kwargs = _copy_structure(
+                (
+                    self.args_streams_input[stream_id],
+                    self.kwargs_streams_input[stream_id],
+                )
+            )
+            # The end time is recorded in the task thread, not when the event
+            # loop gets to the result.
+            future = _TimedStreamFuture()
+            # Running, so that cancelling the awaiting coroutine doesn't cancel
+            # it before the task thread sets the result.
+            future.set_running_or_notify_cancel()
+            self.tasks[stream_id].run_async_with_callback(
+                future.callback, *stream_args, **stream_kwargs
+            )
+            timed_futures.append(future)
+        results_raw = await asyncio.gather(
+            *[asyncio.wrap_future(future) for future in timed_futures]
+        )
+        if self.adaptive_split:
+            self._update_stream_stats(
+                split_sizes, [f.end_time - start_time for f in timed_futures]
+            )
+        if not self.concat_output:
+            return list(results_raw)
+        # No await from here, the outputs are concatenated without interleaving.
+        for stream_id, result in enumerate(results_raw):
+            self._generate_outputs([result], stream_id)
+        return self._concat_output_for_each_stream()
 
     def get_stream_number(self):
         return self.num_streams
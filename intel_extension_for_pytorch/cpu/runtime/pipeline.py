@@ -0,0 +1,194 @@
+import torch.nn as nn
+import threading
+import time
+from concurrent.futures import Future
+from .cpupool import CPUPool
+from .task import Task
+from .multi_stream import (
+    MultiStreamModuleHint,
+    default_multi_stream_module_split_hint,
+    default_multi_stream_module_concat_hint,
+)
+from .dynamic_batching import (
+    _hint_of_args,
+    _hint_of_output,
+    _batch_size,
+    _concat,
+    _split,
+)
+
+
+def _split_sequential(model, num_stages):
+    # Split the children of nn.Sequential into num_stages contiguous stages
+    children = list(model.children())
+    assert (
+        len(children) >= num_stages
+    ), "nn.Sequential with {} modules can't be split into {} stages".format(
+        len(children), num_stages
+    )
+    stages = []
+    start = 0
+    for i in range(num_stages):
+        end = start + len(children) // num_stages
+        if i < len(children) % num_stages:
+            end += 1
+        stages.append(nn.Sequential(*children[start:end]))
+        start = end
+    return stages
+
+
+class PipelineModule(nn.Module):
+    r"""
+    PipelineModule supports pipeline-parallel inference across CPUPools.
+
+    The model is split into stages, each stage runs on its own CPUPool as a
+    intel_extension_for_pytorch.cpu.runtime.Task. The inputs are split into
+    micro-batches which stream through the stages concurrently: once a stage
+    finishes a micro-batch, the micro-batch is submitted to the next stage
+    while the stage runs the next micro-batch. The outputs of the last stage
+    are concatenated. The output of a stage is the input of the next stage,
+    a tuple output is unpacked as the positional inputs.
+
+    The time each stage spends on each micro-batch is recorded, which helps to
+    balance the stages. The slowest stage limits the throughput of the
+    pipeline.
+
+    Args:
+        stages (list or torch.nn.Sequential): The modules
+            (torch.jit.ScriptModule or torch.nn.Module) of the stages, or a
+            torch.nn.Sequential split into ``len(cpu_pools)`` stages evenly.
+        cpu_pools (list): The
+            intel_extension_for_pytorch.cpu.runtime.CPUPool object of each
+            stage.
+        num_micro_batches (int): The number of micro-batches the inputs are
+            split into. The default value is 4.
+        input_split_hint (MultiStreamModuleHint): Hint about how to split the
+            inputs into micro-batches.
+        output_concat_hint (MultiStreamModuleHint): Hint about how to concat
+            the outputs of the micro-batches.
+
+    Returns:
+        intel_extension_for_pytorch.cpu.runtime.PipelineModule: Generated
+        intel_extension_for_pytorch.cpu.runtime.PipelineModule object.
+
+    :meta public:
+    """
+
+    def __init__(
+        self,
+        stages,
+        cpu_pools: list,
+        num_micro_batches: int = 4,
+        input_split_hint: MultiStreamModuleHint = default_multi_stream_module_split_hint,
+        output_concat_hint: MultiStreamModuleHint = default_multi_stream_module_concat_hint,
+    ):
+        super(PipelineModule, self).__init__()
+        assert all(
+            type(cpu_pool) is CPUPool for cpu_pool in cpu_pools
+        ), "Input of cpu_pools must be provided with type of ipex.cpu.runtime.CPUPool"
+        if isinstance(stages, nn.Sequential):
+            stages = _split_sequential(stages, len(cpu_pools))
+        assert len(stages) == len(
+            cpu_pools
+        ), "The number of stages {} doesn't match the number of CPUPools {}".format(
+            len(stages), len(cpu_pools)
+        )
+        assert num_micro_batches >= 1, "num_micro_batches should be a positive number"
+        self.stages = nn.ModuleList(stages)
+        self.cpu_pools = cpu_pools
+        self.num_stages = len(stages)
+        self.num_micro_batches = num_micro_batches
+        self.input_split_hint = input_split_hint
+        self.output_hint = _hint_of_output(output_concat_hint)
+        self.tasks = [
+            Task(stage, cpu_pool) for stage, cpu_pool in zip(self.stages, cpu_pools)
+        ]
+        self.stats_lock = threading.Lock()
+        self.reset_stage_stats()
+
+    def reset_stage_stats(self):
+        with self.stats_lock:
+            self.stage_time = [0.0] * self.num_stages
+            self.stage_micro_batches = [0] * self.num_stages
+
+    def get_stage_stats(self):
+        r"""
+        Get the timing of each stage since the creation or the last
+        ``reset_stage_stats``: the number of the micro-batches run
+        (``num_micro_batches``), the total and the mean time in milliseconds
+        spent on them (``total_time_ms`` and ``mean_time_ms``), and the id of
+        the stage with the max total time (``bottleneck_stage``).
+        """
+        with self.stats_lock:
+            stages = [
+                {
+                    "num_micro_batches": count,
+                    "total_time_ms": total * 1000,
+                    "mean_time_ms": total * 1000 / count if count else None,
+                }
+                for total, count in zip(self.stage_time, self.stage_micro_batches)
+            ]
+            bottleneck = max(range(self.num_stages), key=lambda i: self.stage_time[i])
+        return {"stages": stages, "bottleneck_stage": bottleneck}
+
+    def _split_micro_batches(self, args, kwargs):
+        args_hint = _hint_of_args(self.input_split_hint, len(args))
+        kwargs_hint = {
+            key: self.input_split_hint.kwargs.get(key, None) for key in kwargs
+        }
+        batch_size = _batch_size([args_hint, kwargs_hint], [args, kwargs])
+        assert batch_size is not None, "No input is to be split into micro-batches"
+        num_micro_batches = min(self.num_micro_batches, batch_size)
+        sizes = [
+            batch_size // num_micro_batches
+            + (1 if i < batch_size % num_micro_batches else 0)
+            for i in range(num_micro_batches)
+        ]
+        return (
+            _split(args_hint, args, sizes),
+            _split(kwargs_hint, kwargs, sizes),
+            sizes,
+        )
+
+    def forward(self, *args, **kwargs):
+        micro_batch_args, micro_batch_kwargs, sizes = self._split_micro_batches(
+            args, kwargs
+        )
+        num_micro_batches = len(sizes)
+        futures = [Future() for _ in range(num_micro_batches)]
+        # The time each stage finishes its last micro-batch. A stage runs the
+        # micro-batches in order, so a micro-batch starts once both the stage
+        # finishes the previous one and the micro-batch is submitted.
+        last_end_time = [0.0] * self.num_stages
+
+        def submit(stage_id, micro_batch_id, stage_args, stage_kwargs):
+            submit_time = time.perf_counter()
+
+            def callback(output, error):
+                # Invoked in the thread of the stage
+                end_time = time.perf_counter()
+                start_time = max(submit_time, last_end_time[stage_id])
+                last_end_time[stage_id] = end_time
+                with self.stats_lock:
+                    self.stage_time[stage_id] += end_time - start_time
+                    self.stage_micro_batches[stage_id] += 1
+                future = futures[micro_batch_id]
+                if error is not None:
+                    future.set_exception(error)
+                elif stage_id == self.num_stages - 1:
+                    future.set_result(output)
+                else:
+                    next_args = output if isinstance(output, tuple) else (output,)
+                    try:
+                        submit(stage_id + 1, micro_batch_id, next_args, {})
+                    except Exception as e:
+                        future.set_exception(e)
+
+            self.tasks[stage_id].run_async_with_callback(
+                callback, *stage_args, **stage_kwargs
+            )
+
+        for i in range(num_micro_batches):
+            submit(0, i, micro_batch_args[i], micro_batch_kwargs[i])
+        outputs = [future.result() for future in futures]
+        return _concat(self.output_hint, outputs)
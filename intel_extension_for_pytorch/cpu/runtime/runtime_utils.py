@@ -36,3 +36,17 @@ def get_core_list_of_node_id(node_id):
     )
     num_cores_per_node = get_num_cores_per_node()
     return list(range(num_cores_per_node * node_id, num_cores_per_node * (node_id + 1)))
+
+
+def get_node_id_of_core(core_id):
+    r"""
+    Helper function to get the numa node id of the input CPU core.
+
+    Args:
+        core_id (int): Input CPU core id.
+
+    Returns:
+        int: The numa node id which the CPU core is on.
+    """
+
+    return (core_id // get_num_cores_per_node()) % get_num_nodes()
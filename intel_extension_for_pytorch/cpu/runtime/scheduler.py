@@ -0,0 +1,214 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+from .cpupool import CPUPool
+from .task import Task
+
+
+class _ModelEntry(object):
+    def __init__(self, name, tasks, priority, weight):
+        self.name = name
+        self.tasks = tasks
+        self.priority = priority
+        self.weight = weight
+        self.queue = collections.deque()
+        # The pool which ran the model last, preferred for the cache locality
+        self.last_pool = None
+        self.submitted = 0
+        self.completed = 0
+        self.running = 0
+        self.busy_time = 0.0
+
+    def share_key(self):
+        # The busy time per weight, with the running requests charged by the
+        # mean time, so the requests dispatched together are shared fairly too.
+        mean_time = self.busy_time / self.completed if self.completed else 0.0
+        return (
+            (self.busy_time + self.running * mean_time) / self.weight,
+            self.running / self.weight,
+        )
+
+
+class ModelScheduler(object):
+    r"""
+    ModelScheduler runs the requests of multiple models on a shared set of
+    CPUPools, instead of partitioning the cores statically for each model.
+
+    Each CPUPool runs one request at a time. Once a CPUPool is free, it runs
+    the next request of the model with the highest priority among the models
+    with queued requests. The models of the same priority share the CPUPools
+    fairly by their weights: the one with the least busy time divided by its
+    weight runs first. So an idle model doesn't hold any core, and the pools
+    are reassigned to whichever models have backlog.
+
+    Args:
+        cpu_pools (list): The
+            intel_extension_for_pytorch.cpu.runtime.CPUPool objects shared by
+            the models.
+
+    Returns:
+        intel_extension_for_pytorch.cpu.runtime.ModelScheduler: Generated
+        intel_extension_for_pytorch.cpu.runtime.ModelScheduler object.
+
+    :meta public:
+    """
+
+    def __init__(self, cpu_pools: list):
+        assert all(
+            type(cpu_pool) is CPUPool for cpu_pool in cpu_pools
+        ), "Input of cpu_pools must be provided with type of ipex.cpu.runtime.CPUPool"
+        assert len(cpu_pools) > 0, "At least one CPUPool is needed"
+        self.cpu_pools = cpu_pools
+        self.models = {}
+        self.lock = threading.Lock()
+        self.free_pools = list(range(len(cpu_pools)))
+        self.pool_runs = [0] * len(cpu_pools)
+        self.closed = False
+
+    def register(self, name, module, priority: int = 0, weight: float = 1.0):
+        r"""
+        Register a model to be scheduled.
+
+        Args:
+            name (str): The name of the model to submit the requests with.
+            module (torch.jit.ScriptModule or torch.nn.Module): The model. A
+                intel_extension_for_pytorch.cpu.runtime.Task is created for it
+                on each CPUPool.
+            priority (int): The priority class of the model. The requests of
+                the models with a larger priority run first.
+            weight (float): The share of the CPUPools among the models of the
+                same priority.
+        """
+        assert weight > 0, "weight should be a positive number"
+        tasks = [
+            Task(module, cpu_pool, name="{}@pool{}".format(name, i))
+            for i, cpu_pool in enumerate(self.cpu_pools)
+        ]
+        with self.lock:
+            assert name not in self.models, "Model {} is registered".format(name)
+            self.models[name] = _ModelEntry(name, tasks, priority, weight)
+
+    def unregister(self, name):
+        r"""
+        Unregister a model. Its queued requests are cancelled.
+        """
+        with self.lock:
+            entry = self.models.pop(name)
+            queue = list(entry.queue)
+            entry.queue.clear()
+        for _, _, future in queue:
+            future.cancel()
+
+    def submit(self, name, *args, **kwargs):
+        r"""
+        Queue a request of the model ``name``, and return a
+        ``concurrent.futures.Future`` of its output.
+        """
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The ModelScheduler is closed")
+            entry = self.models[name]
+            entry.queue.append((args, kwargs, future))
+            entry.submitted += 1
+            self._dispatch()
+        return future
+
+    def __call__(self, name, *args, **kwargs):
+        return self.submit(name, *args, **kwargs).result()
+
+    def close(self):
+        r"""
+        Stop accepting requests and cancel the queued ones. The running
+        requests still complete.
+        """
+        with self.lock:
+            self.closed = True
+            queues = [list(entry.queue) for entry in self.models.values()]
+            for entry in self.models.values():
+                entry.queue.clear()
+        for queue in queues:
+            for _, _, future in queue:
+                future.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def stats(self):
+        r"""
+        Get the statistics of each model (``models``): the priority, the
+        weight, the number of the submitted, completed, queued and running
+        requests, and the busy time in seconds of the CPUPools on it, and the
+        number of the requests each CPUPool has run (``pool_runs``).
+        """
+        with self.lock:
+            return {
+                "models": {
+                    name: {
+                        "priority": e.priority,
+                        "weight": e.weight,
+                        "submitted": e.submitted,
+                        "completed": e.completed,
+                        "queued": len(e.queue),
+                        "running": e.running,
+                        "busy_seconds": e.busy_time,
+                    }
+                    for name, e in self.models.items()
+                },
+                "pool_runs": list(self.pool_runs),
+            }
+
+    def _next_model(self):
+        # The model with backlog of the highest priority, and the least busy
+        # time per weight among the models of the same priority.
+        candidates = [e for e in self.models.values() if e.queue]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda e: (-e.priority, e.share_key()))
+
+    def _dispatch(self):
+        # Should be called with self.lock held
+        while self.free_pools:
+            entry = self._next_model()
+            if entry is None:
+                return
+            args, kwargs, future = entry.queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            pool_id = (
+                entry.last_pool
+                if entry.last_pool in self.free_pools
+                else self.free_pools[0]
+            )
+            self.free_pools.remove(pool_id)
+            entry.last_pool = pool_id
+            entry.running += 1
+            self.pool_runs[pool_id] += 1
+            self._run(entry, pool_id, future, args, kwargs)
+
+    def _run(self, entry, pool_id, future, args, kwargs):
+        start_time = time.perf_counter()
+
+        def callback(output, error):
+            # Invoked in the thread of the task
+            with self.lock:
+                entry.busy_time += time.perf_counter() - start_time
+                entry.completed += 1
+                entry.running -= 1
+                self.free_pools.append(pool_id)
+                self._dispatch()
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(output)
+
+        try:
+            entry.tasks[pool_id].run_async_with_callback(callback, *args, **kwargs)
+        except Exception as e:
+            entry.running -= 1
+            self.free_pools.append(pool_id)
+            future.set_exception(e)
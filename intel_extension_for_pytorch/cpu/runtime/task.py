@@ -1,6 +1,11 @@
+import asyncio
+import itertools
 import torch
 import intel_extension_for_pytorch as ipex
 from .cpupool import CPUPool
+from . import instrumentation
+
+_task_ids = itertools.count()
 
 
 class Task(object):
@@ -13,14 +18,22 @@ class Task(object):
         cpu_pool (intel_extension_for_pytorch.cpu.runtime.CPUPool): An
             intel_extension_for_pytorch.cpu.runtime.CPUPool object, contains
             all CPU cores used to run Task asynchronously.
+        name (str): The name of the Task in the runtime metrics. The default
+            value is "task_<N>" numbered in the creation order.
+
+    Calling the Task returns a future whose ``get()`` blocks the calling
+    thread until the output is ready. In a coroutine, ``await
+    task.run_async_aio(*args, **kwargs)`` gets the output without blocking
+    the event loop.
 
     Returns:
         intel_extension_for_pytorch.cpu.runtime.Task: Generated
         intel_extension_for_pytorch.cpu.runtime.Task object.
     """
 
-    def __init__(self, module, cpu_pool: CPUPool):
+    def __init__(self, module, cpu_pool: CPUPool, name: str = None):
         self.cpu_pool = cpu_pool
+        self.name = name if name is not None else "task_{}".format(next(_task_ids))
         assert type(self.cpu_pool) is CPUPool
         if isinstance(module, torch.jit.ScriptModule):
             self._task = ipex._C.TaskModule(module._c, self.cpu_pool.cpu_pool, True)
@@ -29,8 +42,66 @@ class Task(object):
 
     def __call__(self, *args, **kwargs):
         # async execution
+        if instrumentation.is_instrumentation_enabled():
+            future = instrumentation._InstrumentedFuture()
+
+            def callback(output, error):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(output)
+
+            self.run_async_with_callback(callback, *args, **kwargs)
+            return future
         return self._task.run_async(*args, **kwargs)
 
     def run_sync(self, *args, **kwargs):
         # sync execution
+        if instrumentation.is_instrumentation_enabled():
+            return self(*args, **kwargs).get()
         return self._task.run_sync(*args, **kwargs)
+
+    def run_async_with_callback(self, callback, *args, **kwargs):
+        r"""
+        Asynchronous execution, ``callback(output, error)`` is invoked in the
+        task thread once the execution finishes. ``error`` is the raised
+        exception or None.
+        """
+        if instrumentation.is_instrumentation_enabled():
+            metrics = instrumentation._get_task_metrics(
+                self.name, self.cpu_pool.core_ids
+            )
+            submit_time = metrics.on_submit()
+            user_callback = callback
+
+            def callback(output, error):
+                metrics.on_complete(submit_time, error is not None)
+                user_callback(output, error)
+
+        self._task.run_async_with_callback(callback, *args, **kwargs)
+
+    def run_async_aio(self, *args, **kwargs):
+        r"""
+        Asynchronous execution for asyncio. Returns an ``asyncio.Future`` of
+        the output, which is completed from the task thread through a callback
+        scheduled on the running event loop. It must be called in the thread
+        running the event loop, e.g. in a coroutine.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_result(output, error):
+            # The waiting coroutine may have been cancelled
+            if future.cancelled():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(output)
+
+        def callback(output, error):
+            # Invoked in the task thread
+            loop.call_soon_threadsafe(set_result, output, error)
+
+        self.run_async_with_callback(callback, *args, **kwargs)
+        return future
@@ -207,6 +207,17 @@ void InitIpexModuleBindings(py::module m) {
             // Depending on this being ScriptModule of nn.Module we will release
             // the GIL or not further down in the stack
             return self.run_async(std::move(args), std::move(kwargs));
+          })
+      .def(
+          "run_async_with_callback",
+          [](torch_ipex::runtime::TaskModule& self,
+             py::object& callback,
+             py::args& args,
+             py::kwargs& kwargs) {
+            // The callback is invoked with (output, error) in the executor
+            // thread once the task finishes
+            self.run_async_with_callback(
+                std::move(callback), std::move(args), std::move(kwargs));
           });
 
   m.def(
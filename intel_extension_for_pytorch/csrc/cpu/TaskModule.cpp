@@ -3,6 +3,35 @@
 namespace torch_ipex {
 namespace runtime {
 
+namespace {
+// The tasks are destroyed in the executor thread without the GIL, the Python
+// objects captured by them must be released with the GIL held.
+std::shared_ptr<py::object> make_gil_safe_object(py::object obj) {
+  return std::shared_ptr<py::object>(
+      new py::object(std::move(obj)), [](py::object* p) {
+        pybind11::gil_scoped_acquire gil_guard;
+        delete p;
+      });
+}
+
+py::object make_runtime_error(const char* msg) {
+  return py::reinterpret_borrow<py::object>(PyExc_RuntimeError)(msg);
+}
+
+// Should be called with the GIL held.
+void invoke_callback(
+    const py::object& callback,
+    const py::object& output,
+    const py::object& error) {
+  try {
+    callback(output, error);
+  } catch (py::error_already_set& e) {
+    // No caller to raise the error to in the executor thread.
+    e.discard_as_unraisable(__func__);
+  }
+}
+} // namespace
+
 py::object FutureTensor::get() {
   CHECK(this->script_module_initialized_ ^ this->module_initialized_);
   if (this->script_module_initialized_) {
@@ -131,6 +160,76 @@ std::unique_ptr<FutureTensor> TaskModule::run_async(
   return future_tensor_result;
 }
 
+void TaskModule::run_async_with_callback(
+    py::object&& callback,
+    py::args&& args,
+    py::kwargs&& kwargs) {
+  CHECK(this->script_module_initialized_ ^ this->module_initialized_);
+  auto grad_mode = at::GradMode::is_enabled();
+  auto callback_ptr = make_gil_safe_object(std::move(callback));
+  std::function<void()> task;
+  if (this->script_module_initialized_) {
+    auto* function = &script_module_.get_method("forward").function();
+    auto stack = std::make_shared<std::vector<at::IValue>>(
+        torch::jit::createStackForSchema(
+            function->getSchema(),
+            std::move(args),
+            // NOLINTNEXTLINE(performance-move-const-arg)
+            std::move(kwargs),
+            script_module_._ivalue()));
+    task = [function, stack, callback_ptr, grad_mode]() {
+      at::GradMode::set_enabled(grad_mode);
+      c10::IValue res;
+      std::string error_msg;
+      bool failed = false;
+      try {
+        res = (*function)(std::move(*stack));
+      } catch (const std::exception& e) {
+        failed = true;
+        error_msg = e.what();
+      }
+      pybind11::gil_scoped_acquire gil_guard;
+      if (failed) {
+        invoke_callback(
+            *callback_ptr, py::none(), make_runtime_error(error_msg.c_str()));
+      } else {
+        invoke_callback(
+            *callback_ptr, torch::jit::toPyObject(std::move(res)), py::none());
+      }
+    };
+  } else {
+    CHECK(this->module_initialized_);
+    // Captured by value, the concurrent calls don't share the inputs.
+    auto module_ptr = make_gil_safe_object(this->module_);
+    auto args_ptr = make_gil_safe_object(std::move(args));
+    auto kwargs_ptr = make_gil_safe_object(std::move(kwargs));
+    task = [module_ptr, args_ptr, kwargs_ptr, callback_ptr, grad_mode]() {
+      at::GradMode::set_enabled(grad_mode);
+      pybind11::gil_scoped_acquire gil_guard;
+      py::object output = py::none();
+      py::object error = py::none();
+      try {
+        output = (*module_ptr)(*(*args_ptr), **(*kwargs_ptr));
+      } catch (py::error_already_set& e) {
+        error = e.value();
+      } catch (const std::exception& e) {
+        error = make_runtime_error(e.what());
+      }
+      invoke_callback(*callback_ptr, output, error);
+    };
+  }
+
+  {
+    std::unique_lock<std::mutex> lock(this->task_executor->get_mutex());
+    // submit task to a stopping the pool is not allowed
+    if (this->task_executor->is_stop())
+      throw std::runtime_error(
+          "submit TaskModule(py::object) on stopped ThreadPool");
+    this->task_executor->get_tasks().emplace(std::move(task));
+  }
+  this->task_executor->get_condition().notify_one();
+}
+
 py::object TaskModule::run_sync(py::args&& args, py::kwargs&& kwargs) {
   // sync API to run application inside task
   std::unique_ptr<FutureTensor> future_tensor_result =
@@ -46,6 +46,11 @@ class TORCH_API TaskModule {
   std::unique_ptr<FutureTensor> run_async(
       py::args&& args,
       py::kwargs&& kwargs); /*async execution in threadpool*/
+  void run_async_with_callback(
+      py::object&& callback,
+      py::args&& args,
+      py::kwargs&& kwargs); /*async execution, callback(output, error) with
+                               the GIL held in the threadpool once finished*/
  private:
   // Script module input
   torch::jit::Module script_module_;
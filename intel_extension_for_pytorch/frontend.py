@@ -1,5 +1,10 @@
 # This Python file uses the following encoding: utf-8
 import copy
+import itertools
+import logging
+import os
+import statistics
+import time
 import warnings
 
 import torch
@@ -19,6 +24,16 @@ from .cpu.graph_capture import GraphCapture
 from .nn.utils._lstm_convert import _LSTM, replace_lstm_with_ipex_lstm
 from .nn.utils._weight_prepack import _IPEXConv1d, _IPEXConv2d, _IPEXConv3d, _IPEXConvTranspose2d, _IPEXConvTranspose3d, _IPEXLinear
 from .nn.utils._weight_prepack import weight_prepack_with_ipex, record_input_shape_for_prepack
+from .nn.utils._weight_prepack import (
+    prepack_variants_with_ipex,
+    record_input_shapes_for_prepack,
+)
+from .nn.utils._optimize_cache import (
+    _sample_input_signature,
+    get_optimize_cache_path,
+    load_optimized_model,
+    save_optimized_model,
+)
 from .cpu._auto_kernel_selection import (
     _enable_dnnl,
     _disable_dnnl,
@@ -28,8 +43,20 @@ from .fx.concat_linear import _concat_linear
 import intel_extension_for_pytorch._C as core
 
 
-def _copy_model_and_optimizer(model, optimizer):
-    new_model = copy.deepcopy(model)
+def _copy_model_and_optimizer(model, optimizer, share_weights=False):
+    if share_weights:
+        # Pre-populate the memo so that the copied model gets new parameter and
+        # buffer objects sharing the storages with the original ones. The passes
+        # only rebind the data of the parameters they rewrite, the original
+        # model is left untouched.
+        memo = {}
+        for p in model.parameters():
+            memo[id(p)] = torch.nn.Parameter(p.detach(), requires_grad=p.requires_grad)
+        for b in model.buffers():
+            memo[id(b)] = b.detach()
+        new_model = copy.deepcopy(model, memo)
+    else:
+        new_model = copy.deepcopy(model)
     if optimizer is None:
         return new_model, optimizer
     else:
@@ -155,6 +182,94 @@ class _O1:
 
 opt_levels = {"O0": _O0(), "O1": _O1()}
 
+logger = logging.getLogger(__name__)
+
+
+_AUTO_TUNE_KNOBS = ["auto_kernel_selection", "concat_linear", "graph_mode"]
+_AUTO_TUNE_WARMUP_ITERS = 3
+_AUTO_TUNE_ITERS = 10
+
+
+def _benchmark_latency(model, sample_input, dtype):
+    with torch.no_grad(), torch.cpu.amp.autocast(
+        enabled=dtype in (torch.bfloat16, torch.half),
+        dtype=dtype if dtype is not None else torch.bfloat16,
+    ):
+        for _ in range(_AUTO_TUNE_WARMUP_ITERS):
+            model(*sample_input)
+        latencies = []
+        for _ in range(_AUTO_TUNE_ITERS):
+            start = time.perf_counter()
+            model(*sample_input)
+            latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1000
+
+
+def _auto_optimize(**kwargs):
+    # Optimize the model with level "O1" and each combination of the knobs in
+    # _AUTO_TUNE_KNOBS not set by the user, then with the fastest one on
+    # sample_input.
+    model = kwargs["model"]
+    sample_input = kwargs["sample_input"]
+    kwargs["level"] = "O1"
+    if isinstance(model, torch.jit.ScriptModule):
+        return optimize(**kwargs)
+    if model.training or kwargs["optimizer"] is not None or sample_input is None:
+        warnings.warn(
+            "level 'auto' only works for inference model with sample_input given, "
+            + "falling back to level 'O1'."
+        )
+        return optimize(**kwargs)
+    if any(p.device.type != "cpu" for p in model.parameters()):
+        warnings.warn("level 'auto' only works on CPU, falling back to level 'O1'.")
+        return optimize(**kwargs)
+
+    if isinstance(sample_input, torch.Tensor):
+        sample_input = (sample_input,)
+    tuned_knobs = [k for k in _AUTO_TUNE_KNOBS if kwargs[k] is None]
+    candidates = []
+    for values in itertools.product([False, True], repeat=len(tuned_knobs)):
+        knobs = dict(zip(tuned_knobs, values))
+        candidate_kwargs = dict(
+            kwargs, inplace=False, share_weights=True, cache_dir=None
+        )
+        candidate_kwargs.update(knobs)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                candidate = optimize(**candidate_kwargs)
+                latency = _benchmark_latency(candidate, sample_input, kwargs["dtype"])
+        except Exception as e:
+            candidates.append({"knobs": knobs, "latency_ms": None, "error": str(e)})
+            continue
+        finally:
+            candidate = None
+        candidates.append({"knobs": knobs, "latency_ms": latency})
+
+    measured = [c for c in candidates if c["latency_ms"] is not None]
+    if len(measured) == 0:
+        warnings.warn(
+            "level 'auto' fails to run any candidate, falling back to level 'O1'."
+        )
+        return optimize(**kwargs)
+    best = min(measured, key=lambda c: c["latency_ms"])
+    for c in candidates:
+        if c["latency_ms"] is None:
+            logger.info(f"ipex.optimize auto: {c['knobs']} failed: {c['error']}")
+        else:
+            logger.info(f"ipex.optimize auto: {c['knobs']} {c['latency_ms']:.3f} ms")
+    logger.info(f"ipex.optimize auto: choose {best['knobs']}")
+
+    kwargs.update(best["knobs"])
+    optimized = optimize(**kwargs)
+    optimized_model = optimized[0] if isinstance(optimized, tuple) else optimized
+    setattr(  # noqa: B010
+        optimized_model,
+        "auto_tune_report",
+        {"knobs": best["knobs"], "candidates": candidates},
+    )
+    return optimized
+
 
 def optimize(
     model,
@@ -173,6 +288,12 @@ def optimize(
     sample_input=None,
     graph_mode=None,
     concat_linear=None,
+    cache_dir=None,
+    share_weights=False,
+    weights_prepack_num_workers=1,
+    lazy_weights_prepack=False,
+    sample_inputs=None,
+    prepack_memory_budget=None,
 ):
     r"""
     Apply optimizations at Python frontend to the given model (nn.Module), as
@@ -208,13 +329,21 @@ def optimize(
             of ``nn.Embedding`` and ``nn.LSTM``.
         optimizer (torch.optim.Optimizer): User optimizer to apply optimizations
             on, such as SGD. The default value is ``None``, meaning inference case.
-        level (string): ``"O0"`` or ``"O1"``. No optimizations are applied with
-            ``"O0"``. The optimizer function just returns the original model and
-            optimizer. With ``"O1"``, the following optimizations are applied:
-            conv+bn folding, weights prepack, dropout removal (inferenc model),
-            master weight split and fused optimizer update step (training model).
-            The optimization options can be further overridden by setting the
-            following options explicitly. The default value is ``"O1"``.
+        level (string): ``"O0"``, ``"O1"`` or ``"auto"``. No optimizations are
+            applied with ``"O0"``. The optimizer function just returns the
+            original model and optimizer. With ``"O1"``, the following
+            optimizations are applied: conv+bn folding, weights prepack, dropout
+            removal (inferenc model), master weight split and fused optimizer
+            update step (training model). ``"auto"`` [experimental] starts from
+            ``"O1"`` and measures the latency of ``sample_input`` with each
+            combination of ``auto_kernel_selection``, ``concat_linear`` and
+            ``graph_mode`` not set explicitly, then returns the model optimized
+            with the fastest one. The measured latencies are logged and stored
+            in ``auto_tune_report`` of the returned model. ``"auto"`` only works
+            for inference model on CPU with ``sample_input`` given, otherwise
+            it falls back to ``"O1"``. The optimization options can be further
+            overridden by setting the following options explicitly. The default
+            value is ``"O1"``.
         inplace (bool): Whether to perform inplace optimization. Default value is
             ``False``.
         conv_bn_folding (bool): Whether to perform ``conv_bn`` folding. It only
@@ -259,11 +388,58 @@ def optimize(
             ``True``. You might get better performance at the cost of extra memory usage.
             The default value is ``None``. Explicitly setting this knob overwrites the
             configuration set by ``level`` knob.
-        graph_mode: (bool) [experimental]: It will automatically apply a combination of methods
-            to generate graph or multiple subgraphs if True. The default value is ``False``.
+        graph_mode: (bool or str) [experimental]: It will automatically apply a combination of methods
+            to generate graph or multiple subgraphs if True. If ``"async"``, the graphs are
+            generated on a background thread, and the inputs are run in eager mode until
+            the graph of their signature is ready. The default value is ``False``.
         concat_linear (bool): Whether to perform ``concat_linear``. It only
             works for inference model. The default value is ``None``. Explicitly
             setting this knob overwrites the configuration set by ``level`` knob.
+        cache_dir (str) [experimental]: A directory to cache the optimized model
+            in. The cache is keyed by the model structure and weights, ``dtype``,
+            the optimization knobs, the shapes of ``sample_input``, the detected
+            ISA and the versions of PyTorch and Intel® Extension for PyTorch*. On
+            a cache hit, the folded and prepacked model is loaded from the cache
+            directly and all the optimization passes are skipped, in which case
+            ``inplace`` doesn't take effect. With ``graph_mode``, the graphs
+            generated for each input signature are cached in it as well, and
+            loaded instead of being generated again. It only works for inference
+            model on CPU. The cached models are unpickled on loading, so only use
+            a trusted directory. The default value is ``None``, meaning no cache
+            is used.
+        share_weights (bool) [experimental]: Whether to share the parameters
+            and buffers with the original model instead of deep-copying them
+            when ``inplace`` is ``False``. Only the modules rewritten by the
+            optimization passes (e.g. folded or prepacked ones) get new storages,
+            which cuts the peak memory of ``ipex.optimize`` for large models. Note
+            that in-place updates on the shared tensors are visible in both
+            models. It only works for inference model. The default value is
+            ``False``.
+        weights_prepack_num_workers (int) [experimental]: The number of threads
+            to prepack the weights of different modules with. The OpenMP threads
+            are evenly shared among them during prepacking. The time each module
+            takes is recorded in ``weight_prepack_timing`` of the returned model.
+            The default value is ``1``.
+        lazy_weights_prepack (bool) [experimental]: Whether to defer the weight
+            prepack of each module to its first forward. It reduces the time of
+            ``ipex.optimize`` and only spends the memory of prepacked weights on
+            the modules actually executed. If ``sample_input`` is not given, the
+            input of the first forward is used to choose the prepacked format.
+            The module must run once in eager mode before ``torch.jit.trace``.
+            It only works for inference model without ``graph_mode``. The
+            default value is ``False``.
+        sample_inputs (list) [experimental]: A list of sample inputs in the same
+            form as ``sample_input``, for models serving very different input
+            shapes. Besides the weight packed for the first sample input (or
+            ``sample_input`` if given), a variant is prepacked for each of the
+            other distinct input shapes, and the inference dispatches to the
+            variant of the recorded shape nearest to the real input. It only
+            works for inference model in eager mode. The default value is
+            ``None``.
+        prepack_memory_budget (int) [experimental]: The memory budget in bytes
+            of the variants prepacked for ``sample_inputs``. The least recently
+            used variants are evicted if exceeding the budget, and prepacked
+            again when needed. The default value is ``None``, meaning unlimited.
 
     Returns:
         Model and optimizer (if given) modified according to the ``level`` knob
@@ -318,6 +494,9 @@ def optimize(
         >>> # running training step.
 
     """
+    if level == "auto":
+        return _auto_optimize(**locals())
+
     if isinstance(model, torch.jit.ScriptModule):
         if optimizer is None:
             return model
@@ -331,7 +510,7 @@ def optimize(
     opt_properties = _Properties()
     if level not in opt_levels:
         raise RuntimeError(
-            f"Unexpected optimization level {level}. Options are 'O0', 'O1'."
+            f"Unexpected optimization level {level}. Options are 'O0', 'O1', 'auto'."
         )
     else:
         opt_properties = opt_levels[level](opt_properties)
@@ -425,24 +604,95 @@ def optimize(
             )
             opt_properties.weights_prepack = False
             sample_input = None
+            sample_inputs = None
         if opt_properties.optimize_lstm is not None:
             warnings.warn(
                 "For XPU, the optimize_lstm(replace lstm with ipex_lstm) is unsupported, so disable it"
             )
             opt_properties.optimize_lstm = False
 
+    if lazy_weights_prepack and (
+        model.training or optimizer is not None or opt_properties.graph_mode
+    ):
+        warnings.warn(
+            "lazy_weights_prepack only works for inference model without graph_mode, "
+            + "the weights are prepacked eagerly instead."
+        )
+        lazy_weights_prepack = False
+
+    cache_path = None
+    if cache_dir is not None:
+        if device_type != "cpu" or model.training or optimizer is not None:
+            warnings.warn(
+                "The optimize cache only supports inference model on CPU, so cache_dir is ignored."
+            )
+        else:
+            cache_path = get_optimize_cache_path(
+                cache_dir,
+                model,
+                dtype,
+                opt_properties,
+                sample_input,
+                {
+                    "lazy_weights_prepack": lazy_weights_prepack,
+                    "sample_inputs": [
+                        _sample_input_signature(x) for x in sample_inputs or []
+                    ],
+                    "prepack_memory_budget": prepack_memory_budget,
+                },
+            )
+            optimized_model = load_optimized_model(cache_path)
+            if optimized_model is not None:
+                if opt_properties.optimize_lstm:
+                    torch._dynamo.allow_in_graph(_LSTM)
+                if opt_properties.weights_prepack:
+                    _allow_prepack_modules_in_graph()
+                if opt_properties.graph_mode:
+                    _apply_graph_capture(
+                        optimized_model,
+                        False,
+                        dtype,
+                        opt_properties.weights_prepack,
+                        opt_properties.graph_mode,
+                        cache_path,
+                    )
+                return optimized_model
+
     if inplace:
         optimized_model = model
         optimized_optimizer = optimizer
     else:
+        if share_weights and (model.training or optimizer is not None):
+            warnings.warn(
+                "share_weights only works for inference model, the model is deep-copied instead."
+            )
+            share_weights = False
         optimized_model, optimized_optimizer = _copy_model_and_optimizer(
-            model, optimizer
+            model, optimizer, share_weights
         )
 
+    if sample_inputs:
+        if model.training or optimizer is not None or opt_properties.graph_mode:
+            warnings.warn(
+                "The weights are only prepacked for one of sample_inputs since it "
+                + "only works for inference model without graph_mode."
+            )
+            if sample_input is None:
+                sample_input = sample_inputs[0]
+            sample_inputs = None
+        else:
+            if sample_input is not None:
+                sample_inputs = [sample_input] + list(sample_inputs)
+            sample_input = None
     if sample_input is not None:
         if isinstance(sample_input, torch.Tensor):
             sample_input = (sample_input,)
         record_input_shape_for_prepack(optimized_model, sample_input)
+    if sample_inputs:
+        sample_inputs = [
+            (x,) if isinstance(x, torch.Tensor) else x for x in sample_inputs
+        ]
+        record_input_shapes_for_prepack(optimized_model, sample_inputs)
     params_attr = {}
     if not model.training:
         if opt_properties.conv_bn_folding:
@@ -551,25 +801,37 @@ def optimize(
             optimized_optimizer,
             params_attr,
         ) = weight_prepack_with_ipex(
-            optimized_model, optimized_optimizer, params_attr, "cpu"
+            optimized_model,
+            optimized_optimizer,
+            params_attr,
+            "cpu",
+            weights_prepack_num_workers,
+            lazy_weights_prepack,
         )
-        torch._dynamo.allow_in_graph(_IPEXConv1d)
-        torch._dynamo.allow_in_graph(_IPEXConv2d)
-        torch._dynamo.allow_in_graph(_IPEXConv3d)
-        torch._dynamo.allow_in_graph(_IPEXConvTranspose2d)
-        torch._dynamo.allow_in_graph(_IPEXConvTranspose3d)
-        torch._dynamo.allow_in_graph(_IPEXLinear)
+        _allow_prepack_modules_in_graph()
+        if sample_inputs:
+            prepack_variants_with_ipex(
+                optimized_model, prepack_memory_budget, not lazy_weights_prepack
+            )
 
+    if cache_path is not None:
+        if opt_properties.weights_prepack:
+            state_dict_mode = "prepack"
+        elif len(params_attr) != 0:
+            state_dict_mode = "inference"
+        else:
+            state_dict_mode = None
+        save_optimized_model(optimized_model, params_attr, state_dict_mode, cache_path)
 
     if opt_properties.graph_mode:
-        _old_forward = optimized_model.forward
-        wrapper = GraphCapture(
+        _apply_graph_capture(
             optimized_model,
             optimizer is not None,
             dtype,
             opt_properties.weights_prepack,
+            opt_properties.graph_mode,
+            cache_path,
         )
-        optimized_model.forward = wrapper(_old_forward)
 
     if optimizer is None:
         return optimized_model
@@ -584,6 +846,36 @@ def optimize(
     return optimized_model, optimized_optimizer
 
 
+def _allow_prepack_modules_in_graph():
+    torch._dynamo.allow_in_graph(_IPEXConv1d)
+    torch._dynamo.allow_in_graph(_IPEXConv2d)
+    torch._dynamo.allow_in_graph(_IPEXConv3d)
+    torch._dynamo.allow_in_graph(_IPEXConvTranspose2d)
+    torch._dynamo.allow_in_graph(_IPEXConvTranspose3d)
+    torch._dynamo.allow_in_graph(_IPEXLinear)
+
+
+def _apply_graph_capture(
+    model, train, dtype, weights_prepack, graph_mode, cache_path=None
+):
+    _old_forward = model.forward
+    # The graphs are cached along with the optimized model they are generated from
+    cache_dir, cache_prefix = None, None
+    if cache_path is not None:
+        cache_dir = os.path.dirname(cache_path)
+        cache_prefix = os.path.splitext(os.path.basename(cache_path))[0]
+    wrapper = GraphCapture(
+        model,
+        train,
+        dtype,
+        weights_prepack,
+        async_compile=graph_mode == "async",
+        cache_dir=cache_dir,
+        cache_prefix=cache_prefix,
+    )
+    model.forward = wrapper(_old_forward)
+
+
 def _convert_convNd_deconvNd_weight_memory_format(module):
     # inspired from https://github.com/pytorch/pytorch/blob/master/torch/nn/utils/memory_format.py
     if isinstance(module, (torch.nn.Conv1d, torch.nn.ConvTranspose1d)):
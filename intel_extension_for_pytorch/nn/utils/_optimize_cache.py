@@ -0,0 +1,167 @@
+import hashlib
+import logging
+import os
+import tempfile
+import warnings
+
+import torch
+import intel_extension_for_pytorch._C as core
+from ._parameter_wrapper import patch_state_dict
+
+logger = logging.getLogger(__name__)
+
+# Bump it whenever the layout of the cached file changes.
+_OPTIMIZE_CACHE_FORMAT = 1
+
+
+def _hash_tensor(hasher, tensor):
+    t = tensor.detach()
+    hasher.update(f"{t.dtype}:{tuple(t.shape)}".encode())
+    if t.numel() == 0:
+        return
+    # contiguous() drops the memory format, so the hash only depends on the values
+    t = t.contiguous().reshape(-1)
+    if t.dtype == torch.bool:
+        t = t.to(torch.uint8)
+    hasher.update(t.view(torch.uint8).numpy())
+
+
+def _sample_input_signature(sample_input):
+    if sample_input is None:
+        return "None"
+    if isinstance(sample_input, torch.Tensor):
+        sample_input = (sample_input,)
+    return str(
+        [
+            (tuple(x.shape), str(x.dtype)) if isinstance(x, torch.Tensor) else repr(x)
+            for x in sample_input
+        ]
+    )
+
+
+def get_optimize_cache_path(
+    cache_dir, model, dtype, opt_properties, sample_input, options=None
+):
+    r"""
+    Get the file path in ``cache_dir`` which the result of ``ipex.optimize`` is
+    stored to. The key is made of the model structure, the model weights, the
+    dtype, the optimization knobs (``opt_properties`` and the other ``options``
+    affecting the result), the sample input shapes, the detected ISA and the
+    versions of torch and Intel® Extension for PyTorch*.
+    """
+    import intel_extension_for_pytorch as ipex
+
+    hasher = hashlib.sha256()
+    meta = [
+        f"format:{_OPTIMIZE_CACHE_FORMAT}",
+        f"torch:{torch.__version__}",
+        f"ipex:{ipex.__version__}",
+        f"isa:{core._get_current_isa_level()}",
+        f"dtype:{dtype}",
+        f"properties:{sorted(vars(opt_properties).items())}",
+        f"options:{sorted((options or {}).items())}",
+        f"sample_input:{_sample_input_signature(sample_input)}",
+        f"structure:{model}",
+    ]
+    for m in model.modules():
+        meta.append(f"{type(m).__module__}.{type(m).__qualname__}")
+    for line in meta:
+        hasher.update(line.encode())
+    for name, param in model.named_parameters():
+        hasher.update(name.encode())
+        _hash_tensor(hasher, param)
+    for name, buf in model.named_buffers():
+        hasher.update(name.encode())
+        _hash_tensor(hasher, buf)
+    return os.path.join(cache_dir, f"ipex_optimize_{hasher.hexdigest()}.pt")
+
+
+def _prepacked_wrappers(model):
+    for m in model.modules():
+        wrapper = getattr(m, "weight_wrapper", None)
+        if wrapper is None or wrapper.op_ctx is None:
+            continue
+        # The MKL sgemm context does not share the storage with the weight.
+        if not getattr(m, "use_dnnl", True):
+            continue
+        yield m, wrapper
+
+
+def save_optimized_model(model, params_attr, state_dict_mode, path):
+    r"""
+    Store the optimized model to ``path``. The patched ``state_dict`` method is
+    not picklable, it is detached during saving and patched again by
+    ``load_optimized_model``. Failures are reported as warnings since the cache
+    is only an accelerator of ``ipex.optimize``.
+    """
+    stashed_attrs = {}
+    stashed_weights = []
+    for attr in ("state_dict", "_original_state_dict"):
+        if attr in model.__dict__:
+            stashed_attrs[attr] = model.__dict__.pop(attr)
+    try:
+        # The packed weight shares the storage with the op context, which is
+        # serialized by itself. Skip the duplicated copy in the file.
+        with torch.no_grad():
+            for _, wrapper in _prepacked_wrappers(model):
+                stashed_weights.append((wrapper.parameter, wrapper.parameter.data))
+                wrapper.parameter.data = torch.empty(
+                    0, dtype=wrapper.parameter.dtype
+                )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                torch.save(
+                    {
+                        "format": _OPTIMIZE_CACHE_FORMAT,
+                        "model": model,
+                        "params_attr": params_attr,
+                        "state_dict_mode": state_dict_mode,
+                    },
+                    f,
+                )
+            # Atomic rename, concurrent replicas never see a partial file.
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.debug(f"ipex.optimize result is cached to {path}")
+    except Exception as e:
+        warnings.warn(f"Failed to cache the optimized model to {path}: {e}")
+    finally:
+        with torch.no_grad():
+            for param, data in stashed_weights:
+                param.data = data
+        model.__dict__.update(stashed_attrs)
+
+
+def load_optimized_model(path):
+    r"""
+    Load the optimized model stored by ``save_optimized_model``. Returns
+    ``None`` if there is no usable cache in ``path``.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        # The whole optimized model is unpickled, the cache directory must be
+        # trusted.
+        cached = torch.load(path, weights_only=False)
+    except Exception as e:
+        warnings.warn(f"Failed to load the cached optimized model from {path}: {e}")
+        return None
+    if not isinstance(cached, dict) or cached.get("format") != _OPTIMIZE_CACHE_FORMAT:
+        warnings.warn(f"{path} is not a cached optimized model of this version.")
+        return None
+    model = cached["model"]
+    with torch.no_grad():
+        for _, wrapper in _prepacked_wrappers(model):
+            # The op context is rebuilt from its plain weight on loading,
+            # share the packed weight with the parameter as weight prepack does.
+            wrapper.parameter.data = wrapper.op_ctx.get_weight()
+    if cached["state_dict_mode"] is not None:
+        patch_state_dict(model, cached["params_attr"], cached["state_dict_mode"])
+    logger.debug(f"ipex.optimize result is loaded from {path}")
+    return model
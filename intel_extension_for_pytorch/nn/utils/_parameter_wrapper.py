@@ -412,11 +412,15 @@ class ParameterWrapper(object):
 
     def prepack(self, module, is_training):
         self.plain_format_shape = module.weight.shape
-        if module.__class__ not in IPEX_WEIGHT_PREPACK_MODULE_CPU():
+        if module.__class__ in IPEX_WEIGHT_PREPACK_MODULE_CPU().values():
+            # lazily prepacked module, which is already converted
+            target_module = module.__class__
+        elif module.__class__ in IPEX_WEIGHT_PREPACK_MODULE_CPU():
+            target_module = IPEX_WEIGHT_PREPACK_MODULE_CPU()[module.__class__]
+        else:
             raise ValueError(
                 "Cannot prepack module with class {}".format(module.__class__)
             )
-        target_module = IPEX_WEIGHT_PREPACK_MODULE_CPU()[module.__class__]
         if target_module in (
             _IPEXConv1d,
             _IPEXConv2d,
@@ -506,7 +510,9 @@ class ParameterWrapper(object):
         self.pack_weight()
 
     def linear_prepack(self, module, is_training):
-        if module.__class__ in IPEX_GEMM_MODULE_CPU():
+        if module.__class__ in IPEX_GEMM_MODULE_CPU() or isinstance(
+            module, _IPEXLinear
+        ):
             if module.weight.dtype == torch.half:
                 use_dnnl = True
             elif (
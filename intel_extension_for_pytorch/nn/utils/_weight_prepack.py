@@ -2,8 +2,13 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import logging
+import math
 import os
+import threading
+import time
 import pkg_resources
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from intel_extension_for_pytorch import optim
 
 logger = logging.getLogger(__name__)
@@ -60,9 +65,143 @@ def _ipex_module_load_from_state_dict_(self, state_dict, prefix):
         loaded_bias = state_dict[b_name]
         self.bias_wrapper.load(self, loaded_bias)
     self.weight_wrapper.load(self, loaded_weight)
+    if getattr(self, "prepack_variants", None) is not None:
+        self.prepack_variants.invalidate(self)
+
+
+class _PrepackVariantCache(object):
+    r"""
+    Holds the weights of the modules prepacked for the input shapes other than
+    the one in their ``ctx``, within ``memory_budget`` bytes (unlimited if
+    ``None``). The least recently used variants are evicted first, and are
+    prepacked again when they are needed.
+    """
+
+    def __init__(self, memory_budget=None):
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # (module, key) -> (op context, size in bytes)
+        self._ctxs = OrderedDict()
+
+    def __getstate__(self):
+        # The variants are prepacked again on demand after copying
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_ctxs"] = OrderedDict()
+        state["memory_used"] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ctxs)
+
+    def get(self, module, key):
+        # Hits only take the lock to update the LRU order and the counter, the
+        # prepacking of a miss is done outside of it, so that the concurrent
+        # forwards of the model (e.g. in MultiStreamModule) are not serialized.
+        with self._lock:
+            entry = self._ctxs.get((module, key))
+            if entry is not None:
+                self._ctxs.move_to_end((module, key))
+                self.hits += 1
+                return entry[0]
+        nbytes = module.weight.numel() * module.weight.element_size()
+        if self.memory_budget is not None and nbytes > self.memory_budget:
+            with self._lock:
+                self.misses += 1
+            return None
+        # Prepack outside the lock, only the insertion is serialized
+        with torch.no_grad():
+            ctx = module._prepack_variant(key)
+        with self._lock:
+            self.misses += 1
+            if ctx is None:
+                return None
+            entry = self._ctxs.get((module, key))
+            if entry is not None:
+                # prepacked by another thread meanwhile
+                return entry[0]
+            while (
+                self.memory_budget is not None
+                and self.memory_used + nbytes > self.memory_budget
+            ):
+                _, (_, evicted_nbytes) = self._ctxs.popitem(last=False)
+                self.memory_used -= evicted_nbytes
+                self.evictions += 1
+            self._ctxs[(module, key)] = (ctx, nbytes)
+            self.memory_used += nbytes
+            return ctx
+
+    def invalidate(self, module):
+        with self._lock:
+            for k in [k for k in self._ctxs if k[0] is module]:
+                self.memory_used -= self._ctxs.pop(k)[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "variants": len(self._ctxs),
+                "memory_used": self.memory_used,
+                "memory_budget": self.memory_budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Serializes the first-use prepacking of the lazily prepacked modules.
+_lazy_prepack_lock = threading.Lock()
 
 
 class _IPEXPrepackModule(nn.Module):
+    # The _PrepackVariantCache holding the weights prepacked for the other
+    # input shapes, set by prepack_variants_with_ipex.
+    prepack_variants = None
+
+    def _maybe_prepack(self, x):
+        # ctx is None only if the module is converted with lazy_weights_prepack,
+        # the weight is prepacked on the first forward in this case.
+        if self.ctx is not None:
+            return
+        with _lazy_prepack_lock:
+            if self.ctx is not None:
+                return
+            if torch.jit.is_tracing():
+                raise RuntimeError(
+                    "The lazily prepacked module {} should be run in eager mode "
+                    "before being traced".format(self.__class__.__name__)
+                )
+            if not hasattr(self, "input_shape"):
+                self.input_shape = x.shape
+            with torch.no_grad():
+                self.weight_wrapper.prepack(self, False)
+            self.ctx = self.weight_wrapper.op_ctx
+
+    def _get_ctx(self, x):
+        # Dispatch to the weight prepacked for the recorded input shape nearest
+        # to the one of x, see prepack_variants_with_ipex. Only the eager real
+        # tensors are dispatched, the traced graphs always use self.ctx.
+        variants = self.prepack_variants
+        if (
+            variants is None
+            or self.training
+            or torch.jit.is_tracing()
+            or type(x) is not torch.Tensor
+        ):
+            return self.ctx
+        key = self._prepack_variant_key(x.shape)
+        if key is None:
+            return self.ctx
+        ctx = variants.get(self, key)
+        return self.ctx if ctx is None else ctx
+
     def _get_forward_weight(self):
         return self.weight if self.training else self._ipex_module_empty_weight_tensor
 
@@ -119,22 +258,13 @@ class _IPEXConvNd(_IPEXPrepackModule):
         # Since autograd requires that grad shape to match the input tensor shape in the forward func,
         # we can't use empty tensor here.
         if self.padding_mode != "zeros":
-            return torch.ops.torch_ipex.convolution_forward(
-                F.pad(x, self._reversed_padding_repeated_twice, mode=self.padding_mode),
-                self._get_forward_weight(),
-                self._get_forward_bias(),
-                self.ctx.get_data_handle(),
-                self.weight_size,
-                self._real_padding,
-                self.stride,
-                self.dilation,
-                self.weight_channels_last,
-            )
+            x = F.pad(x, self._reversed_padding_repeated_twice, mode=self.padding_mode)
+        self._maybe_prepack(x)
         return torch.ops.torch_ipex.convolution_forward(
             x,
             self._get_forward_weight(),
             self._get_forward_bias(),
-            self.ctx.get_data_handle(),
+            self._get_ctx(x).get_data_handle(),
             self.weight_size,
             self._real_padding,
             self.stride,
@@ -142,6 +272,26 @@ class _IPEXConvNd(_IPEXPrepackModule):
             self.weight_channels_last,
         )
 
+    def _prepack_variant_key(self, input_shape):
+        key = tuple(input_shape)
+        if key == tuple(self.prepack_input_shape):
+            return None
+        if key not in [tuple(shape) for shape in self.prepack_input_shapes]:
+            return None
+        return key
+
+    def _prepack_variant(self, key):
+        return torch.ops.ipex_prepack.convolution_prepack(
+            self.ctx.to_public(self.weight),
+            self.bias,
+            self.stride,
+            self._real_padding,
+            self.dilation,
+            self.groups,
+            self.weight_channels_last,
+            list(key),
+        )
+
 
 class _IPEXConv1d(_IPEXConvNd):
     def __init__(self):
@@ -166,12 +316,13 @@ class _IPEXLinear(_IPEXPrepackModule):
         return output
 
     def forward(self, x):
+        self._maybe_prepack(x)
         if self.use_dnnl:
             output = torch.ops.torch_ipex.ipex_linear(
                 x,
                 self._get_forward_weight(),
                 self._get_forward_bias(),
-                self.ctx.get_data_handle(),
+                self._get_ctx(x).get_data_handle(),
                 self.out_features,
             )
         else:
@@ -185,6 +336,26 @@ class _IPEXLinear(_IPEXPrepackModule):
 
         return self.post_ipex_gemm(output)
 
+    def _prepack_variant_key(self, input_shape):
+        # The weight format only depends on the collapsed batch size, choose
+        # the recorded one nearest to it in the log scale.
+        batch_size = math.prod(input_shape[:-1])
+        if batch_size == 0:
+            return None
+        candidates = [math.prod(shape[:-1]) for shape in self.prepack_input_shapes]
+        key = min(
+            candidates, key=lambda b: abs(math.log(max(b, 1)) - math.log(batch_size))
+        )
+        return None if key == self.batch_size_collapsed else key
+
+    def _prepack_variant(self, key):
+        # The MKL sgemm weight format doesn't depend on the input shape
+        if not self.use_dnnl:
+            return None
+        return torch.ops.ipex_prepack.linear_prepack(
+            self.ctx.to_public(self.weight), self.bias, key
+        )
+
     def _save_to_state_dict(self, destination, prefix, keep_vars):
         assert (
             not keep_vars
@@ -249,11 +420,12 @@ class _IPEXConvTransposeNd(_IPEXPrepackModule):
             _ipex_module_load_from_state_dict_(self, state_dict, prefix)
 
     def forward(self, x):
+        self._maybe_prepack(x)
         return torch.ops.torch_ipex.conv_transpose(
             x,
             self._get_forward_weight(),
             self._get_forward_bias(),
-            self.ctx.get_data_handle(),
+            self._get_ctx(x).get_data_handle(),
             self.weight_size,
             self.padding,
             self.output_padding,
@@ -263,6 +435,27 @@ class _IPEXConvTransposeNd(_IPEXPrepackModule):
             self.weight_channels_last,
         )
 
+    def _prepack_variant_key(self, input_shape):
+        key = tuple(input_shape)
+        if key == tuple(self.prepack_input_shape):
+            return None
+        if key not in [tuple(shape) for shape in self.prepack_input_shapes]:
+            return None
+        return key
+
+    def _prepack_variant(self, key):
+        return torch.ops.ipex_prepack.conv_transpose_prepack(
+            self.ctx.to_public(self.weight),
+            self.bias,
+            self.stride,
+            self.padding,
+            self.output_padding,
+            self.groups,
+            self.dilation,
+            self.weight_channels_last,
+            list(key),
+        )
+
 
 class _IPEXConvTranspose2d(_IPEXConvTransposeNd):
     def __init__(self):
@@ -290,7 +483,9 @@ def is_with_hook_on_weight_or_bias(module):
                 return True
 
 
-def weight_prepack_with_ipex(model, optimizer, params_attr, device_type="cpu"):
+def weight_prepack_with_ipex(
+    model, optimizer, params_attr, device_type="cpu", num_workers=1, lazy=False
+):
     from ._parameter_wrapper import (
         patch_state_dict,
         get_shared_parameter_status,
@@ -307,19 +502,19 @@ def weight_prepack_with_ipex(model, optimizer, params_attr, device_type="cpu"):
                 return v
         return None
 
-    def convert(m, optimizer, params_attr):
+    def get_wrappers(m, params_attr):
         # already packed for reentrancy test
         if m.__class__ in IPEX_WEIGHT_PREPACK_MODULE_CPU().values():
-            return m
+            return None
         # pre check module class
         if m.__class__ not in IPEX_WEIGHT_PREPACK_MODULE_CPU().keys():
-            return m
+            return None
         if not hasattr(m, "weight"):
-            return m
+            return None
         if m.weight is None:
-            return m
+            return None
         if is_with_hook_on_weight_or_bias(m):
-            return m
+            return None
         if hasattr(m, "bias") and m.bias is not None:
             if m.bias in params_attr:
                 param_wrapper = params_attr[m.bias]
@@ -342,57 +537,119 @@ def weight_prepack_with_ipex(model, optimizer, params_attr, device_type="cpu"):
             )
             param_wrapper = found_wrapper(m.weight, params_attr)
             assert param_wrapper is not None
-        if param_wrapper.can_prepack(m, is_training):
-            new_m = IPEX_WEIGHT_PREPACK_MODULE_CPU()[m.__class__]()
-            all_reduce_bias = m.bias
-            if isinstance(new_m, _IPEXLinearAllreduce):
-                m.bias = None
-            param_wrapper.prepack(m, is_training)
-            new_m.__dict__ = m.__dict__
-            if isinstance(new_m, _IPEXLinearAllreduce):
-                new_m.original_bias = all_reduce_bias
-            new_m.ctx = param_wrapper.op_ctx
-            setattr(new_m, "weight_wrapper", param_wrapper)  # noqa: B010
-            setattr(new_m, "bias_wrapper", bias_wrapper)  # noqa: B010
-            optimizer_para = param_wrapper.parameter
-            if param_wrapper.master_parameter is not None:
-                optimizer_para = param_wrapper.master_parameter
-            optim._optimizer_utils.pack_optimizer_states(
-                optimizer, optimizer_para, param_wrapper
-            )
-            new_m.training = is_training
-            # _ipex_module_empty_weight_tensor and _ipex_module_empty_bias_tensor
-            # have to be a Parameter so that dynamo could convert it into FakeTensor
-            # These empty tensors will only be used during inference but we'll set
-            # it in both training and eval mode to supprt the use case of the below
-            # workflow:
-            # model.train() -> ipex.optimize(model) -> model.eval()
-            new_m._ipex_module_empty_weight_tensor = torch.nn.Parameter(
-                torch.Tensor().to(dtype=new_m.weight.dtype)
-            )
-            if new_m.bias is None:
-                new_m.register_parameter("_ipex_module_empty_bias_tensor", None)
-            else:
-                new_m._ipex_module_empty_bias_tensor = torch.nn.Parameter(
-                    torch.Tensor().to(dtype=new_m.bias.dtype)
-                )
-            return new_m
-        else:
+        if not param_wrapper.can_prepack(m, is_training):
+            return None
+        return param_wrapper, bias_wrapper
+
+    def collect_rec(m, prefix, candidates):
+        wrappers = get_wrappers(m, params_attr)
+        if wrappers is not None:
+            candidates.append((prefix, m) + wrappers)
+        for name, sub_m in m.named_children():
+            collect_rec(sub_m, prefix + "." + name if prefix else name, candidates)
+        return candidates
+
+    def prepack(m, param_wrapper, num_threads=None):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        start = time.perf_counter()
+        param_wrapper.prepack(m, is_training)
+        return time.perf_counter() - start
+
+    def convert(m, optimizer, prepacked):
+        if m not in prepacked:
             return m
+        param_wrapper, bias_wrapper, all_reduce_bias = prepacked[m]
+        new_m = IPEX_WEIGHT_PREPACK_MODULE_CPU()[m.__class__]()
+        new_m.__dict__ = m.__dict__
+        if isinstance(new_m, _IPEXLinearAllreduce):
+            new_m.original_bias = all_reduce_bias
+        # op_ctx is None for lazy prepack, see _IPEXPrepackModule._maybe_prepack
+        new_m.ctx = param_wrapper.op_ctx
+        setattr(new_m, "weight_wrapper", param_wrapper)  # noqa: B010
+        setattr(new_m, "bias_wrapper", bias_wrapper)  # noqa: B010
+        optimizer_para = param_wrapper.parameter
+        if param_wrapper.master_parameter is not None:
+            optimizer_para = param_wrapper.master_parameter
+        optim._optimizer_utils.pack_optimizer_states(
+            optimizer, optimizer_para, param_wrapper
+        )
+        new_m.training = is_training
+        # _ipex_module_empty_weight_tensor and _ipex_module_empty_bias_tensor
+        # have to be a Parameter so that dynamo could convert it into FakeTensor
+        # These empty tensors will only be used during inference but we'll set
+        # it in both training and eval mode to supprt the use case of the below
+        # workflow:
+        # model.train() -> ipex.optimize(model) -> model.eval()
+        new_m._ipex_module_empty_weight_tensor = torch.nn.Parameter(
+            torch.Tensor().to(dtype=new_m.weight.dtype)
+        )
+        if new_m.bias is None:
+            new_m.register_parameter("_ipex_module_empty_bias_tensor", None)
+        else:
+            new_m._ipex_module_empty_bias_tensor = torch.nn.Parameter(
+                torch.Tensor().to(dtype=new_m.bias.dtype)
+            )
+        return new_m
 
-    def convert_rec(m, optimizer, params_attr):
-        new_m = convert(m, optimizer, params_attr)
+    def convert_rec(m, optimizer, prepacked):
+        new_m = convert(m, optimizer, prepacked)
         for name, sub_m in m.named_children():
-            setattr(new_m, name, convert_rec(sub_m, optimizer, params_attr)[0])
-        return new_m, optimizer, params_attr
+            setattr(new_m, name, convert_rec(sub_m, optimizer, prepacked))
+        return new_m
 
     if device_type == "cpu":
-        opt_model, opt_optmizer, params_attr = convert_rec(
-            model, optimizer, params_attr
-        )
+        # Prepacking is done in 3 steps: the candidates are collected in the
+        # traversal order, the weights of different modules are prepacked
+        # independently (in parallel if num_workers > 1), and the module tree
+        # is rewired in the traversal order again, so the result doesn't depend
+        # on the order the prepacking finishes in.
+        # With lazy prepack, the 2nd step is deferred to the first forward.
+        assert not (lazy and is_training), "Lazy prepack only supports inference"
+        candidates = collect_rec(model, "", [])
+        prepacked = {}
+        for _, m, param_wrapper, bias_wrapper in candidates:
+            all_reduce_bias = m.bias
+            if (
+                IPEX_WEIGHT_PREPACK_MODULE_CPU()[m.__class__]
+                is _IPEXLinearAllreduce
+            ):
+                m.bias = None
+            prepacked[m] = (param_wrapper, bias_wrapper, all_reduce_bias)
+
+        timing = {}
+        num_workers = 0 if lazy else max(1, min(num_workers, len(candidates)))
+        if num_workers == 1:
+            for name, m, param_wrapper, _ in candidates:
+                timing[name] = prepack(m, param_wrapper)
+        elif num_workers > 1:
+            # Share the OpenMP threads among the workers to avoid oversubscription
+            num_threads = torch.get_num_threads()
+            worker_threads = max(1, num_threads // num_workers)
+            try:
+                with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    futures = [
+                        (
+                            name,
+                            executor.submit(
+                                prepack, m, param_wrapper, worker_threads
+                            ),
+                        )
+                        for name, m, param_wrapper, _ in candidates
+                    ]
+                    for name, future in futures:
+                        timing[name] = future.result()
+            finally:
+                torch.set_num_threads(num_threads)
+        for name, t in timing.items():
+            logger.debug(f"weight prepack of {name} takes {t * 1000:.3f} ms")
+
+        opt_model = convert_rec(model, optimizer, prepacked)
+        opt_optmizer = optimizer
 
         patch_state_dict(opt_model, params_attr, "prepack")
         setattr(opt_model, "params_attr", params_attr)  # noqa: B010
+        setattr(opt_model, "weight_prepack_timing", timing)  # noqa: B010
         if opt_optmizer is not None:
             setattr(opt_optmizer, "params_attr", params_attr)  # noqa: B010
             optim._optimizer_utils.patch_load_state_dict(opt_optmizer)
@@ -404,7 +661,7 @@ def record_input_shape_for_prepack(module, sample_input):
     def hook_function(self, input):
         # input for linear/conv/transpose conv received here will be Tuple[Tensor]
         if (
-            self in [torch.nn.Conv1d, torch.nn.Conv2d, torch.nn.Conv3d]
+            type(self) in [torch.nn.Conv1d, torch.nn.Conv2d, torch.nn.Conv3d]
             and self.padding_mode != "zeros"
         ):
             self.input_shape = F.pad(
@@ -438,3 +695,43 @@ def record_input_shape_for_prepack(module, sample_input):
         module.train()
     for hook in hooks:
         hook.remove()
+
+
+def record_input_shapes_for_prepack(module, sample_inputs):
+    # Record all the distinct input shapes of the modules in prepack_input_shapes,
+    # input_shape is the one in the first sample input which they get
+    recorded = OrderedDict()
+    for sample_input in sample_inputs:
+        record_input_shape_for_prepack(module, sample_input)
+        for m in module.modules():
+            if hasattr(m, "input_shape"):
+                shapes = recorded.setdefault(m, [])
+                if m.input_shape not in shapes:
+                    shapes.append(m.input_shape)
+    for m, shapes in recorded.items():
+        m.input_shape = shapes[0]
+        m.prepack_input_shapes = shapes
+
+
+def prepack_variants_with_ipex(model, memory_budget=None, prewarm=True):
+    r"""
+    Let the prepacked modules which have recorded several input shapes by
+    ``record_input_shapes_for_prepack`` dispatch to the weights prepacked for
+    them. The variants share the ``memory_budget`` bytes of the whole model and
+    are prepacked now if ``prewarm``, otherwise on their first use.
+    """
+    cache = _PrepackVariantCache(memory_budget)
+    for m in model.modules():
+        if not isinstance(m, _IPEXPrepackModule):
+            continue
+        if len(getattr(m, "prepack_input_shapes", [])) < 2:
+            continue
+        m.prepack_variants = cache
+        if not prewarm:
+            continue
+        for shape in m.prepack_input_shapes[1:]:
+            key = m._prepack_variant_key(shape)
+            if key is not None:
+                cache.get(m, key)
+    setattr(model, "prepack_variants", cache)  # noqa: B010
+    return model
@@ -125,6 +125,90 @@ class TestGraphCapture(TestCase):
         self.assertEqual(y1, y2_bf16, prec=0.01)
         self.assertTrue(y2_bf16.dtype == torch.bfloat16)
 
+    def test_inference_graph_mode_multiple_signatures(self):
+        model = Conv_Bn_Relu().to(memory_format=torch.channels_last).eval()
+        model = ipex.optimize(model, graph_mode=True)
+        graph_capture = model.forward.graph_capture
+        graph_capture.max_graphs = 2
+        inputs = [
+            torch.randn(bs, 6, 10, 10).to(memory_format=torch.channels_last)
+            for bs in [1, 2, 3]
+        ]
+
+        with torch.no_grad():
+            for x in inputs[:2]:
+                for _ in range(3):
+                    self.assertEqual(model(x), graph_capture.model(x))
+            stats = graph_capture.stats()
+            self.assertEqual(stats["misses"], 2)
+            self.assertEqual(stats["evictions"], 0)
+            self.assertEqual([g["method"] for g in stats["graphs"]], ["JIT", "JIT"])
+            self.assertEqual([g["hits"] for g in stats["graphs"]], [2, 2])
+
+            # the least recently used graph of batch size 1 is evicted
+            model(inputs[1])
+            model(inputs[2])
+            stats = graph_capture.stats()
+            self.assertEqual(stats["misses"], 3)
+            self.assertEqual(stats["evictions"], 1)
+            self.assertEqual(
+                [g["signature"][0][1][1][0] for g in stats["graphs"]], [2, 3]
+            )
+            self.assertEqual([g["hits"] for g in stats["graphs"]], [3, 0])
+
+    def test_inference_graph_mode_async(self):
+        for module in [Conv_Bn_Relu, Conv_IF_Relu]:
+            model = module().to(memory_format=torch.channels_last).eval()
+            x = torch.randn(3, 6, 10, 10).to(memory_format=torch.channels_last)
+            y1 = model(x)
+            model = ipex.optimize(model, graph_mode="async")
+            graph_capture = model.forward.graph_capture
+
+            with torch.no_grad():
+                # served in eager mode while the graph is being generated
+                y2 = model(x)
+                self.assertEqual(y1, y2)
+                self.assertTrue(graph_capture.wait_compilation(timeout=300))
+                stats = graph_capture.stats()
+                self.assertEqual(stats["pending"], 0)
+                self.assertEqual(stats["misses"], 1)
+                self.assertEqual(len(stats["graphs"]), 1)
+                self.assertTrue(stats["graphs"][0]["method"] in ["JIT", "TorchDynamo"])
+                for _ in range(3):
+                    y3 = model(x)
+                self.assertEqual(y1, y3)
+                self.assertEqual(graph_capture.stats()["graphs"][0]["hits"], 3)
+
+    def test_inference_graph_mode_cache_dir(self):
+        for module, method in [(Conv_Bn_Relu, "JIT"), (Conv_IF_Relu, "TorchDynamo")]:
+            model = module().to(memory_format=torch.channels_last).eval()
+            x = torch.randn(3, 6, 10, 10).to(memory_format=torch.channels_last)
+            y1 = model(x)
+            with tempfile.TemporaryDirectory() as cache_dir, torch.no_grad():
+                opt_model = ipex.optimize(model, graph_mode=True, cache_dir=cache_dir)
+                self.assertEqual(opt_model(x), y1)
+                files = os.listdir(cache_dir)
+                graph_files = [f for f in files if "_graph_" in f]
+                if method == "JIT":
+                    self.assertEqual(len(graph_files), 2)
+                else:
+                    # only the run method is stored for TorchDynamo
+                    self.assertEqual(len(graph_files), 1)
+                self.assertTrue(any(f.endswith(".json") for f in graph_files))
+
+                # the graph is loaded in the new optimized model
+                opt_model = ipex.optimize(model, graph_mode=True, cache_dir=cache_dir)
+                for _ in range(3):
+                    self.assertEqual(opt_model(x), y1)
+                stats = opt_model.forward.graph_capture.stats()
+                self.assertEqual(stats["graphs"][0]["method"], method)
+                self.assertEqual(sorted(os.listdir(cache_dir)), sorted(files))
+                if method == "JIT":
+                    graph = opt_model.forward.graph_capture.graphs[
+                        next(iter(opt_model.forward.graph_capture.graphs))
+                    ].model
+                    self.assertTrue(isinstance(graph, torch.jit.RecursiveScriptModule))
+
     def test_inference_trace_graph_mode(self):
         model = Conv_Bn_Relu().to(memory_format=torch.channels_last).eval()
         x = torch.randn(3, 6, 10, 10).to(memory_format=torch.channels_last)
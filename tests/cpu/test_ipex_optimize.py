@@ -24,6 +24,7 @@ import copy
 from common_utils import TestModule, _empty_weight_bias_parameter_names
 from intel_extension_for_pytorch.optim._lamb import Lamb
 import os
+import tempfile
 
 
 class ConvBatchNorm(torch.nn.Module):
@@ -347,6 +348,44 @@ class TestOptimizeCases(TestCase):
                 M.embeddingbag.weight.data_ptr() == opt_M.embeddingbag.weight.data_ptr()
             )
 
+    def test_optimize_share_weights_eval_mode(self):
+        M_ori = TestModule()
+        options = itertools.product([torch.float32, torch.bfloat16], ["O0", "O1"])
+        for dtype, level in options:
+            M = copy.deepcopy(M_ori).eval()
+            ref_state = copy.deepcopy(M.state_dict())
+            opt_M = ipex.optimize(
+                M, dtype=dtype, level=level, inplace=False, share_weights=True
+            )
+            # the original model is untouched
+            self.assertTrue(type(M.linear) is torch.nn.Linear)
+            self.assertTrue(M.linear.weight is not opt_M.linear.weight)
+            for name, value in M.state_dict().items():
+                self.assertEqual(value, ref_state[name])
+            if level == "O1":
+                self.assertTrue(
+                    M.linear.weight.data_ptr() != opt_M.linear.weight.data_ptr()
+                )
+                self.assertTrue(
+                    M.conv.weight.data_ptr() != opt_M.conv.weight.data_ptr()
+                )
+            # un-optimized part shares the storage
+            self.assertTrue(M.embeddingbag.weight is not opt_M.embeddingbag.weight)
+            if dtype == torch.float32:
+                self.assertTrue(
+                    M.embeddingbag.weight.data_ptr()
+                    == opt_M.embeddingbag.weight.data_ptr()
+                )
+
+        # training model falls back to deepcopy
+        M = copy.deepcopy(M_ori).train()
+        optimizer = torch.optim.SGD(M.parameters(), lr=0.01)
+        with self.assertWarnsRegex(UserWarning, "share_weights only works"):
+            opt_M, _ = ipex.optimize(M, optimizer=optimizer, share_weights=True)
+        self.assertTrue(
+            M.embeddingbag.weight.data_ptr() != opt_M.embeddingbag.weight.data_ptr()
+        )
+
     def test_optimize_inplace_behavior_training_mode_with_optimizer(self):
         M_ori = TestModule()
         options = itertools.product([torch.float32, torch.bfloat16], ["O0", "O1"])
@@ -841,6 +880,73 @@ class TestOptimizeCases(TestCase):
                 graph_mode,
             )
 
+    def test_optimize_auto_level(self):
+        M = TwoLayerMLP().eval()
+        input = (M.input1, M.input2)
+        with torch.no_grad():
+            ref_out = M(*input)
+        opt_M = ipex.optimize(M, level="auto", sample_input=input, graph_mode=False)
+        report = opt_M.auto_tune_report
+        # graph_mode is set explicitly, so it is not tuned
+        self.assertEqual(len(report["candidates"]), 4)
+        for c in report["candidates"]:
+            self.assertEqual(
+                set(c["knobs"].keys()), {"auto_kernel_selection", "concat_linear"}
+            )
+            self.assertTrue(c["latency_ms"] > 0)
+        best = min(report["candidates"], key=lambda c: c["latency_ms"])
+        self.assertEqual(report["knobs"], best["knobs"])
+        self.assertTrue(isinstance(opt_M.l1, _IPEXLinear))
+        with torch.no_grad():
+            self.assertEqual(opt_M(*input), ref_out)
+
+        # falls back to O1 without sample_input or for training
+        with self.assertWarnsRegex(UserWarning, "falling back to level 'O1'"):
+            opt_M = ipex.optimize(M, level="auto")
+        self.assertFalse(hasattr(opt_M, "auto_tune_report"))
+        M.train()
+        optimizer = torch.optim.SGD(M.parameters(), lr=0.01)
+        with self.assertWarnsRegex(UserWarning, "falling back to level 'O1'"):
+            ipex.optimize(M, optimizer=optimizer, level="auto", sample_input=input)
+
+    def test_optimize_cache_dir(self):
+        for module in [ConvBatchNorm, OneLayerMLP, ConvTranspose2d]:
+            for dtype in [torch.float, torch.bfloat16]:
+                M = module().eval()
+                input = M.input1.to(dtype)
+                with tempfile.TemporaryDirectory() as cache_dir:
+                    opt_M = ipex.optimize(M, dtype=dtype, cache_dir=cache_dir)
+                    self.assertEqual(len(os.listdir(cache_dir)), 1)
+                    cached_M = ipex.optimize(M, dtype=dtype, cache_dir=cache_dir)
+                    self.assertEqual(len(os.listdir(cache_dir)), 1)
+                    self.assertEqual(
+                        [type(m) for m in opt_M.modules()],
+                        [type(m) for m in cached_M.modules()],
+                    )
+                    with torch.no_grad():
+                        self.assertEqual(opt_M(input), cached_M(input))
+                    self.assertEqual(opt_M.state_dict(), cached_M.state_dict())
+                    # the cached model keeps the original state_dict behavior
+                    M.load_state_dict(cached_M.state_dict())
+
+                    # changing the weights or the knobs misses the cache
+                    with torch.no_grad():
+                        next(M.parameters()).add_(1)
+                    ipex.optimize(M, dtype=dtype, cache_dir=cache_dir)
+                    self.assertEqual(len(os.listdir(cache_dir)), 2)
+                    ipex.optimize(
+                        M, dtype=dtype, weights_prepack=False, cache_dir=cache_dir
+                    )
+                    self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+        # training model does not use the cache
+        M = OneLayerMLP().train()
+        optimizer = torch.optim.SGD(M.parameters(), lr=0.01)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with self.assertWarnsRegex(UserWarning, "cache_dir is ignored"):
+                ipex.optimize(M, optimizer=optimizer, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 0)
+
 
 if __name__ == "__main__":
     test = unittest.main()
@@ -6,10 +6,27 @@ from intel_extension_for_pytorch.cpu.launch import (
     Launcher,
     DistributedTrainingLauncher,
 )
+from intel_extension_for_pytorch.cpu.launch.instance_metrics import (
+    METRICS_FILE_ENV,
+    summarize_metrics,
+)
+from intel_extension_for_pytorch.cpu.launch.supervisor import InstanceSupervisor
+from intel_extension_for_pytorch.cpu.launch.launcher_auto_tune import (
+    gen_candidate_ncores,
+    parse_metric,
+)
+from intel_extension_for_pytorch.cpu.launch.cpu_info import (
+    read_sysfs_topology,
+    read_cgroup_cpu_quota,
+)
 import os
 from os.path import expanduser
 import glob
 import subprocess
+import tempfile
+import json
+import sys
+import threading
 
 
 class TestLauncher(TestCase):
@@ -81,6 +98,45 @@ class TestLauncher(TestCase):
                 == "oversize_threshold:1,background_thread:false,metadata_thp:always,dirty_decay_ms:-1,muzzy_decay_ms:-1"
             )
 
+    def test_memory_profile(self):
+        for env_name in [
+            "MALLOC_CONF",
+            "MALLOC_ARENA_MAX",
+            "MALLOC_MMAP_THRESHOLD_",
+            "MALLOC_TRIM_THRESHOLD_",
+            "GLIBC_TUNABLES",
+        ]:
+            self.del_env(env_name)
+
+        launcher = Launcher()
+        launcher.set_memory_allocator(
+            memory_allocator="default",
+            memory_profile="latency",
+            ncores_per_instance=4,
+        )
+        self.assertEqual(launcher.environ_set["MALLOC_ARENA_MAX"], "4")
+        self.assertEqual(launcher.environ_set["MALLOC_TRIM_THRESHOLD_"], str(1 << 30))
+
+        launcher = Launcher()
+        launcher.set_memory_allocator(
+            memory_allocator="default",
+            memory_profile="low-memory",
+            ncores_per_instance=4,
+        )
+        self.assertEqual(launcher.environ_set["MALLOC_ARENA_MAX"], "2")
+        self.assertNotIn("GLIBC_TUNABLES", launcher.environ_set)
+
+        # jemalloc is searched first with the latency profile
+        launcher = Launcher()
+        ma = launcher.set_memory_allocator(
+            memory_profile="latency", ncores_per_instance=4
+        )
+        if self.find_lib("jemalloc"):
+            self.assertEqual(ma, "jemalloc")
+            malloc_conf = launcher.environ_set["MALLOC_CONF"]
+            self.assertIn("dirty_decay_ms:-1", malloc_conf)
+            self.assertIn("narenas:4", malloc_conf)
+
     def test_mpi_pin_domain_and_ccl_worker_affinity(self):
         # HT ON, use_logical_cores ON
         nprocs_per_node = 2
@@ -740,6 +796,362 @@ class TestLauncher(TestCase):
         }
         self.verify_affinity(cpuinfo.pools_ondemand, ground_truth)
 
+    def construct_sysfs(self, root, num_sockets, n_phycores_per_socket):
+        # 2 threads per core, the logical cores are indexed after the physical ones
+        n_phycores = num_sockets * n_phycores_per_socket
+        num_cpus = n_phycores * 2
+
+        def write(path, txt):
+            path = os.path.join(root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(f"{txt}\n")
+
+        write("devices/system/cpu/online", f"0-{num_cpus - 1}")
+        socket_cpulists = []
+        for socket in range(num_sockets):
+            first = socket * n_phycores_per_socket
+            last = first + n_phycores_per_socket - 1
+            socket_cpulists.append(
+                f"{first}-{last},{first + n_phycores}-{last + n_phycores}"
+            )
+            write(f"devices/system/node/node{socket}/cpulist", socket_cpulists[-1])
+        for cpu in range(num_cpus):
+            phycore = cpu % n_phycores
+            socket = phycore // n_phycores_per_socket
+            cpu_dir = f"devices/system/cpu/cpu{cpu}"
+            write(f"{cpu_dir}/topology/physical_package_id", socket)
+            # core_id is numbered in each socket
+            write(f"{cpu_dir}/topology/core_id", phycore % n_phycores_per_socket)
+            write(f"{cpu_dir}/cpufreq/cpuinfo_max_freq", 3800000)
+            write(f"{cpu_dir}/cache/index2/level", 2)
+            write(f"{cpu_dir}/cache/index2/type", "Unified")
+            write(
+                f"{cpu_dir}/cache/index2/shared_cpu_list",
+                f"{phycore},{phycore + n_phycores}",
+            )
+            write(f"{cpu_dir}/cache/index3/level", 3)
+            write(f"{cpu_dir}/cache/index3/type", "Unified")
+            write(f"{cpu_dir}/cache/index3/shared_cpu_list", socket_cpulists[socket])
+
+    def test_sysfs_topology(self):
+        num_sockets = 2
+        n_phycores_per_socket = 4
+        with tempfile.TemporaryDirectory() as root:
+            self.construct_sysfs(root, num_sockets, n_phycores_per_socket)
+            cores = read_sysfs_topology(root)
+        self.assertEqual(len(cores), 16)
+        for c in cores:
+            phycore = c.cpu % 8
+            self.assertEqual(c.core, phycore)
+            self.assertEqual(c.socket, phycore // n_phycores_per_socket)
+            self.assertEqual(c.node, c.socket)
+            self.assertEqual(c.maxmhz, 3800)
+            self.assertEqual(c.cache, {"l2": phycore, "l3": c.socket})
+
+        # Same topology as lscpu
+        lscpu_txt = construct_numa_config(
+            num_sockets, n_phycores_per_socket, enable_ht=True, numa_mode=1
+        )
+        cpuinfo = CPUPoolList(lscpu_txt=lscpu_txt)
+        self.assertEqual(
+            [(c.cpu, c.core, c.socket, c.node) for c in cpuinfo.pool_all],
+            [(c.cpu, c.core, c.socket, c.node) for c in cores],
+        )
+
+    def test_topology_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            topology_file = os.path.join(tmp_dir, "topology.json")
+            cpuinfo = CPUPoolList(topology_file=topology_file)
+            self.assertTrue(os.path.exists(topology_file))
+            cpuinfo_cached = CPUPoolList(topology_file=topology_file)
+            self.assertEqual(
+                [c.to_dict() for c in cpuinfo.pool_all],
+                [c.to_dict() for c in cpuinfo_cached.pool_all],
+            )
+            self.assertEqual(
+                [c.is_physical_core for c in cpuinfo.pool_all],
+                [c.is_physical_core for c in cpuinfo_cached.pool_all],
+            )
+
+    def test_cgroup_cpu_quota(self):
+        def write(path, txt):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(f"{txt}\n")
+
+        with tempfile.TemporaryDirectory() as root:
+            proc_root = os.path.join(root, "proc")
+            cgroup_root = os.path.join(root, "cgroup")
+            # cgroup v2, the quota of the parent applies
+            write(f"{proc_root}/self/cgroup", "0::/kubepods/pod0/container0")
+            write(f"{cgroup_root}/kubepods/pod0/cpu.max", "250000 100000")
+            write(f"{cgroup_root}/kubepods/pod0/container0/cpu.max", "max 100000")
+            self.assertEqual(read_cgroup_cpu_quota(proc_root, cgroup_root), 2.5)
+            # cgroup v1 mounted at the root of the cgroup namespace
+            write(
+                f"{proc_root}/self/cgroup", "4:cpu,cpuacct:/kubepods/pod1\n3:memory:/"
+            )
+            write(f"{cgroup_root}/cpu,cpuacct/cpu.cfs_quota_us", "400000")
+            write(f"{cgroup_root}/cpu,cpuacct/cpu.cfs_period_us", "100000")
+            self.assertEqual(read_cgroup_cpu_quota(proc_root, cgroup_root), 4)
+            # no quota
+            write(f"{cgroup_root}/cpu,cpuacct/cpu.cfs_quota_us", "-1")
+            self.assertIsNone(read_cgroup_cpu_quota(proc_root, cgroup_root))
+
+    def test_core_affinity_with_cpu_quota(self):
+        num_nodes = 2
+        n_phycores_per_node = 28
+        lscpu_txt = construct_numa_config(
+            num_nodes, n_phycores_per_node, enable_ht=True, numa_mode=1
+        )
+        cpuinfo = CPUPoolList(lscpu_txt=lscpu_txt)
+        cpuinfo.cpu_quota = 16.5
+        cpuinfo.gen_pools_ondemand(ninstances=2)
+        ground_truth = {
+            "ninstances": 2,
+            "ncores_per_instance": 8,
+            "num_cores_sum": 16,
+            "num_nodes_sum": 1,
+            "num_cores": [8, 8],
+            "num_nodes": [1, 1],
+            "pools_cores": ["0-7", "8-15"],
+            "pools_nodes": ["0", "0"],
+        }
+        self.verify_affinity(cpuinfo.pools_ondemand, ground_truth)
+
+        cpuinfo.gen_pools_ondemand(ninstances=2, skip_cross_node_cores=True)
+        ground_truth = {
+            "ninstances": 2,
+            "ncores_per_instance": 8,
+            "num_cores_sum": 16,
+            "num_nodes_sum": 2,
+            "num_cores": [8, 8],
+            "num_nodes": [1, 1],
+            "pools_cores": ["0-7", "28-35"],
+            "pools_nodes": ["0", "1"],
+        }
+        self.verify_affinity(cpuinfo.pools_ondemand, ground_truth)
+
+        # The explicit layout is kept
+        cpuinfo.gen_pools_ondemand(ninstances=2, ncores_per_instance=14)
+        self.assertEqual(sum([len(p) for p in cpuinfo.pools_ondemand]), 28)
+
+    def test_core_affinity_with_pack_cache_domains(self):
+        # 12 cores in 3 L3 domains, cores of a domain are not contiguous
+        lscpu_txt = "CPU NODE SOCKET CORE L1d:L1i:L2:L3 ONLINE MAXMHZ\n"
+        for cpu in range(12):
+            lscpu_txt += f"{cpu} 0 0 {cpu} {cpu}:{cpu}:{cpu}:{cpu % 3} yes 3800.0\n"
+        cpuinfo = CPUPoolList(lscpu_txt=lscpu_txt)
+        self.assertEqual([c.cache["l3"] for c in cpuinfo.pool_all], [0, 1, 2] * 4)
+
+        cpuinfo.gen_pools_ondemand(ninstances=3)
+        pools_cores = [p.get_pool_txt()["cores"] for p in cpuinfo.pools_ondemand]
+        self.assertEqual(pools_cores, ["0-3", "4-7", "8-11"])
+
+        cpuinfo.gen_pools_ondemand(ninstances=3, pack_cache_domains=True)
+        pools_cores = [p.get_pool_txt()["cores"] for p in cpuinfo.pools_ondemand]
+        self.assertEqual(pools_cores, ["0,3,6,9", "1,4,7,10", "2,5,8,11"])
+
+        # Instances larger than a domain span as few domains as possible
+        cpuinfo.gen_pools_ondemand(
+            ninstances=2, ncores_per_instance=6, pack_cache_domains=True
+        )
+        for p in cpuinfo.pools_ondemand:
+            self.assertEqual(len(set([c.cache["l3"] for c in p])), 2)
+
+    def test_auto_tune_candidates_and_metric(self):
+        self.assertEqual(gen_candidate_ncores(56, 2), [1, 2, 4, 8, 16, 28, 32, 56])
+        self.assertEqual(gen_candidate_ncores(6, 1), [1, 2, 4, 6])
+        self.assertEqual(gen_candidate_ncores(1, 1), [1])
+        pattern = r"throughput\D*?([0-9]+(?:\.[0-9]+)?)"
+        output = "Throughput: 1.5\nthroughput: 10.5 samples/s\nThroughput=20\n"
+        # The last value of each instance
+        self.assertEqual(parse_metric(output, pattern, 2), 30.5)
+        self.assertIsNone(parse_metric(output, pattern, 4))
+
+    def test_auto_tune(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            program = os.path.join(tmp_dir, "program.py")
+            with open(program, "w") as f:
+                f.write(
+                    "import os\n"
+                    'ncores = int(os.environ["OMP_NUM_THREADS"])\n'
+                    'print(f"Throughput: {100 if ncores == 2 else 1}")\n'
+                )
+            auto_tune_file = os.path.join(tmp_dir, "auto_tune.json")
+            cmd = [
+                "ipexrun",
+                "--auto-tune",
+                "--auto-tune-file",
+                auto_tune_file,
+                "--cores-list",
+                "0-1",
+                "--memory-allocator",
+                "default",
+                "--omp-runtime",
+                "default",
+                program,
+            ]
+            r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            self.assertEqual(r.returncode, 0)
+            with open(auto_tune_file) as f:
+                decisions = json.load(f)
+            self.assertEqual(len(decisions), 1)
+            decision = list(decisions.values())[0]
+            self.assertEqual(decision["config"]["ncores_per_instance"], 2)
+            self.assertEqual(decision["config"]["ninstances"], 1)
+            self.assertEqual(decision["throughput"], 100)
+
+    def test_instance_metrics_summary(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            metrics_files = {}
+            for i in range(2):
+                metrics_files[i] = os.path.join(tmp_dir, f"instance_{i}.jsonl")
+                with open(metrics_files[i], "w") as f:
+                    for j in range(5):
+                        latency_ms = 10 * (i + 1) + j
+                        record = {"time": j, "latency_ms": latency_ms, "samples": 2}
+                        f.write(json.dumps(record) + "\n")
+                    # Incomplete line of a killed instance
+                    f.write('{"time": 5, "lat')
+            summary = summarize_metrics(metrics_files)
+        self.assertEqual(summary["ninstances"], 2)
+        self.assertEqual(summary["samples"], 20)
+        # 8 samples after the first record in 4 seconds per instance
+        self.assertEqual(summary["instances"][0]["throughput"], 2)
+        self.assertEqual(summary["throughput"], 4)
+        self.assertEqual(summary["instances"][0]["latency"]["p50_ms"], 12)
+        self.assertEqual(summary["instances"][1]["latency"]["max_ms"], 24)
+        self.assertEqual(summary["latency"]["count"], 10)
+        self.assertEqual(summary["latency"]["p50_ms"], 17)
+
+    def test_launcher_report_metrics(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            program = os.path.join(tmp_dir, "program.py")
+            with open(program, "w") as f:
+                f.write(
+                    "from intel_extension_for_pytorch.cpu.launch import report_metrics\n"
+                    "for i in range(10):\n"
+                    "    report_metrics(latency_ms=i + 1)\n"
+                    "report_metrics(throughput=100)\n"
+                )
+            report_file = os.path.join(tmp_dir, "summary.json")
+            cmd = [
+                "ipexrun",
+                "--ninstances",
+                "2",
+                "--ncores-per-instance",
+                "1",
+                "--report-metrics",
+                "--report-file",
+                report_file,
+                program,
+            ]
+            r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            self.assertEqual(r.returncode, 0)
+            self.assertNotIn(METRICS_FILE_ENV, os.environ)
+            with open(report_file) as f:
+                summary = json.load(f)
+        self.assertEqual(summary["ninstances"], 2)
+        self.assertEqual(summary["samples"], 20)
+        self.assertEqual(summary["throughput"], 200)
+        self.assertEqual(summary["latency"]["max_ms"], 10)
+
+    def test_supervisor_restart(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            count_file = os.path.join(tmp_dir, "count")
+            # Instance 0 crashes twice then completes, instance 1 always crashes
+            program = os.path.join(tmp_dir, "program.py")
+            with open(program, "w") as f:
+                f.write(
+                    "import os, sys\n"
+                    f"path = {count_file!r} + sys.argv[1]\n"
+                    "n = int(open(path).read()) if os.path.exists(path) else 0\n"
+                    "open(path, 'w').write(str(n + 1))\n"
+                    "sys.exit(0 if sys.argv[1] == '0' and n >= 2 else 3)\n"
+                )
+
+            def spawn(i):
+                cmd = f"{sys.executable} {program} {i}"
+                process = subprocess.Popen(cmd, shell=True, start_new_session=True)
+                return {"process": process, "cmd": cmd}
+
+            health_file = os.path.join(tmp_dir, "health.json")
+            supervisor = InstanceSupervisor(
+                spawn, max_restarts=2, backoff=0.1, health_file=health_file
+            )
+            instances = supervisor.run([0, 1])
+            self.assertEqual(instances[0].state, "completed")
+            self.assertEqual(instances[0].restarts, 2)
+            self.assertEqual(instances[1].state, "failed")
+            self.assertEqual(instances[1].restarts, 2)
+            self.assertEqual(instances[1].last_exit_code, 3)
+            with open(health_file) as f:
+                health = json.load(f)
+            self.assertEqual(health["instances"]["1"]["state"], "failed")
+            self.assertEqual(health["instances"]["1"]["restarts"], 2)
+
+    def test_supervisor_restart_with_log_dir(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            program = os.path.join(tmp_dir, "program.py")
+            with open(program, "w") as f:
+                f.write("import sys\nprint('crash', flush=True)\nsys.exit(3)\n")
+            health_file = os.path.join(tmp_dir, "health.json")
+            cmd = [
+                "ipexrun",
+                "--ninstances",
+                "1",
+                "--ncores-per-instance",
+                "1",
+                "--log-dir",
+                tmp_dir,
+                "--supervise",
+                "--max-restarts",
+                "2",
+                "--restart-backoff",
+                "0.1",
+                "--health-file",
+                health_file,
+                program,
+            ]
+            r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            self.assertNotEqual(r.returncode, 0)
+            with open(health_file) as f:
+                health = json.load(f)
+            self.assertEqual(health["instances"]["0"]["state"], "failed")
+            self.assertEqual(health["instances"]["0"]["restarts"], 2)
+            self.assertEqual(health["instances"]["0"]["last_exit_code"], 3)
+            # The log of the instance is appended on each restart
+            logs = glob.glob(os.path.join(tmp_dir, "*_instance_0_*.log"))
+            self.assertEqual(len(logs), 1)
+            with open(logs[0]) as f:
+                self.assertEqual(f.read().count("crash"), 3)
+
+    def test_supervisor_drain(self):
+        def spawn(i):
+            # Instance 0 exits on SIGTERM, instance 1 ignores it
+            handler = "lambda *args: sys.exit(0)" if i == 0 else "signal.SIG_IGN"
+            code = (
+                f"import signal, sys, time; signal.signal(signal.SIGTERM, {handler}); "
+                "print('ready', flush=True); time.sleep(100)"
+            )
+            process = subprocess.Popen(
+                [sys.executable, "-c", code],
+                stdout=subprocess.PIPE,
+                start_new_session=True,
+            )
+            process.stdout.readline()
+            return {"process": process, "cmd": code}
+
+        supervisor = InstanceSupervisor(spawn, drain_timeout=1)
+        threading.Timer(0.5, supervisor.request_drain).start()
+        instances = supervisor.run([0, 1])
+        self.assertEqual(instances[0].state, "stopped")
+        self.assertEqual(instances[0].last_exit_code, 0)
+        self.assertEqual(instances[1].state, "stopped")
+        self.assertEqual(instances[1].last_exit_code, -9)
+
 
 if __name__ == "__main__":
     test = unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 import torch
 import intel_extension_for_pytorch as ipex
@@ -6,6 +7,8 @@ from common_utils import TestCase
 from common_ipex_conf import runtime_thread_affinity_test_env
 import subprocess
 import os
+import threading
+import time
 
 
 class SimpleNet(torch.nn.Module):
@@ -220,6 +223,31 @@ class TestRuntimeAPI(TestCase):
         y_runtime = y_runtime_future.get()
         self.assertEqual(y, y_runtime)
 
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_task_asyncio_api(self):
+        model = SimpleNet()
+        model.eval()
+        x = torch.rand(64, 64, 3, 3)
+        # Calculate the reference result
+        trace_model = torch.jit.trace(model, x)
+        y = trace_model(x)
+
+        cpu_pool = ipex.cpu.runtime.CPUPool(node_id=0)
+        tasks = [
+            ipex.cpu.runtime.Task(trace_model, cpu_pool),
+            ipex.cpu.runtime.Task(model, cpu_pool),
+        ]
+
+        async def run():
+            return await asyncio.gather(*[task.run_async_aio(x) for task in tasks])
+
+        for y_runtime in asyncio.run(run()):
+            self.assertEqual(y, y_runtime)
+
     @unittest.skipIf(
         not ipex.cpu.runtime.is_runtime_ext_enabled(),
         "Skip when IPEX Runtime extension is not enabled",
@@ -247,6 +275,85 @@ class TestRuntimeAPI(TestCase):
         self.assertEqual(y, y_runtime)
         self.assertEqual(y, y_runtime2)
 
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_task_instrumentation(self):
+        model = SimpleNet()
+        model.eval()
+        x = torch.rand(64, 64, 3, 3)
+        trace_model = torch.jit.trace(model, x)
+        y = trace_model(x)
+
+        cpu_pool = ipex.cpu.runtime.CPUPool(core_ids=[0, 1])
+        task = ipex.cpu.runtime.Task(trace_model, cpu_pool, name="test_task")
+        ipex.cpu.runtime.reset_runtime_metrics()
+        # Not recorded by default
+        self.assertEqual(y, task(x).get())
+        self.assertEqual(ipex.cpu.runtime.get_runtime_metrics()["tasks"], {})
+
+        ipex.cpu.runtime.enable_instrumentation()
+        try:
+            futures = [task(x) for _ in range(4)]
+            for future in futures:
+                self.assertEqual(y, future.get())
+            self.assertEqual(y, task.run_sync(x))
+        finally:
+            ipex.cpu.runtime.disable_instrumentation()
+
+        metrics = ipex.cpu.runtime.get_runtime_metrics()
+        task_metrics = metrics["tasks"]["test_task"]
+        self.assertEqual(task_metrics["core_ids"], [0, 1])
+        self.assertEqual(task_metrics["submitted"], 5)
+        self.assertEqual(task_metrics["completed"], 5)
+        self.assertEqual(task_metrics["queue_depth"], 0)
+        self.assertEqual(task_metrics["exec_time"]["count"], 5)
+        self.assertEqual(task_metrics["wait_time"]["buckets"][-1][1], 5)
+        utilization = metrics["cpu_pools"][(0, 1)]["utilization"]
+        self.assertTrue(0 < utilization <= 1)
+
+        text = ipex.cpu.runtime.get_runtime_metrics_prometheus()
+        self.assertIn(
+            'ipex_runtime_task_completed_total{task="test_task",cores="0-1"} 5', text
+        )
+        self.assertIn(
+            'ipex_runtime_task_exec_seconds_bucket{task="test_task",cores="0-1",le="+Inf"} 5',
+            text,
+        )
+        # The label values are escaped
+        self.assertEqual(
+            ipex.cpu.runtime.instrumentation._escape_label_value('a"b\\c\nd'),
+            'a\\"b\\\\c\\nd',
+        )
+        ipex.cpu.runtime.reset_runtime_metrics()
+
+    def test_cpupool_busy_time(self):
+        # The overlapping executions of the Tasks on a CPUPool are counted once
+        instrumentation = ipex.cpu.runtime.instrumentation
+        ipex.cpu.runtime.reset_runtime_metrics()
+        ipex.cpu.runtime.enable_instrumentation()
+        try:
+            metrics = [
+                instrumentation._get_task_metrics(name, [0, 1])
+                for name in ["stream_0", "stream_1"]
+            ]
+            submit_times = [m.on_submit() for m in metrics]
+            time.sleep(0.2)
+            for m, submit_time in zip(metrics, submit_times):
+                m.on_complete(submit_time, False)
+        finally:
+            ipex.cpu.runtime.disable_instrumentation()
+        runtime_metrics = ipex.cpu.runtime.get_runtime_metrics()
+        pool_metrics = runtime_metrics["cpu_pools"][(0, 1)]
+        self.assertGreaterEqual(pool_metrics["busy_seconds"], 0.2)
+        self.assertLessEqual(
+            pool_metrics["busy_seconds"], runtime_metrics["elapsed_seconds"]
+        )
+        self.assertLessEqual(pool_metrics["utilization"], 1)
+        ipex.cpu.runtime.reset_runtime_metrics()
+
 
 class TestMultiStreamModule(TestCase):
     @unittest.skipIf(
@@ -471,6 +578,373 @@ class TestMultiStreamModule(TestCase):
         self.assertEqual(y_runtime2[1].size(0), 1)
         self.assertEqual(y_runtime2[2].size(0), 1)
 
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_dynamic_batcher(self):
+        model = SimpleNet()
+        model.eval()
+        num_requests = 16
+        inputs = [torch.rand(1, 64, 3, 3) for _ in range(num_requests)]
+        # Calculate the reference result
+        refs = [model(x) for x in inputs]
+
+        cpu_pool = ipex.cpu.runtime.CPUPool(node_id=0)
+        multi_stream_model = ipex.cpu.runtime.MultiStreamModule(
+            model, num_streams=2, cpu_pool=cpu_pool
+        )
+        with ipex.cpu.runtime.DynamicBatcher(
+            multi_stream_model, max_batch_size=8, max_latency_ms=50
+        ) as batcher:
+            outputs = [None] * num_requests
+
+            def request(i):
+                outputs[i] = batcher(inputs[i])
+
+            threads = [
+                threading.Thread(target=request, args=(i,))
+                for i in range(num_requests)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            stats = batcher.stats()
+
+        for y, y_runtime in zip(refs, outputs):
+            self.assertEqual(y, y_runtime)
+        self.assertEqual(stats["num_requests"], num_requests)
+        self.assertEqual(stats["num_samples"], num_requests)
+        self.assertLess(stats["num_batches"], num_requests)
+
+    def test_dynamic_batcher_kwargs_only(self):
+        model = SimpleNet()
+        model.eval()
+        num_requests = 4
+        inputs = [torch.rand(1, 64, 3, 3) for _ in range(num_requests)]
+        refs = [model(x) for x in inputs]
+
+        # The requests give fewer positional args than the hint covers
+        with ipex.cpu.runtime.DynamicBatcher(
+            model,
+            max_batch_size=num_requests,
+            max_latency_ms=1000,
+            input_split_hint=ipex.cpu.runtime.MultiStreamModuleHint(0, x=0),
+        ) as batcher:
+            futures = [batcher.submit(x=x) for x in inputs]
+            outputs = [future.result() for future in futures]
+            stats = batcher.stats()
+
+        for y, y_runtime in zip(refs, outputs):
+            self.assertEqual(y, y_runtime)
+        self.assertEqual(stats["num_batches"], 1)
+
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_multi_stream_module_forward_async(self):
+        model = SimpleNet()
+        model.eval()
+        inputs = [torch.rand(batch_size, 64, 3, 3) for batch_size in [8, 3, 1]]
+        # Calculate the reference result
+        trace_model = torch.jit.trace(model, inputs[0])
+        refs = [trace_model(x) for x in inputs]
+
+        cpu_pool = ipex.cpu.runtime.CPUPool(node_id=0)
+        multi_stream_model = ipex.cpu.runtime.MultiStreamModule(
+            trace_model, num_streams=2, cpu_pool=cpu_pool
+        )
+
+        async def run():
+            # Concurrent requests in the same event loop
+            return await asyncio.gather(
+                *[multi_stream_model.forward_async(x) for x in inputs]
+            )
+
+        for y, y_runtime in zip(refs, asyncio.run(run())):
+            self.assertEqual(y, y_runtime)
+
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_multi_stream_module_adaptive_split(self):
+        model = SimpleNet()
+        model.eval()
+        num_streams = 2
+        batch_size = 16
+        x = torch.rand(batch_size, 64, 3, 3)
+        # Calculate the reference result
+        trace_model = torch.jit.trace(model, x)
+        y = trace_model(x)
+
+        cpu_pool = ipex.cpu.runtime.CPUPool(node_id=0)
+        multi_stream_model = ipex.cpu.runtime.MultiStreamModule(
+            trace_model,
+            num_streams=num_streams,
+            cpu_pool=cpu_pool,
+            adaptive_split=True,
+        )
+        for _ in range(3):
+            y_runtime = multi_stream_model(x)
+            self.assertEqual(y, y_runtime)
+            stats = multi_stream_model.get_stream_stats()
+            self.assertEqual(sum(stats["split_sizes"]), batch_size)
+            self.assertEqual(len(stats["split_sizes"]), num_streams)
+            self.assertTrue(all(size >= 1 for size in stats["split_sizes"]))
+            self.assertGreaterEqual(stats["imbalance"], 1.0)
+        self.assertTrue(all(t > 0 for t in stats["throughput"]))
+
+        # Batch size less than the stream number splits as the even mode
+        y_runtime = multi_stream_model(x[:1])
+        self.assertEqual(y[:1], y_runtime)
+        self.assertEqual(multi_stream_model.get_stream_stats()["split_sizes"], [1])
+
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_multi_stream_module_preallocate_output(self):
+        model = SimpleNet()
+        model.eval()
+        batch_size = 8
+        x = torch.rand(batch_size, 64, 3, 3)
+        x2 = torch.rand(batch_size, 64, 3, 3)
+        # Calculate the reference result
+        trace_model = torch.jit.trace(model, x)
+        y = trace_model(x)
+        y2 = trace_model(x2)
+
+        cpu_pool = ipex.cpu.runtime.CPUPool(node_id=0)
+        multi_stream_model = ipex.cpu.runtime.MultiStreamModule(
+            trace_model, num_streams=2, cpu_pool=cpu_pool, preallocate_output=True
+        )
+        y_runtime = multi_stream_model(x)
+        self.assertEqual(y, y_runtime)
+        # The output of the same split sizes is written in place
+        y_runtime2 = multi_stream_model(x2)
+        self.assertEqual(y2, y_runtime2)
+        self.assertEqual(y_runtime.data_ptr(), y_runtime2.data_ptr())
+        # Another batch size gets its own output
+        y_runtime3 = multi_stream_model(x[:3])
+        self.assertEqual(y[:3], y_runtime3)
+        self.assertNotEqual(y_runtime.data_ptr(), y_runtime3.data_ptr())
+
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_tune_num_streams(self):
+        model = SimpleNet()
+        model.eval()
+        x = torch.rand(8, 64, 3, 3)
+        trace_model = torch.jit.trace(model, x)
+        cpu_pool = ipex.cpu.runtime.CPUPool(core_ids=[0, 1, 2, 3])
+
+        num_streams, report = ipex.cpu.runtime.tune_num_streams(
+            trace_model,
+            cpu_pool,
+            x,
+            num_iters=3,
+            num_warmup_iters=1,
+            return_report=True,
+        )
+        self.assertEqual([r["num_streams"] for r in report["results"]], [1, 2, 4])
+        self.assertIn(num_streams, [1, 2, 4])
+        self.assertEqual(report["batch_size"], 8)
+        # The decision is cached
+        self.assertEqual(
+            ipex.cpu.runtime.tune_num_streams(
+                trace_model, cpu_pool, x, num_iters=3, num_warmup_iters=1
+            ),
+            num_streams,
+        )
+        # The decision is not reused with the other arguments of MultiStreamModule
+        _, report_no_concat = ipex.cpu.runtime.tune_num_streams(
+            trace_model,
+            cpu_pool,
+            x,
+            num_iters=3,
+            num_warmup_iters=1,
+            return_report=True,
+            concat_output=False,
+        )
+        self.assertIsNot(report_no_concat, report)
+
+        # Tuned by MultiStreamModule
+        multi_stream_model = ipex.cpu.runtime.MultiStreamModule(
+            trace_model, num_streams="TUNE", cpu_pool=cpu_pool, sample_input=x
+        )
+        self.assertIn(multi_stream_model.get_stream_number(), [1, 2, 4])
+        with torch.no_grad():
+            self.assertEqual(trace_model(x), multi_stream_model(x))
+
+        # No candidate meets the SLA, the one with the lowest latency is selected
+        with self.assertWarnsRegex(UserWarning, "latency SLA"):
+            num_streams, report = ipex.cpu.runtime.tune_num_streams(
+                trace_model,
+                cpu_pool,
+                x,
+                candidates=[1, 2],
+                latency_sla_ms=1e-6,
+                num_iters=3,
+                num_warmup_iters=1,
+                return_report=True,
+            )
+        best = min(report["results"], key=lambda r: r["p95_latency_ms"])
+        self.assertEqual(num_streams, best["num_streams"])
+
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_multi_stream_module_numa_weight_replicas(self):
+        model = SimpleNet()
+        model.eval()
+        x = torch.rand(8, 64, 3, 3)
+        trace_model = torch.jit.trace(model, x)
+        y = trace_model(x)
+        weight_bytes = model.conv.weight.numel() * model.conv.weight.element_size()
+
+        # Default CPUPool has all the cores of the process, which may cross nodes
+        cpu_pool = ipex.cpu.runtime.CPUPool()
+        multi_stream_model = ipex.cpu.runtime.MultiStreamModule(
+            trace_model, num_streams=2, cpu_pool=cpu_pool, numa_weight_replicas=True
+        )
+        self.assertEqual(y, multi_stream_model(x))
+        stats = multi_stream_model.get_weight_replica_stats()
+        streams = sorted(s for node in stats["nodes"].values() for s in node["streams"])
+        self.assertEqual(streams, [0, 1])
+        num_replicas = sum(node["replicated"] for node in stats["nodes"].values())
+        self.assertEqual(len(stats["nodes"]) - 1, num_replicas)
+        self.assertEqual(stats["replica_bytes"], num_replicas * weight_bytes)
+
+        # No replica out of the memory budget
+        if num_replicas:
+            with self.assertWarnsRegex(UserWarning, "memory budget"):
+                multi_stream_model = ipex.cpu.runtime.MultiStreamModule(
+                    trace_model,
+                    num_streams=2,
+                    cpu_pool=cpu_pool,
+                    numa_weight_replicas=True,
+                    weight_replica_memory_budget=0,
+                )
+            self.assertEqual(y, multi_stream_model(x))
+            stats = multi_stream_model.get_weight_replica_stats()
+            self.assertEqual(stats["replica_bytes"], 0)
+
+
+class TestPipelineModule(TestCase):
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_pipeline_module(self):
+        model = torch.nn.Sequential(
+            torch.nn.Conv2d(64, 64, (3, 3), padding=(1, 1)),
+            torch.nn.ReLU(),
+            torch.nn.Conv2d(64, 128, (3, 3), stride=(2, 2), padding=(1, 1)),
+            torch.nn.Flatten(),
+        )
+        model.eval()
+        x = torch.rand(8, 64, 3, 3)
+        # Calculate the reference result
+        y = model(x)
+
+        cpu_pools = [
+            ipex.cpu.runtime.CPUPool(core_ids=[0]),
+            ipex.cpu.runtime.CPUPool(core_ids=[1]),
+        ]
+        # Split nn.Sequential into stages
+        pipeline_model = ipex.cpu.runtime.PipelineModule(
+            model, cpu_pools, num_micro_batches=4
+        )
+        # The stages are registered as submodules
+        self.assertEqual(
+            len(list(pipeline_model.parameters())), len(list(model.parameters()))
+        )
+        self.assertEqual(
+            list(pipeline_model.state_dict().keys()),
+            [
+                "stages.0.0.weight",
+                "stages.0.0.bias",
+                "stages.1.0.weight",
+                "stages.1.0.bias",
+            ],
+        )
+        with torch.no_grad():
+            y_runtime = pipeline_model(x)
+        self.assertEqual(y, y_runtime)
+        stats = pipeline_model.get_stage_stats()
+        self.assertEqual(
+            [stage["num_micro_batches"] for stage in stats["stages"]], [4, 4]
+        )
+        self.assertIn(stats["bottleneck_stage"], [0, 1])
+
+        # Traced stages
+        stages = [
+            torch.jit.trace(model[:2], x),
+            torch.jit.trace(model[2:], model[:2](x)),
+        ]
+        pipeline_model = ipex.cpu.runtime.PipelineModule(
+            stages, cpu_pools, num_micro_batches=16
+        )
+        self.assertEqual(y, pipeline_model(x))
+        # The micro-batches are no more than the batch size
+        self.assertEqual(
+            pipeline_model.get_stage_stats()["stages"][0]["num_micro_batches"], 8
+        )
+
+
+class TestModelScheduler(TestCase):
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_model_scheduler(self):
+        model = SimpleNet()
+        model.eval()
+        model2 = SimpleNet()
+        model2.eval()
+        x = torch.rand(4, 64, 3, 3)
+        trace_model = torch.jit.trace(model, x)
+        trace_model2 = torch.jit.trace(model2, x)
+        y = trace_model(x)
+        y2 = trace_model2(x)
+
+        cpu_pools = [
+            ipex.cpu.runtime.CPUPool(core_ids=[0]),
+            ipex.cpu.runtime.CPUPool(core_ids=[1]),
+        ]
+        with ipex.cpu.runtime.ModelScheduler(cpu_pools) as scheduler:
+            scheduler.register("model", trace_model)
+            scheduler.register("model2", trace_model2, priority=1)
+            futures = [scheduler.submit("model", x) for _ in range(8)]
+            futures2 = [scheduler.submit("model2", x) for _ in range(8)]
+            for future in futures:
+                self.assertEqual(y, future.result())
+            for future in futures2:
+                self.assertEqual(y2, future.result())
+            self.assertEqual(y, scheduler("model", x))
+            stats = scheduler.stats()
+
+        self.assertEqual(stats["models"]["model"]["completed"], 9)
+        self.assertEqual(stats["models"]["model2"]["completed"], 8)
+        self.assertEqual(stats["models"]["model"]["queued"], 0)
+        self.assertEqual(sum(stats["pool_runs"]), 17)
+        with self.assertRaises(RuntimeError):
+            scheduler.submit("model", x)
+
 
 class TestModuleMultiStreamModuleHint(TestCase):
     # For the inputs format which can't be jit.trace
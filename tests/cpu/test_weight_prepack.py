@@ -1,5 +1,6 @@
 import unittest
 import itertools
+import threading
 import copy
 import os
 import time
@@ -879,6 +880,178 @@ class TestPrepackCases(TestCase):
         model = torchvision.models.resnet.resnext50_32x4d(pretrained=False)
         self._test_imagenet_model(model)
 
+    def test_parallel_prepack(self):
+        class M(torch.nn.Module):
+            def __init__(self):
+                super(M, self).__init__()
+                self.conv = torch.nn.Conv2d(3, 8, kernel_size=3)
+                self.deconv = torch.nn.ConvTranspose2d(8, 8, kernel_size=3)
+                self.linears = torch.nn.Sequential(
+                    *[torch.nn.Linear(64, 64) for _ in range(8)]
+                )
+
+            def forward(self, x):
+                x = self.deconv(self.conv(x))
+                return self.linears(x.reshape(x.size(0), -1)[:, :64])
+
+        x = torch.randn(2, 3, 10, 10)
+        for is_training in [True, False]:
+            model = M().train(is_training)
+            num_threads = torch.get_num_threads()
+            outputs = []
+            for num_workers in [1, 4]:
+                m = copy.deepcopy(model)
+                if is_training:
+                    optimizer = SGD(m.parameters(), lr=0.1)
+                    m, _ = ipex.optimize(
+                        m,
+                        optimizer=optimizer,
+                        weights_prepack_num_workers=num_workers,
+                    )
+                else:
+                    m = ipex.optimize(m, weights_prepack_num_workers=num_workers)
+                self.assertEqual(torch.get_num_threads(), num_threads)
+                self.assertEqual(
+                    list(m.weight_prepack_timing.keys()),
+                    ["conv", "deconv"] + ["linears.%d" % i for i in range(8)],
+                )
+                self.assertTrue(
+                    isinstance(m.conv, ipex.nn.utils._weight_prepack._IPEXConv2d)
+                )
+                for linear in m.linears:
+                    self.assertTrue(
+                        isinstance(linear, ipex.nn.utils._weight_prepack._IPEXLinear)
+                    )
+                with torch.no_grad():
+                    outputs.append(m(x))
+            self.assertEqual(outputs[0], outputs[1])
+
+    def test_lazy_prepack(self):
+        class M(torch.nn.Module):
+            def __init__(self):
+                super(M, self).__init__()
+                self.conv = torch.nn.Conv2d(
+                    3, 8, kernel_size=3, padding=1, padding_mode="reflect"
+                )
+                self.linear = torch.nn.Linear(8, 16)
+                self.unused_head = torch.nn.Linear(16, 16)
+
+            def forward(self, x):
+                x = self.conv(x).mean(dim=(2, 3))
+                return self.linear(x)
+
+        x = torch.randn(2, 3, 10, 10)
+        model = M().eval()
+        ref_state = copy.deepcopy(model.state_dict())
+        eager_m = ipex.optimize(model)
+        lazy_m = ipex.optimize(model, lazy_weights_prepack=True)
+        for name in ["conv", "linear", "unused_head"]:
+            self.assertTrue(getattr(lazy_m, name).ctx is None)
+        # the weights are not prepacked before the first forward
+        self.assertEqual(lazy_m.state_dict(), ref_state)
+        with self.assertRaisesRegex(RuntimeError, "should be run in eager mode"):
+            torch.jit.trace(lazy_m, x)
+
+        # concurrent first forwards prepack each module only once
+        threads_num = 4
+        outputs = [None] * threads_num
+
+        def run(i):
+            with torch.no_grad():
+                outputs[i] = lazy_m(x)
+
+        threads = [
+            threading.Thread(target=run, args=(i,)) for i in range(threads_num)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertTrue(lazy_m.conv.ctx is not None)
+        self.assertTrue(lazy_m.linear.ctx is not None)
+        self.assertTrue(lazy_m.unused_head.ctx is None)
+        self.assertEqual(lazy_m.conv.input_shape, (2, 3, 12, 12))
+        with torch.no_grad():
+            ref = eager_m(x)
+            for out in outputs:
+                self.assertEqual(out, ref)
+            traced_m = torch.jit.trace(lazy_m, x)
+            self.assertEqual(traced_m(x), ref)
+        self.assertEqual(lazy_m.state_dict(), ref_state)
+
+        # lazy prepack is disabled for training
+        train_m = M().train()
+        optimizer = SGD(train_m.parameters(), lr=0.1)
+        with self.assertWarnsRegex(UserWarning, "lazy_weights_prepack only works"):
+            train_m, _ = ipex.optimize(
+                train_m, optimizer=optimizer, lazy_weights_prepack=True
+            )
+        self.assertTrue(train_m.conv.ctx is not None)
+
+    def test_prepack_variants(self):
+        class M(torch.nn.Module):
+            def __init__(self):
+                super(M, self).__init__()
+                self.conv = torch.nn.Conv2d(3, 8, kernel_size=3)
+                self.linear = torch.nn.Linear(8, 16)
+
+            def forward(self, x):
+                x = self.conv(x).mean(dim=(2, 3))
+                return self.linear(x)
+
+        model = M().eval()
+        sample_inputs = [torch.randn(bs, 3, 10, 10) for bs in [1, 16, 128]]
+        opt_m = ipex.optimize(
+            model, sample_inputs=sample_inputs, auto_kernel_selection=True
+        )
+        variants = opt_m.prepack_variants
+        self.assertEqual(opt_m.linear.batch_size_collapsed, 1)
+        self.assertEqual(opt_m.conv.prepack_input_shape, (1, 3, 10, 10))
+        # 2 variants for each of conv and linear
+        self.assertEqual(variants.stats()["variants"], 4)
+        self.assertEqual(variants.stats()["misses"], 4)
+        with torch.no_grad():
+            for bs in [1, 12, 16, 100, 128]:
+                x = torch.randn(bs, 3, 10, 10)
+                self.assertEqual(opt_m(x), model(x))
+        stats = variants.stats()
+        self.assertEqual(stats["variants"], 4)
+        self.assertEqual(stats["misses"], 4)
+        # conv only dispatches for bs 16 and 128, linear for 12, 16, 100 and 128
+        self.assertEqual(stats["hits"], 6)
+
+        # only one variant fits into the budget
+        budget = model.linear.weight.numel() * model.linear.weight.element_size()
+        opt_m = ipex.optimize(
+            model,
+            sample_inputs=sample_inputs,
+            auto_kernel_selection=True,
+            prepack_memory_budget=budget,
+        )
+        variants = opt_m.prepack_variants
+        # the conv weight exceeds the budget, the 2 linear variants evict each other
+        self.assertEqual(variants.stats()["variants"], 1)
+        self.assertEqual(variants.stats()["evictions"], 1)
+        self.assertLessEqual(variants.stats()["memory_used"], budget)
+        with torch.no_grad():
+            for bs in [16, 128, 16]:
+                x = torch.randn(bs, 3, 10, 10)
+                self.assertEqual(opt_m(x), model(x))
+        self.assertEqual(variants.stats()["variants"], 1)
+        self.assertEqual(variants.stats()["evictions"], 4)
+
+        # variants are dropped on loading weights
+        opt_m.load_state_dict(model.state_dict())
+        self.assertEqual(variants.stats()["variants"], 0)
+
+        # variants are prepacked again after copying
+        copied_m = copy.deepcopy(opt_m)
+        self.assertEqual(copied_m.prepack_variants.stats()["variants"], 0)
+        with torch.no_grad():
+            x = torch.randn(16, 3, 10, 10)
+            self.assertEqual(copied_m(x), model(x))
+        self.assertEqual(copied_m.prepack_variants.stats()["variants"], 1)
+
     def test_blas_backend(self):
         class L(torch.nn.Module):
             def __init__(self, in_f, out_f, bias):